@@ -1,7 +1,13 @@
+import os
 from django.contrib import admin
+from django.http import FileResponse, Http404
+from django.shortcuts import get_object_or_404
+from django.urls import path, reverse
+from django.utils.html import format_html
 from import_export import resources
 from import_export.admin import ImportExportModelAdmin
-from .models import APIKey, Session, PageView, Event, DailyMetric, DiagnosticResponse
+from .models import APIKey, Session, PageView, Event, DailyMetric, DiagnosticResponse, ExportJob, SlowQuery
+from .admin_utils import LargeTableAdminMixin, RollingDateFieldListFilter, TrigramSearchMixin
 
 
 # Resources define which fields to import/export
@@ -60,17 +66,27 @@ class DailyMetricResource(resources.ModelResource):
 @admin.register(APIKey)
 class APIKeyAdmin(ImportExportModelAdmin):
     resource_class = APIKeyResource
-    list_display = ['name', 'domain', 'is_active', 'created_at']
-    list_filter = ['is_active', 'created_at']
+    list_display = ['name', 'domain', 'is_active', 'retention_days', 'shard', 'created_at']
+    list_filter = ['is_active', 'shard', 'created_at']
     search_fields = ['name', 'domain', 'key']
 
+    def get_readonly_fields(self, request, obj=None):
+        # Moving a site's data between shards is done by move_api_key_shard
+        if obj is not None:
+            return [*super().get_readonly_fields(request, obj), 'shard']
+        return super().get_readonly_fields(request, obj)
+
 
 @admin.register(Session)
-class SessionAdmin(ImportExportModelAdmin):
+class SessionAdmin(TrigramSearchMixin, LargeTableAdminMixin, ImportExportModelAdmin):
     resource_class = SessionResource
     list_display = ['session_id', 'user', 'source', 'device_type', 'page_views_count', 'created_at']
-    list_filter = ['source', 'device_type', 'has_converted', 'created_at']
-    search_fields = ['session_id', 'ip_address', 'landing_page_url']
+    list_filter = ['source', 'device_type', 'has_converted', ('created_at', RollingDateFieldListFilter)]
+    list_select_related = ['user']
+    search_fields = ['landing_page_url', 'email']
+    uuid_search_fields = ['session_id']
+    ip_search_fields = ['ip_address']
+    search_help_text = 'Landing page URL or email (3+ characters), a session UUID, or an IP address'
     readonly_fields = ['session_id', 'created_at', 'last_activity_at']
     
     # Limit export to prevent memory issues
@@ -84,11 +100,14 @@ class SessionAdmin(ImportExportModelAdmin):
 
 
 @admin.register(PageView)
-class PageViewAdmin(ImportExportModelAdmin):
+class PageViewAdmin(TrigramSearchMixin, LargeTableAdminMixin, ImportExportModelAdmin):
     resource_class = PageViewResource
     list_display = ['session', 'sequence_number', 'page_path', 'time_on_page_seconds', 'viewed_at']
-    list_filter = ['viewed_at']
-    search_fields = ['page_url', 'page_title', 'session__session_id']
+    list_filter = [('viewed_at', RollingDateFieldListFilter)]
+    list_select_related = ['session']
+    search_fields = ['page_url', 'page_title']
+    uuid_search_fields = ['session__session_id']
+    search_help_text = 'Page URL or title (3+ characters), or a session UUID'
     readonly_fields = ['viewed_at']
     
     def get_export_queryset(self, request):
@@ -101,7 +120,7 @@ class PageViewAdmin(ImportExportModelAdmin):
 
 
 @admin.register(Event)
-class EventAdmin(ImportExportModelAdmin):
+class EventAdmin(TrigramSearchMixin, LargeTableAdminMixin, ImportExportModelAdmin):
     list_display = [
         'id',
         'event_type',
@@ -114,15 +133,16 @@ class EventAdmin(ImportExportModelAdmin):
     list_filter = [
         'event_type',
         'event_category',
-        'occurred_at',  # Changed from created_at
+        ('occurred_at', RollingDateFieldListFilter),  # Changed from created_at
     ]
+    list_select_related = ['session']
     search_fields = [
-        'event_type',
         'event_label',
-        'session__session_id',
         'session__email',
         'element_text',
     ]
+    uuid_search_fields = ['session__session_id']
+    search_help_text = 'Event label, element text or session email (3+ characters), or a session UUID'
     readonly_fields = ['metadata_display', 'occurred_at']  # Changed from created_at
     
     fieldsets = (
@@ -157,7 +177,7 @@ class EventAdmin(ImportExportModelAdmin):
     metadata_display.short_description = 'Metadata (JSON)'
     
     def get_queryset(self, request):
-        """Limit exports to last 30 days by default"""
+        """Show the last 30 days unless ?all=1; use Export Jobs for longer ranges"""
         qs = super().get_queryset(request)
         if not request.GET.get('all'):
             from django.utils import timezone
@@ -179,7 +199,7 @@ class DiagnosticResponseResource(resources.ModelResource):
 
 
 @admin.register(DiagnosticResponse)
-class DiagnosticResponseAdmin(ImportExportModelAdmin):
+class DiagnosticResponseAdmin(LargeTableAdminMixin, ImportExportModelAdmin):
     resource_class = DiagnosticResponseResource
     list_display = [
         'id',
@@ -192,8 +212,9 @@ class DiagnosticResponseAdmin(ImportExportModelAdmin):
     list_filter = [
         'diagnostic_name',
         'result_category',
-        'completed_at',
+        ('completed_at', RollingDateFieldListFilter),
     ]
+    list_select_related = ['session']
     search_fields = [
         'diagnostic_name',
         'session__session_id',
@@ -234,11 +255,143 @@ class DiagnosticResponseAdmin(ImportExportModelAdmin):
     metadata_display.short_description = 'Metadata (JSON)'
     
     def get_queryset(self, request):
-        """Limit exports to last 30 days by default"""
+        """Show the last 30 days unless ?all=1; use Export Jobs for longer ranges"""
         qs = super().get_queryset(request)
         if not request.GET.get('all'):
             from django.utils import timezone
             from datetime import timedelta
             thirty_days_ago = timezone.now() - timedelta(days=30)
             qs = qs.filter(completed_at__gte=thirty_days_ago)
-        return qs
\ No newline at end of file
+        return qs
+
+
+@admin.register(ExportJob)
+class ExportJobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'dataset', 'format', 'api_key', 'start_date', 'end_date',
+                    'status', 'progress', 'requested_by', 'created_at', 'download_link']
+    list_filter = ['status', 'dataset']
+    list_select_related = ['api_key', 'requested_by']
+    readonly_fields = ['status', 'progress', 'rows_total', 'rows_exported', 'error',
+                       'file_size', 'download_link', 'requested_by',
+                       'created_at', 'started_at', 'heartbeat_at', 'finished_at']
+
+    fieldsets = (
+        ('Export', {
+            'fields': ('dataset', 'format', 'api_key', 'start_date', 'end_date')
+        }),
+        ('Progress', {
+            'fields': ('status', 'progress', 'rows_total', 'rows_exported', 'error')
+        }),
+        ('Result', {
+            'fields': ('download_link', 'file_size')
+        }),
+        ('Timestamps', {
+            'fields': ('requested_by', 'created_at', 'started_at', 'heartbeat_at', 'finished_at')
+        }),
+    )
+
+    def get_readonly_fields(self, request, obj=None):
+        """Jobs are immutable once queued"""
+        if obj is not None:
+            return ['dataset', 'format', 'api_key', 'start_date', 'end_date'] + self.readonly_fields
+        return self.readonly_fields
+
+    def save_model(self, request, obj, form, change):
+        if not change:
+            obj.requested_by = request.user
+        super().save_model(request, obj, form, change)
+
+    def delete_model(self, request, obj):
+        self._delete_file(obj)
+        super().delete_model(request, obj)
+
+    def delete_queryset(self, request, queryset):
+        for obj in queryset:
+            self._delete_file(obj)
+        super().delete_queryset(request, queryset)
+
+    def _delete_file(self, obj):
+        if obj.file_path and os.path.exists(obj.file_path):
+            os.remove(obj.file_path)
+
+    def progress(self, obj):
+        return f"{obj.progress_percent}%"
+    progress.short_description = 'Progress'
+
+    def download_link(self, obj):
+        if obj.status != 'completed' or not obj.file_path:
+            return '-'
+        url = reverse('admin:analytics_exportjob_download', args=[obj.pk])
+        return format_html('<a href="{}">Download</a>', url)
+    download_link.short_description = 'File'
+
+    def get_urls(self):
+        urls = [
+            path('<int:object_id>/download/',
+                 self.admin_site.admin_view(self.download_view),
+                 name='analytics_exportjob_download'),
+        ]
+        return urls + super().get_urls()
+
+    def download_view(self, request, object_id):
+        """Stream the compressed export file"""
+        job = get_object_or_404(ExportJob, pk=object_id)
+        if not self.has_view_permission(request, job):
+            raise Http404
+        if job.status != 'completed' or not job.file_path or not os.path.exists(job.file_path):
+            raise Http404("Export file is not available")
+        return FileResponse(open(job.file_path, 'rb'), as_attachment=True,
+                            filename=os.path.basename(job.file_path))
+
+
+@admin.register(SlowQuery)
+class SlowQueryAdmin(admin.ModelAdmin):
+    """Read-only view of the slow query log; delete rows once a query has been fixed"""
+    list_display = ['short_sql', 'route', 'function', 'database', 'calls', 'avg_ms_display',
+                    'max_ms_display', 'has_seq_scan', 'last_seen_at']
+    list_filter = ['database', 'route', 'last_seen_at']
+    search_fields = ['normalized_sql', 'route', 'function', 'plan']
+    ordering = ['-total_ms']
+
+    fieldsets = (
+        ('Query', {
+            'fields': ('normalized_sql', 'sample_sql', 'sample_params', 'database', 'fingerprint')
+        }),
+        ('Call site', {
+            'fields': ('route', 'function')
+        }),
+        ('Timings', {
+            'fields': ('calls', 'total_ms', 'avg_ms_display', 'max_ms', 'last_ms', 'first_seen_at', 'last_seen_at')
+        }),
+        ('Plan', {
+            'fields': ('plan_display',)
+        }),
+    )
+
+    def get_readonly_fields(self, request, obj=None):
+        return [field.name for field in SlowQuery._meta.fields] + ['avg_ms_display', 'plan_display']
+
+    def has_add_permission(self, request):
+        return False
+
+    def short_sql(self, obj):
+        return obj.normalized_sql[:120]
+    short_sql.short_description = 'Query'
+
+    def avg_ms_display(self, obj):
+        return f"{obj.avg_ms:.1f} ms"
+    avg_ms_display.short_description = 'Avg'
+
+    def max_ms_display(self, obj):
+        return f"{obj.max_ms:.1f} ms"
+    max_ms_display.short_description = 'Max'
+    max_ms_display.admin_order_field = 'max_ms'
+
+    def has_seq_scan(self, obj):
+        return 'Seq Scan' in obj.plan
+    has_seq_scan.boolean = True
+    has_seq_scan.short_description = 'Seq scan'
+
+    def plan_display(self, obj):
+        return format_html('<pre style="white-space: pre-wrap">{}</pre>', obj.plan or '-')
+    plan_display.short_description = 'EXPLAIN'
@@ -0,0 +1,175 @@
+import ipaddress
+import json
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib import admin, messages
+from django.core.exceptions import EmptyResultSet
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.functional import cached_property
+
+
+def estimate_count(queryset):
+    """
+    Cheap row-count estimate from the Postgres planner
+
+    Unfiltered querysets use pg_class.reltuples (summed over partitions for
+    partitioned tables); filtered ones use the top-level row estimate from
+    EXPLAIN. Returns None if no estimate is available.
+    """
+    connection = connections[queryset.db]
+    with connection.cursor() as cursor:
+        if not queryset.query.where:
+            table = queryset.model._meta.db_table
+            cursor.execute(
+                """
+                SELECT COALESCE(SUM(GREATEST(c.reltuples, 0)), 0)::bigint
+                FROM pg_class c
+                WHERE c.oid = to_regclass(%s)
+                   OR c.oid IN (SELECT inhrelid FROM pg_inherits WHERE inhparent = to_regclass(%s))
+                """,
+                [table, table],
+            )
+            row = cursor.fetchone()
+            return int(row[0]) if row else None
+
+        try:
+            sql, params = queryset.order_by().query.get_compiler(queryset.db).as_sql()
+        except EmptyResultSet:
+            return 0
+        cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+        plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]['Plan']['Plan Rows'])
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that avoids exact COUNT(*) on large tables
+
+    Below ANALYTICS_ADMIN_EXACT_COUNT_LIMIT rows the exact count is used;
+    above it the planner estimate is shown instead.
+    """
+
+    @cached_property
+    def count(self):
+        estimate = estimate_count(self.object_list)
+        if estimate is None or estimate < settings.ANALYTICS_ADMIN_EXACT_COUNT_LIMIT:
+            return self.object_list.count()
+        return estimate
+
+
+class RollingDateFieldListFilter(admin.DateFieldListFilter):
+    """
+    Date filter with rolling windows instead of calendar periods
+
+    Every option is a single open-ended ``>=`` bound on the timestamp, rounded
+    to the hour so repeated clicks produce the same query.
+    """
+
+    WINDOWS = (
+        ('Past 24 hours', timedelta(hours=24)),
+        ('Past 7 days', timedelta(days=7)),
+        ('Past 30 days', timedelta(days=30)),
+        ('Past 90 days', timedelta(days=90)),
+    )
+
+    def __init__(self, field, request, params, model, model_admin, field_path):
+        super().__init__(field, request, params, model, model_admin, field_path)
+
+        now = timezone.now().replace(minute=0, second=0, microsecond=0)
+        self.links = (('Any date', {}),) + tuple(
+            (label, {self.lookup_kwarg_since: (now - window).isoformat()})
+            for label, window in self.WINDOWS
+        )
+
+
+class LargeTableAdminMixin:
+    """Changelist settings for tables too large for exact counts"""
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    show_facets = admin.ShowFacets.NEVER
+
+
+class TrigramSearchMixin:
+    """
+    Admin search backed by the pg_trgm GIN indexes on UPPER(column)
+
+    Each search field is matched in its own subquery and the matching ids are
+    combined with UNION, so every branch can use its own index (a single OR
+    across joined tables forces a sequential scan). Field prefixes follow the
+    admin convention: ``^`` for prefix match, ``=`` for exact match, plain for
+    substring match.
+
+    UUID and IP address terms skip the text search entirely and use exact
+    lookups on ``uuid_search_fields`` / ``ip_search_fields``.
+    """
+    uuid_search_fields = []
+    ip_search_fields = []
+    min_search_length = 3  # shorter terms produce no trigrams and cannot use the index
+
+    LOOKUP_PREFIXES = {'^': 'istartswith', '=': 'iexact'}
+
+    def get_search_results(self, request, queryset, search_term):
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+
+        exact = self._exact_search_q(search_term)
+        if exact is not None:
+            return queryset.filter(exact), False
+
+        if len(search_term) < self.min_search_length:
+            self.message_user(
+                request,
+                f"Search terms must be at least {self.min_search_length} characters "
+                f"(or a full session UUID).",
+                level=messages.WARNING,
+            )
+            return queryset.none(), False
+
+        matches = [self._field_matches(field, search_term) for field in self.get_search_fields(request)]
+        if not matches:
+            return queryset, False
+        ids = matches[0].union(*matches[1:]) if len(matches) > 1 else matches[0]
+        return queryset.filter(pk__in=ids), False
+
+    def _exact_search_q(self, search_term):
+        try:
+            value = uuid.UUID(search_term)
+            fields = self.uuid_search_fields
+        except ValueError:
+            try:
+                value = str(ipaddress.ip_address(search_term))
+                fields = self.ip_search_fields
+            except ValueError:
+                return None
+
+        if not fields:
+            return None
+        q = Q()
+        for field in fields:
+            q |= Q(**{field: value})
+        return q
+
+    def _field_matches(self, field, search_term):
+        """Primary keys of rows matching one search field, as a subquery"""
+        lookup = self.LOOKUP_PREFIXES.get(field[0], 'icontains')
+        field = field.lstrip('^=')
+
+        relation, _, related_field = field.partition('__')
+        if related_field:
+            # Search the related table on its own index, then follow the FK
+            related_model = self.model._meta.get_field(relation).related_model
+            related = related_model._default_manager.filter(**{f'{related_field}__{lookup}': search_term})
+            matches = self.model._default_manager.filter(**{f'{relation}__in': related.values('pk')})
+        else:
+            matches = self.model._default_manager.filter(**{f'{field}__{lookup}': search_term})
+
+        return matches.values('pk').order_by()
+
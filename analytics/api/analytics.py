@@ -1,9 +1,17 @@
+import heapq
+from datetime import date
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse
 from ninja import Router
 from typing import List
-from django.db.models import Count, Avg, Sum, Q
-from analytics.auth import JWTAuth
-from analytics.schemas import SessionOut, DashboardStats
-from analytics.models import Session, PageView, Event
+from analytics.auth import JWTAuth, StreamTokenAuth
+from analytics.schemas import SessionOut, DashboardStats, ErrorSchema, LiveVisitorsOut, StreamTokenOut
+from analytics.models import APIKey, Session
+from analytics.services.live import live_window
+from analytics.services.live_stream import stream, stream_token
+from analytics.services.sharding import fan_out
+from analytics.services.tiered import dashboard_totals, diagnostic_funnel
 
 from analytics.schemas import (
 
@@ -17,26 +25,34 @@ from analytics.models import (
 router = Router(tags=['Analytics'], auth=JWTAuth())
 
 
-@router.get('/dashboard', response=DashboardStats)
-def get_dashboard_stats(request):
+@router.get('/dashboard', response={200: DashboardStats, 400: ErrorSchema, 404: ErrorSchema})
+def get_dashboard_stats(request, start: date = None, end: date = None, api_key: str = None):
     """
     Get dashboard statistics (requires JWT authentication)
+
+    Ranges reaching back past an API key's retention are answered from its
+    archived day files (see prune_retention).
     """
-    sessions = Session.objects.all()
-    
-    total_sessions = sessions.count()
-    total_page_views = PageView.objects.count()
-    total_events = Event.objects.count()
-    total_conversions = sessions.filter(has_converted=True).count()
+    if start and end and start > end:
+        return 400, {'detail': 'start must be before end'}
+    api_key_id = None
+    if api_key:
+        api_key_id = APIKey.objects.filter(key=api_key).values_list('pk', flat=True).first()
+        if api_key_id is None:
+            return 404, {'detail': 'Unknown API key'}
+
+    totals = dashboard_totals(start=start, end=end, api_key_id=api_key_id)
+    total_sessions = totals['sessions']
+    total_conversions = totals['conversions']
     
-    avg_duration = sessions.aggregate(avg=Avg('duration_seconds'))['avg'] or 0
-    bounce_rate = (sessions.filter(is_bounce=True).count() / total_sessions * 100) if total_sessions > 0 else 0
+    avg_duration = totals['duration_sum'] / total_sessions if total_sessions > 0 else 0
+    bounce_rate = (totals['bounces'] / total_sessions * 100) if total_sessions > 0 else 0
     conversion_rate = (total_conversions / total_sessions * 100) if total_sessions > 0 else 0
     
     return {
         'total_sessions': total_sessions,
-        'total_page_views': total_page_views,
-        'total_events': total_events,
+        'total_page_views': totals['page_views'],
+        'total_events': totals['events'],
         'total_conversions': total_conversions,
         'avg_session_duration': int(avg_duration),
         'bounce_rate': round(bounce_rate, 2),
@@ -44,59 +60,104 @@ def get_dashboard_stats(request):
     }
 
 
+@router.get('/live', response={200: LiveVisitorsOut, 400: ErrorSchema, 404: ErrorSchema})
+def get_live_visitors(request, minutes: int = 5, api_key: str = None, pages: int = 20):
+    """
+    Sessions active in the last minutes, and the pages they are on
+
+    Read from the shared window the tracking endpoints update (see
+    analytics.services.live), not from the database: the answer costs the
+    same however many visitors there are.
+    """
+    window = live_window()
+    if window is None:
+        return 400, {'detail': 'Live visitors are turned off (ANALYTICS_LIVE_WINDOW_MINUTES)'}
+    if not 1 <= minutes <= window.window:
+        return 400, {'detail': f'minutes must be between 1 and {window.window}'}
+    api_key_id = None
+    if api_key:
+        api_key_id = APIKey.objects.filter(key=api_key).values_list('pk', flat=True).first()
+        if api_key_id is None:
+            return 404, {'detail': 'Unknown API key'}
+
+    active = window.active(api_key_id, minutes=minutes, pages=min(max(pages, 0), window.pages))
+    return {
+        'minutes': minutes,
+        'active_sessions': active['sessions'],
+        'pages': [{'page_path': page, 'active_sessions': count} for page, count in active['pages']],
+    }
+
+
+@router.post('/stream/token', response=StreamTokenOut)
+def get_stream_token(request):
+    """
+    Short-lived token opening /stream?token=, for EventSource (which cannot
+    send the Authorization header)
+    """
+    return {'token': stream_token(request.user.pk), 'expires_in': settings.ANALYTICS_LIVE_STREAM_TOKEN_MAX_AGE}
+
+
+@router.get('/stream', response={400: ErrorSchema, 404: ErrorSchema}, auth=[JWTAuth(), StreamTokenAuth()])
+async def stream_live(request, api_key: str = None, backfill: int = 0):
+    """
+    Server-Sent Events: a 'tick' every second with the page views, events,
+    conversions and sessions flagged as bots of the second before
+
+    Served by the ASGI application only (django_project.asgi). Browsers
+    authenticate with ?token= from POST /stream/token: once it has expired,
+    a stream that ended needs a new one to reconnect. A reconnecting browser
+    gets the seconds it missed (Last-Event-ID), a new one the last
+    ``backfill`` seconds, as far as ANALYTICS_LIVE_STREAM_SECONDS go back.
+    """
+    if not isinstance(request, ASGIRequest):
+        return 400, {'detail': 'The live stream is served by the ASGI application'}
+    window = live_window()
+    if window is None or not window.seconds:
+        return 400, {'detail': 'The live stream is turned off (ANALYTICS_LIVE_STREAM_SECONDS)'}
+    api_key_id = None
+    if api_key:
+        api_key_id = await APIKey.objects.filter(key=api_key).values_list('pk', flat=True).afirst()
+        if api_key_id is None:
+            return 404, {'detail': 'Unknown API key'}
+    last_event_id = request.headers.get('Last-Event-ID', '')
+    # isdigit() alone also takes e.g. '²', which int() rejects
+    last_event_id = int(last_event_id) if last_event_id.isascii() and last_event_id.isdigit() else None
+
+    response = StreamingHttpResponse(
+        stream(api_key_id, last_event_id, max(backfill, 0)),
+        content_type='text/event-stream',
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Or nginx would buffer the stream
+    return response
+
+
 @router.get('/sessions', response=List[SessionOut])
 def get_sessions(request, limit: int = 50, offset: int = 0):
     """
     Get recent sessions (requires JWT authentication)
+
+    With shards, each returns its newest offset + limit sessions and the
+    merged page is cut from those.
     """
-    sessions = Session.objects.select_related('api_key').order_by('-created_at')[offset:offset+limit]
-    return sessions
+    sessions = Session.objects.select_related('api_key').order_by('-created_at')
+    if not settings.ANALYTICS_SHARDS:
+        return sessions[offset:offset+limit]
 
-@router.get('/diagnostics', response={200: dict}, auth=JWTAuth())
-def get_diagnostic_analytics(request, diagnostic_name: str = None):
-    """Get diagnostic completion funnel"""
-    
-    filters = {'event_type__startswith': 'diagnostic_'}
-    if diagnostic_name:
-        filters['event_label'] = diagnostic_name
-    
-    events = Event.objects.filter(**filters)
-    
-    # Funnel analysis
-    funnel = {
-        'started': events.filter(event_type='diagnostic_question_shown', metadata__step_number=1).count(),
-        'completed_all_questions': events.filter(event_type='diagnostic_contact_form_shown').count(),
-        'submitted_email': events.filter(event_type='diagnostic_email_submitted').count(),
-        'skipped_email': events.filter(event_type='diagnostic_contact_skipped').count(),
-        'viewed_results': events.filter(event_type='diagnostic_results_viewed').count(),
-    }
-    
-    # Step-by-step dropoff
-    steps = []
-    for i in range(1, 10):  # Assuming max 10 questions
-        step_shown = events.filter(
-            event_type='diagnostic_question_shown',
-            metadata__step_number=i
-        ).count()
-        
-        step_completed = events.filter(
-            event_type='diagnostic_step_completed',
-            metadata__step_number=i
-        ).count()
-        
-        if step_shown == 0:
-            break
-            
-        steps.append({
-            'step_number': i,
-            'shown': step_shown,
-            'completed': step_completed,
-            'dropoff_rate': round((1 - step_completed / step_shown) * 100, 2) if step_shown > 0 else 0
-        })
-    
-    return {
-        'diagnostic_name': diagnostic_name,
-        'funnel': funnel,
-        'steps': steps,
-        'conversion_rate': round(funnel['submitted_email'] / funnel['started'] * 100, 2) if funnel['started'] > 0 else 0
-    }
\ No newline at end of file
+    pages = fan_out(lambda: list(sessions[:offset + limit]))
+    sessions = heapq.merge(*pages, key=lambda session: session.created_at, reverse=True)
+    return list(sessions)[offset:offset + limit]
+
+@router.get('/diagnostics', response={200: dict, 400: ErrorSchema, 404: ErrorSchema}, auth=JWTAuth())
+def get_diagnostic_analytics(request, diagnostic_name: str = None, start: date = None,
+                             end: date = None, api_key: str = None):
+    """Get diagnostic completion funnel (archived days included)"""
+    if start and end and start > end:
+        return 400, {'detail': 'start must be before end'}
+    api_key_id = None
+    if api_key:
+        api_key_id = APIKey.objects.filter(key=api_key).values_list('pk', flat=True).first()
+        if api_key_id is None:
+            return 404, {'detail': 'Unknown API key'}
+
+    return diagnostic_funnel(diagnostic_name=diagnostic_name, start=start, end=end, api_key_id=api_key_id)
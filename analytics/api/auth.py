@@ -1,6 +1,5 @@
 from ninja import Router
 from django.contrib.auth import authenticate
-from rest_framework_simplejwt.tokens import RefreshToken
 from analytics.schemas import LoginSchema, TokenSchema, RefreshSchema, ErrorSchema
 
 router = Router(tags=['Authentication'])
@@ -19,7 +18,8 @@ def login(request, payload: LoginSchema):
     if not user.is_active:
         return 403, {'detail': 'User account is disabled'}
     
-    # Generate JWT tokens
+    # Generate JWT tokens (simplejwt is imported on first use)
+    from rest_framework_simplejwt.tokens import RefreshToken
     refresh = RefreshToken.for_user(user)
     
     return 200, {
@@ -35,6 +35,8 @@ def refresh_token(request, payload: RefreshSchema):
     """
     Refresh access token using refresh token
     """
+    from rest_framework_simplejwt.tokens import RefreshToken
+
     try:
         refresh = RefreshToken(payload.refresh_token)
         
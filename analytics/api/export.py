@@ -0,0 +1,37 @@
+from datetime import date
+from django.http import StreamingHttpResponse
+from ninja import Router
+from analytics.auth import JWTAuth
+from analytics.routers import read_alias
+from analytics.schemas import ErrorSchema
+from analytics.services.exporter import EXPORT_DATASETS, EXPORT_FORMATS, stream_export
+
+router = Router(tags=['Export'], auth=JWTAuth())
+
+
+@router.get('/{dataset}', response={400: ErrorSchema, 404: ErrorSchema})
+def export_dataset(request, dataset: str, format: str = 'ndjson', start: date = None,
+                   end: date = None, api_key: str = None):
+    """
+    Stream a raw dataset (sessions, pageviews, events, diagnostics) as NDJSON or CSV
+    (requires JWT authentication)
+
+    Rows are read through a server-side cursor, so memory stays flat
+    regardless of the size of the date range. The body is streamed after the
+    request has returned, so the database chosen for the request is pinned.
+    """
+    if dataset not in EXPORT_DATASETS:
+        return 404, {'detail': f"Unknown dataset '{dataset}'"}
+    if format not in EXPORT_FORMATS:
+        return 400, {'detail': f"Unsupported format '{format}'"}
+    if start and end and start > end:
+        return 400, {'detail': 'start must be before end'}
+
+    response = StreamingHttpResponse(
+        stream_export(dataset, fmt=format, start=start, end=end, api_key=api_key,
+                      using=read_alias()),
+        content_type=EXPORT_FORMATS[format],
+    )
+    filename = '-'.join(str(part) for part in (dataset, start, end) if part)
+    response['Content-Disposition'] = f'attachment; filename="{filename}.{format}"'
+    return response
@@ -1,17 +1,25 @@
 # Keep all imports and helper function the same...
 # Just update the router endpoint decorators:
 
-from ninja import Router
+from typing import Any, List
+
+import pydantic
+from ninja import Body, Router
+from ninja.errors import ValidationError
+from django.conf import settings
+from django.http import HttpResponse
 from django.utils import timezone
 from analytics.auth import APIKeyAuth
 from analytics.schemas import PageViewSchema, EventSchema, ErrorSchema  # ADD ErrorSchema
 from analytics.models import Session, PageView, Event, APIKey
-from user_agents import parse
 from urllib.parse import urlparse
 import uuid
 
 from analytics.schemas import (
 
+    BATCH_EVENT_FIELDS,
+    BATCH_FORMAT_VERSION,
+    BatchEventSchema,
     CaptureEmailSchema,  # ADD
     DiagnosticAnswersSchema,  # ADD
 )
@@ -21,9 +29,82 @@ from analytics.models import (
 )
 
 from analytics.services.bot_detector import update_session_bot_score
+from analytics.services.live import record_activity, record_counts
 
 router = Router(tags=['Tracking'], auth=APIKeyAuth())
 
+BATCH_EVENTS = pydantic.TypeAdapter(List[BatchEventSchema])
+
+# Clients that don't read the result (e.g. navigator.sendBeacon, which cannot
+# set headers, hence the query parameter too) get an empty 204 instead
+MINIMAL = 'return=minimal'
+
+
+def wants_minimal(request) -> bool:
+    """Whether the client sent Prefer: return=minimal or ?return=minimal"""
+    return MINIMAL in request.headers.get('Prefer', '') or request.GET.get('return') == 'minimal'
+
+
+def minimal_response() -> HttpResponse:
+    response = HttpResponse(status=204)
+    del response['Content-Type']
+    response['Preference-Applied'] = MINIMAL
+    return response
+
+
+def parse_user_agent(user_agent_string: str) -> dict:
+    """Device type, browser and OS of a user agent, as Session fields"""
+    # Imported on first use: loading ua-parser's regex tables takes longer
+    # than the rest of the API together (see `manage.py bench_startup`)
+    from user_agents import parse
+
+    user_agent = parse(user_agent_string)
+    
+    # Determine device type
+    if user_agent.is_mobile:
+        device_type = 'mobile'
+    elif user_agent.is_tablet:
+        device_type = 'tablet'
+    elif user_agent.is_pc:
+        device_type = 'desktop'
+    else:
+        device_type = 'unknown'
+    
+    return {
+        'device_type': device_type,
+        'browser': user_agent.browser.family,
+        'browser_version': user_agent.browser.version_string,
+        'os': user_agent.os.family,
+        'os_version': user_agent.os.version_string,
+    }
+
+
+def classify_source(request_data: dict):
+    """
+    Traffic source of a new session from its referrer and UTM parameters
+    
+    Returns:
+        (referrer_domain, source) tuple
+    """
+    referrer_domain = None
+    source = 'direct'
+    if request_data.get('referrer_url'):
+        parsed = urlparse(request_data['referrer_url'])
+        referrer_domain = parsed.netloc
+        
+        # Determine source
+        if 'google' in referrer_domain:
+            source = 'organic'
+        elif any(x in referrer_domain for x in ['facebook', 'twitter', 'linkedin', 'instagram']):
+            source = 'social'
+        elif referrer_domain:
+            source = 'referral'
+    
+    if request_data.get('utm_source'):
+        source = 'paid' if 'cpc' in request_data.get('utm_medium', '') else 'other'
+    
+    return referrer_domain, source
+
 
 # Keep get_or_create_session function exactly the same...
 def get_or_create_session(api_key: APIKey, session_id_str: str, request_data: dict, ip_address: str, user_agent_string: str):
@@ -41,35 +122,8 @@ def get_or_create_session(api_key: APIKey, session_id_str: str, request_data: di
         
     except (ValueError, Session.DoesNotExist):
         # Create new session
-        user_agent = parse(user_agent_string)
-        
-        # Determine device type
-        if user_agent.is_mobile:
-            device_type = 'mobile'
-        elif user_agent.is_tablet:
-            device_type = 'tablet'
-        elif user_agent.is_pc:
-            device_type = 'desktop'
-        else:
-            device_type = 'unknown'
-        
-        # Parse referrer
-        referrer_domain = None
-        source = 'direct'
-        if request_data.get('referrer_url'):
-            parsed = urlparse(request_data['referrer_url'])
-            referrer_domain = parsed.netloc
-            
-            # Determine source
-            if 'google' in referrer_domain:
-                source = 'organic'
-            elif any(x in referrer_domain for x in ['facebook', 'twitter', 'linkedin', 'instagram']):
-                source = 'social'
-            elif referrer_domain:
-                source = 'referral'
-        
-        if request_data.get('utm_source'):
-            source = 'paid' if 'cpc' in request_data.get('utm_medium', '') else 'other'
+        user_agent = parse_user_agent(user_agent_string)
+        referrer_domain, source = classify_source(request_data)
         
         session = Session.objects.create(
             session_id=session_uuid if isinstance(session_uuid, uuid.UUID) else uuid.uuid4(),
@@ -86,11 +140,7 @@ def get_or_create_session(api_key: APIKey, session_id_str: str, request_data: di
             landing_page_title=request_data.get('page_title'),
             ip_address=ip_address,
             user_agent=user_agent_string,
-            device_type=device_type,
-            browser=user_agent.browser.family,
-            browser_version=user_agent.browser.version_string,
-            os=user_agent.os.family,
-            os_version=user_agent.os.version_string,
+            **user_agent,
             screen_resolution=request_data.get('screen_resolution'),
             language=request_data.get('language'),
         )
@@ -98,7 +148,7 @@ def get_or_create_session(api_key: APIKey, session_id_str: str, request_data: di
         return session
 
 
-@router.post('/pageview', response={200: dict})  # Simple dict response
+@router.post('/pageview', response={200: dict, 204: None})  # Simple dict response
 def track_pageview(request, payload: PageViewSchema):
     """
     Track a page view
@@ -138,12 +188,18 @@ def track_pageview(request, payload: PageViewSchema):
     # Update session metrics
     session.page_views_count = session.page_views.count()
     session.is_bounce = (session.page_views_count == 1)
-    session.save(update_fields=['page_views_count', 'is_bounce'])
+    session.save(update_fields=['page_views_count', 'is_bounce', 'last_activity_at'])
+    record_activity(session.api_key_id, session.session_id, page_view.page_path, page_views=1)
     
+    if wants_minimal(request):
+        # The client only needs the session id back if it was not the one it sent
+        if str(session.session_id) == payload.session_id:
+            return minimal_response()
+        return {'session_id': str(session.session_id)}
     return {'status': 'success', 'session_id': str(session.session_id)}
 
 
-@router.post('/email', response={200: dict, 404: ErrorSchema})
+@router.post('/email', response={200: dict, 204: None, 404: ErrorSchema})
 def capture_email(request, payload: CaptureEmailSchema):
     """
     Capture user email and contact information
@@ -155,11 +211,13 @@ def capture_email(request, payload: CaptureEmailSchema):
         return 404, {'detail': 'Session not found'}
     
     # BOT DETECTION - Calculate score based on honeypot and timing
+    was_bot = session.is_suspected_bot
     bot_score = update_session_bot_score(
         session=session,
         time_spent=payload.time_spent_seconds,
         honeypot_filled=payload.honeypot_filled
     )
+    record_counts(session.api_key_id, bot_flags=int(session.is_suspected_bot and not was_bot))
     
     # If high bot score, reject silently (don't tell bots they're detected)
     #if bot_score >= 70: 
@@ -179,17 +237,19 @@ def capture_email(request, payload: CaptureEmailSchema):
     if payload.phone:
         session.phone = payload.phone
     
-    session.save(update_fields=['email', 'name', 'company', 'phone'])
+    session.save(update_fields=['email', 'name', 'company', 'phone', 'last_activity_at'])
     
     # Also link to CustomUser if exists
     from accounts.models import CustomUser
     try:
         user = CustomUser.objects.get(email=payload.email)
         session.user = user
-        session.save(update_fields=['user'])
+        session.save(update_fields=['user', 'last_activity_at'])
     except CustomUser.DoesNotExist:
         pass  # User doesn't exist yet, that's OK
     
+    if wants_minimal(request):
+        return minimal_response()
     return {
         'status': 'success',
         'session_id': str(session.session_id),
@@ -197,7 +257,26 @@ def capture_email(request, payload: CaptureEmailSchema):
     }
 
 
-@router.post('/event', response={200: dict, 404: ErrorSchema})
+def event_fields(payload: EventSchema | BatchEventSchema) -> dict:
+    """Event model fields from a tracked event"""
+    return {
+        'event_type': payload.event_type,
+        'event_category': payload.event_category,
+        'event_label': payload.event_label,
+        'event_value': payload.event_value,
+        'element_id': payload.element_id,
+        'element_class': payload.element_class,
+        'element_text': payload.element_text,
+        'element_tag': payload.element_tag,
+        'page_url': payload.page_url,
+        'page_path': payload.page_path or urlparse(payload.page_url).path,
+        'time_since_page_load_ms': payload.time_since_page_load_ms,
+        'time_since_session_start_seconds': payload.time_since_session_start_seconds,
+        'metadata': payload.metadata,
+    }
+
+
+@router.post('/event', response={200: dict, 204: None, 404: ErrorSchema})
 def track_event(request, payload: EventSchema):
     """
     Track an event (CTA click, form submit, etc.)
@@ -206,6 +285,7 @@ def track_event(request, payload: EventSchema):
         session = Session.objects.get(session_id=payload.session_id)
     except Session.DoesNotExist:
         return 404, {'detail': 'Session not found'}
+    was_bot, was_converted = session.is_suspected_bot, session.has_converted
     
     # Update bot score if timing data provided
     if payload.time_spent_seconds is not None:
@@ -218,23 +298,7 @@ def track_event(request, payload: EventSchema):
     page_view = session.page_views.filter(page_url=payload.page_url).order_by('-viewed_at').first()
     
     # Create event
-    event = Event.objects.create(
-        session=session,
-        page_view=page_view,
-        event_type=payload.event_type,
-        event_category=payload.event_category,
-        event_label=payload.event_label,
-        event_value=payload.event_value,
-        element_id=payload.element_id,
-        element_class=payload.element_class,
-        element_text=payload.element_text,
-        element_tag=payload.element_tag,
-        page_url=payload.page_url,
-        page_path=payload.page_path or urlparse(payload.page_url).path,
-        time_since_page_load_ms=payload.time_since_page_load_ms,
-        time_since_session_start_seconds=payload.time_since_session_start_seconds,
-        metadata=payload.metadata,
-    )
+    event = Event.objects.create(session=session, page_view=page_view, **event_fields(payload))
     
     # Update session metrics
     session.events_count = session.events.count()
@@ -244,12 +308,17 @@ def track_event(request, payload: EventSchema):
         session.has_converted = True
         session.conversion_event = payload.event_label
     
-    session.save(update_fields=['events_count', 'has_converted', 'conversion_event'])
+    session.save(update_fields=['events_count', 'has_converted', 'conversion_event', 'last_activity_at'])
+    record_activity(session.api_key_id, session.session_id, event.page_path, events=1,
+                    conversions=int(session.has_converted and not was_converted),
+                    bot_flags=int(session.is_suspected_bot and not was_bot))
     
+    if wants_minimal(request):
+        return minimal_response()
     return {'status': 'success', 'event_id': event.id}
 
 
-@router.post('/diagnostic', response={200: dict, 404: ErrorSchema})
+@router.post('/diagnostic', response={200: dict, 204: None, 404: ErrorSchema})
 def submit_diagnostic(request, payload: DiagnosticAnswersSchema):
     """
     Submit diagnostic/quiz answers
@@ -276,10 +345,97 @@ def submit_diagnostic(request, payload: DiagnosticAnswersSchema):
     if not session.has_converted:
         session.has_converted = True
         session.conversion_event = f"diagnostic_{payload.diagnostic_name}"
-        session.save(update_fields=['has_converted', 'conversion_event'])
+        session.save(update_fields=['has_converted', 'conversion_event', 'last_activity_at'])
+        record_counts(session.api_key_id, conversions=1)
     
+    if wants_minimal(request):
+        return minimal_response()
     return {
         'status': 'success',
         'diagnostic_id': diagnostic.id,
         'session_id': str(session.session_id)
-    }
\ No newline at end of file
+    }
+
+
+def parse_event_batch(batch: list):
+    """
+    Validate a positional batch (see analytics.schemas.BATCH_EVENT_FIELDS)
+
+    Returns:
+        List of BatchEventSchema, one per event, with the session-level fields filled in
+    """
+    if len(batch) != 5 or batch[0] != BATCH_FORMAT_VERSION or not isinstance(batch[4], list):
+        raise ValidationError([{
+            'type': 'batch_format', 'loc': ['body', 'payload'],
+            'msg': f'Expected [{BATCH_FORMAT_VERSION}, api_key, session_id, page_url, [event, ...]]',
+        }])
+    _, api_key, session_id, page_url, rows = batch
+    if not 0 < len(rows) <= settings.ANALYTICS_TRACK_BATCH_MAX_EVENTS:
+        raise ValidationError([{
+            'type': 'batch_size', 'loc': ['body', 'payload', 4],
+            'msg': f'A batch holds 1 to {settings.ANALYTICS_TRACK_BATCH_MAX_EVENTS} events',
+        }])
+
+    events = []
+    for index, row in enumerate(rows):
+        if not isinstance(row, list) or len(row) > len(BATCH_EVENT_FIELDS):
+            raise ValidationError([{
+                'type': 'batch_event', 'loc': ['body', 'payload', 4, index],
+                'msg': f'Expected an array of up to {len(BATCH_EVENT_FIELDS)} values',
+            }])
+        event = {field: value for field, value in zip(BATCH_EVENT_FIELDS, row) if value is not None}
+        event.update(api_key=api_key, session_id=session_id)
+        event.setdefault('page_url', page_url)
+        events.append(event)
+    try:
+        return BATCH_EVENTS.validate_python(events)
+    except pydantic.ValidationError as exc:
+        raise ValidationError([
+            {**error, 'loc': ['body', 'payload', 4, *error['loc']]}
+            for error in exc.errors(include_url=False, include_context=False, include_input=False)
+        ])
+
+
+@router.post('/batch', response={200: dict, 204: None, 404: ErrorSchema})
+def track_batch(request, payload: List[Any] = Body(...)):
+    """
+    Track several events of one session in one request
+
+    The body is a positional array (see analytics.schemas.BATCH_EVENT_FIELDS),
+    in JSON or MessagePack, and like every tracking request may be gzip or
+    deflate compressed.
+    """
+    events = parse_event_batch(payload)
+    try:
+        session = Session.objects.get(session_id=events[0].session_id)
+    except Session.DoesNotExist:
+        return 404, {'detail': 'Session not found'}
+    was_bot, was_converted = session.is_suspected_bot, session.has_converted
+
+    # Scored once, on the longest time the batch reports
+    time_spent = [event.time_spent_seconds for event in events if event.time_spent_seconds is not None]
+    if time_spent:
+        update_session_bot_score(session=session, time_spent=max(time_spent))
+
+    page_views = {
+        page_url: session.page_views.filter(page_url=page_url).order_by('-viewed_at').first()
+        for page_url in {event.page_url for event in events}
+    }
+    created = Event.objects.bulk_create([
+        Event(session=session, page_view=page_views[event.page_url], **event_fields(event))
+        for event in events
+    ])
+
+    session.events_count = session.events.count()
+    conversions = [event for event in events if event.event_type == 'conversion']
+    if conversions:
+        session.has_converted = True
+        session.conversion_event = conversions[-1].event_label
+    session.save(update_fields=['events_count', 'has_converted', 'conversion_event', 'last_activity_at'])
+    record_activity(session.api_key_id, session.session_id, created[-1].page_path, events=len(created),
+                    conversions=int(session.has_converted and not was_converted),
+                    bot_flags=int(session.is_suspected_bot and not was_bot))
+
+    if wants_minimal(request):
+        return minimal_response()
+    return {'status': 'success', 'event_ids': [event.id for event in created]}
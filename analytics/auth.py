@@ -1,15 +1,20 @@
-from ninja.security import HttpBearer
+from ninja.security import APIKeyQuery, HttpBearer
+from django.db import DEFAULT_DB_ALIAS
 from django.http import HttpRequest
-from rest_framework_simplejwt.tokens import AccessToken
-from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
 from accounts.models import CustomUser
 from analytics.models import APIKey
+from analytics.routers import _shard_alias
+from analytics.services.live_stream import stream_token_user_id
 
 
 class JWTAuth(HttpBearer):
     """JWT Authentication for protected analytics endpoints"""
     
     def authenticate(self, request: HttpRequest, token: str):
+        # simplejwt (and DRF under it) is only needed once a token is checked
+        from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+        from rest_framework_simplejwt.tokens import AccessToken
+
         try:
             # Validate JWT token
             access_token = AccessToken(token)
@@ -26,6 +31,20 @@ class JWTAuth(HttpBearer):
             return None
 
 
+class StreamTokenAuth(APIKeyQuery):
+    """Stream token (see analytics.services.live_stream) from ?token=, for EventSource (which cannot set headers)"""
+    param_name = 'token'
+
+    def authenticate(self, request: HttpRequest, key: str):
+        user_id = stream_token_user_id(key) if key else None
+        if user_id is None:
+            return None
+        user = CustomUser.objects.filter(id=user_id, is_active=True).first()
+        if user is not None:
+            request.user = user
+        return user
+
+
 class APIKeyAuth:
     """API Key Authentication for public tracking endpoints"""
     
@@ -44,6 +63,8 @@ class APIKeyAuth:
         try:
             api_key_obj = APIKey.objects.get(key=api_key, is_active=True)
             request.api_key = api_key_obj
+            # Tracking queries for the rest of the request go to the key's shard
+            _shard_alias.set(api_key_obj.shard or DEFAULT_DB_ALIAS)
             return api_key_obj
         except APIKey.DoesNotExist:
             return None
\ No newline at end of file
@@ -0,0 +1,201 @@
+import threading
+
+from django.apps import apps
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, models
+from django.utils.functional import cached_property
+
+
+# Id used in lookups for names that have no dictionary entry yet: no row has
+# it, so filtering on an unknown name matches nothing
+UNKNOWN_ID = -1
+
+
+class DictionaryCache:
+    """
+    Process-wide name <-> id mapping for one dictionary table
+
+    Dictionary entries are never renamed or deleted, so cached pairs never
+    go stale. Tables flagged PRELOAD are read in full on first use; others
+    are cached one entry at a time, up to ANALYTICS_DICTIONARY_CACHE_SIZE.
+    Tables with MAX_ENTRIES stop growing there: new names are stored as
+    OVERFLOW_NAME instead.
+    """
+
+    def __init__(self, model_label: str):
+        self.model_label = model_label
+        self.ids = {}
+        self.names = {}
+        self.loaded = False
+        self.full = False
+        self.lock = threading.Lock()
+        # Lookups answered from / missing the cache, for metrics
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def model(self):
+        return apps.get_model(self.model_label)
+
+    def _remember(self, pk: int, name: str):
+        if len(self.ids) >= settings.ANALYTICS_DICTIONARY_CACHE_SIZE:
+            self.ids.clear()
+            self.names.clear()
+        self.ids[name] = pk
+        self.names[pk] = name
+
+    def _preload(self, using: str):
+        with self.lock:
+            if self.loaded:
+                return
+            if self.model.PRELOAD:
+                for pk, name in self.model.objects.using(using).values_list('pk', 'name'):
+                    self._remember(pk, name)
+            self.loaded = True
+
+    def reset(self, pairs=None):
+        """
+        Forget every cached entry. With ``pairs`` of (id, name), cache those
+        instead, as if the table had been preloaded.
+        """
+        with self.lock:
+            self.ids.clear()
+            self.names.clear()
+            self.full = False
+            self.loaded = pairs is not None
+            for pk, name in pairs or ():
+                self._remember(pk, name)
+
+    def snapshot(self) -> tuple:
+        """What restore() needs to put the cache back as it is now"""
+        with self.lock:
+            return dict(self.ids), dict(self.names), self.loaded, self.full
+
+    def restore(self, state: tuple):
+        with self.lock:
+            ids, names, self.loaded, self.full = state
+            self.ids, self.names = dict(ids), dict(names)
+
+    def _is_full(self, using: str) -> bool:
+        # Entries are never deleted, so a full table stays full. The last
+        # entry is kept for OVERFLOW_NAME.
+        if not self.full and self.model.MAX_ENTRIES is not None:
+            self.full = self.model.objects.using(using).count() >= self.model.MAX_ENTRIES - 1
+        return self.full
+
+    def id_for(self, name: str, create: bool = False, using: str = DEFAULT_DB_ALIAS):
+        """
+        Id of a dictionary entry, optionally creating it
+
+        Returns:
+            The id, or None if the entry does not exist and create is False
+        """
+        if not self.loaded:
+            self._preload(using)
+        pk = self.ids.get(name)
+        if pk is not None:
+            self.hits += 1
+            return pk
+
+        self.misses += 1
+        manager = self.model.objects.db_manager(using)
+        pk = manager.filter(name=name).values_list('pk', flat=True).first()
+        if pk is None:
+            if not create:
+                return None
+            if name != self.model.OVERFLOW_NAME and self._is_full(using):
+                return self.id_for(self.model.OVERFLOW_NAME, create=True, using=using)
+            pk = manager.get_or_create(name=name)[0].pk
+            if connections[using].in_atomic_block:
+                # The new entry rolls back with the caller's transaction, so
+                # it is only cached once it has been read back committed
+                return pk
+
+        self._remember(pk, name)
+        return pk
+
+    def name_for(self, pk: int, using: str = DEFAULT_DB_ALIAS):
+        if not self.loaded:
+            self._preload(using)
+        name = self.names.get(pk)
+        if name is not None:
+            self.hits += 1
+            return name
+
+        self.misses += 1
+        name = self.model.objects.using(using).filter(pk=pk).values_list('name', flat=True).first()
+        if name is not None:
+            self._remember(pk, name)
+        return name
+
+
+_caches = {}
+
+
+def dictionary_caches() -> list:
+    """Every dictionary cache created in this process"""
+    return list(_caches.values())
+
+
+def dictionary_cache(model_label: str) -> DictionaryCache:
+    """Shared cache for a dictionary model, e.g. 'analytics.EventType'"""
+    if model_label not in _caches:
+        _caches[model_label] = DictionaryCache(model_label)
+    return _caches[model_label]
+
+
+class DictionaryField(models.Field):
+    """
+    A string stored as the id of a row in a dictionary table
+
+    Model instances, values() and filters all see the string, exactly like a
+    CharField, while the row only stores a smallint/int id. Unknown strings
+    get a dictionary entry when first saved. Dictionary tables are only kept
+    on the primary, so rows on every shard and replica share the same ids.
+
+    Only equality lookups (exact, in, isnull) work: prefix and pattern
+    lookups cannot be answered from ids, so filter on a list of names instead.
+    """
+    description = "String stored as a dictionary id"
+
+    def __init__(self, dictionary, *args, **kwargs):
+        self.dictionary = dictionary
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        kwargs['dictionary'] = self.dictionary
+        return name, path, args, kwargs
+
+    @cached_property
+    def cache(self) -> DictionaryCache:
+        return dictionary_cache(self.dictionary)
+
+    def db_type(self, connection):
+        return apps.get_model(self.dictionary)._meta.pk.rel_db_type(connection)
+
+    def get_internal_type(self):
+        # What the Python value is: forms, serializers and exports treat it as text
+        return 'CharField'
+
+    def to_python(self, value):
+        if value is None or isinstance(value, str):
+            return value
+        return str(value)
+
+    def from_db_value(self, value, expression, connection):
+        if value is None:
+            return None
+        return self.cache.name_for(value)
+
+    def get_prep_value(self, value):
+        value = super().get_prep_value(value)
+        if value is None:
+            return None
+        pk = self.cache.id_for(self.to_python(value))
+        return UNKNOWN_ID if pk is None else pk
+
+    def get_db_prep_save(self, value, connection):
+        if value is None or hasattr(value, 'resolve_expression'):
+            return value
+        return self.cache.id_for(self.to_python(value), create=True)
@@ -0,0 +1,73 @@
+import json
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from analytics.services.benchmarks import BENCHMARKS, compare, load_results, run_suite
+
+
+class Command(BaseCommand):
+    help = (
+        "Microbenchmark the tracking hot paths (session lookup/creation, user agent parsing, "
+        "source classification, bot scoring, schema validation, response rendering). "
+        "Results can be saved as JSON and compared with an earlier run."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--bench', action='append', dest='benches',
+                            help="Only run this benchmark (repeatable, see --list)")
+        parser.add_argument('--list', action='store_true', help="List the benchmarks and exit")
+        parser.add_argument('--repeat', type=int, default=5,
+                            help="Timed repeats per benchmark; the median is reported (default: 5)")
+        parser.add_argument('--min-time', type=float, default=0.2,
+                            help="Minimum seconds per repeat, used to calibrate the call count (default: 0.2)")
+        parser.add_argument('--output', help="Write the results to this JSON file")
+        parser.add_argument('--compare', help="Compare with the results in this JSON file")
+        parser.add_argument('--threshold', type=float, default=10,
+                            help="Percent change reported as slower/faster with --compare (default: 10)")
+        parser.add_argument('--fail-on-regression', action='store_true',
+                            help="Exit with an error if any benchmark got slower than the threshold")
+
+    def handle(self, *args, **options):
+        if options['list']:
+            for name in BENCHMARKS:
+                self.stdout.write(name)
+            return
+
+        unknown = set(options['benches'] or ()) - set(BENCHMARKS)
+        if unknown:
+            raise CommandError(f"Unknown benchmark(s): {', '.join(sorted(unknown))}")
+        baseline = load_results(options['compare']) if options['compare'] else None
+
+        def log(name, result):
+            self.stdout.write(
+                f"{name:<32}{result['median_us']:>12.2f} us  (min {result['min_us']:.2f}, "
+                f"±{result['stdev_us']:.2f}, {result['number']} x {result['repeat']})"
+            )
+
+        results = run_suite(options['benches'], repeat=options['repeat'], min_time=options['min_time'], log=log)
+
+        if options['output']:
+            path = Path(options['output'])
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(json.dumps(results, indent=2))
+            self.stdout.write(self.style.SUCCESS(f"Wrote {path}"))
+
+        if baseline is None:
+            return
+
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f"Compared with {baseline.get('revision') or options['compare']}"
+        ))
+        rows = compare(baseline, results, threshold=options['threshold'] / 100)
+        styles = {'slower': self.style.ERROR, 'faster': self.style.SUCCESS}
+        for row in rows:
+            if row['change'] is None:
+                self.stdout.write(f"{row['name']:<32}{row['status']:>12}")
+                continue
+            line = (f"{row['name']:<32}{row['baseline_us']:>12.2f} -> {row['current_us']:.2f} us "
+                    f"({row['change']:+.1%}) {row['status']}")
+            self.stdout.write(styles.get(row['status'], str)(line))
+
+        if options['fail_on_regression'] and any(row['status'] == 'slower' for row in rows):
+            raise CommandError("Benchmarks got slower than the threshold")
@@ -0,0 +1,49 @@
+import json
+from pathlib import Path
+
+from django.core.management.base import BaseCommand
+
+from analytics.services.startup import STAGES, measure
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure worker startup in fresh interpreters: wall time of each stage (Django setup, WSGI "
+        "app, URLconf, first requests, admin) and the import time it spends per package and module."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=5,
+                            help="Fresh interpreters to run; medians are reported (default: 5)")
+        parser.add_argument('--top', type=int, default=10,
+                            help="Packages listed per stage, and modules overall (default: 10)")
+        parser.add_argument('--output', help="Write the results to this JSON file")
+
+    def handle(self, *args, **options):
+        results = measure(repeat=options['repeat'])
+        top = options['top']
+
+        total = sum(stage['seconds'] for stage in results['stages'].values())
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f"Startup stages (median of {options['repeat']}, {total * 1000:.0f} ms in total)"
+        ))
+        for name, _ in STAGES:
+            stage = results['stages'][name]
+            self.stdout.write(f"{name:<28}{stage['seconds'] * 1000:>10.1f} ms")
+            for package, ms in list(stage['packages'].items())[:top]:
+                self.stdout.write(f"    {package:<32}{ms:>10.1f} ms")
+
+        self.stdout.write(self.style.MIGRATE_HEADING("Import time per package, all stages"))
+        for package, ms in list(results['packages'].items())[:top]:
+            self.stdout.write(f"{package:<36}{ms:>10.1f} ms")
+
+        self.stdout.write(self.style.MIGRATE_HEADING("Slowest modules (self time, with their imports)"))
+        modules = sorted(results['modules'].items(), key=lambda item: -item[1]['self_ms'])
+        for module, timing in modules[:top]:
+            self.stdout.write(f"{module:<48}{timing['self_ms']:>10.1f} ms{timing['cumulative_ms']:>10.1f} ms")
+
+        if options['output']:
+            path = Path(options['output'])
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(json.dumps(results, indent=2))
+            self.stdout.write(self.style.SUCCESS(f"Wrote {path}"))
@@ -0,0 +1,59 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from analytics.services.index_audit import index_usage
+
+
+def _human_size(num_bytes):
+    for unit in ('B', 'kB', 'MB', 'GB'):
+        if num_bytes < 1024:
+            return f"{num_bytes:.0f} {unit}"
+        num_bytes /= 1024
+    return f"{num_bytes:.1f} TB"
+
+
+class Command(BaseCommand):
+    help = (
+        "Report per-index size, scan counts (pg_stat_user_indexes) and write "
+        "amplification, flagging unused, write-heavy and redundant indexes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--table', default='analytics_%',
+                            help="Table name LIKE pattern (default: analytics_%%)")
+        parser.add_argument('--json', action='store_true', help="Output JSON instead of a table")
+        parser.add_argument('--flagged', action='store_true', help="Only show flagged indexes")
+
+    def handle(self, *args, **options):
+        rows = index_usage(table_pattern=options['table'])
+        if options['flagged']:
+            rows = [row for row in rows if row['flags']]
+
+        if options['json']:
+            self.stdout.write(json.dumps(rows, indent=2, default=str))
+            return
+
+        header = f"{'index':<56} {'type':<6} {'size':>9} {'scans':>10} {'writes/scan':>12}  flags"
+        current_table = None
+        for row in rows:
+            if row['table_name'] != current_table:
+                current_table = row['table_name']
+                self.stdout.write('')
+                self.stdout.write(self.style.MIGRATE_HEADING(
+                    f"{current_table} ({row['indexes_on_table']} indexes, "
+                    f"{row['index_writes']} index-maintaining writes)"
+                ))
+                self.stdout.write(header)
+
+            writes_per_scan = '-' if row['writes_per_scan'] is None else row['writes_per_scan']
+            line = (
+                f"{row['index_name']:<56} {row['method']:<6} {_human_size(row['size_bytes']):>9} "
+                f"{row['scans']:>10} {writes_per_scan:>12}  {', '.join(row['flags'])}"
+            )
+            self.stdout.write(self.style.WARNING(line) if row['flags'] else line)
+
+        total = sum(row['size_bytes'] for row in rows)
+        unused = sum(row['size_bytes'] for row in rows if 'unused' in row['flags'])
+        self.stdout.write('')
+        self.stdout.write(f"Total index size: {_human_size(total)}, unused: {_human_size(unused)}")
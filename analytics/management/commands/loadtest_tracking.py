@@ -0,0 +1,84 @@
+import json
+import secrets
+
+from django.core.management.base import BaseCommand, CommandError
+
+from analytics.models import APIKey
+from analytics.services.loadtest import HTTPTransport, InProcessTransport, run_load
+
+
+class Command(BaseCommand):
+    help = (
+        "Replay realistic visitor sessions (page views, clicks, diagnostic, email) against "
+        "/api/track/* and report throughput, latency percentiles and queries per request. "
+        "Runs in-process against the configured database, or against a server with --base-url."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sessions', type=int, default=200,
+                            help="Visitor sessions to replay (default: 200)")
+        parser.add_argument('--concurrency', type=int, default=4,
+                            help="Visitors replayed at the same time (default: 4)")
+        parser.add_argument('--duration', type=float,
+                            help="Stop starting new sessions after this many seconds")
+        parser.add_argument('--base-url',
+                            help="Send requests to a running server (e.g. http://localhost:8000) "
+                                 "instead of in-process; queries per request are then not reported")
+        parser.add_argument('--api-key',
+                            help="Existing API key to track with (default: a temporary key)")
+        parser.add_argument('--keep-data', action='store_true',
+                            help="Keep the temporary API key and everything tracked with it")
+        parser.add_argument('--seed', type=int, help="Random seed, for repeatable journeys")
+        parser.add_argument('--json', action='store_true', help="Print the results as JSON")
+
+    def handle(self, *args, **options):
+        if options['sessions'] < 1 or options['concurrency'] < 1:
+            raise CommandError("--sessions and --concurrency must be at least 1")
+
+        temporary = None
+        key = options['api_key']
+        if key is None:
+            temporary = APIKey.objects.create(
+                key=f'loadtest-{secrets.token_hex(8)}', name='Load test', domain='loadtest.example.com',
+            )
+            key = temporary.key
+
+        if options['base_url']:
+            transport = HTTPTransport(key, options['base_url'])
+        else:
+            transport = InProcessTransport(key)
+
+        try:
+            results = run_load(
+                transport, options['sessions'], concurrency=options['concurrency'],
+                duration=options['duration'], seed=options['seed'],
+                log=self.stdout.write if options['verbosity'] > 1 else None,
+            )
+        finally:
+            if temporary is not None and not options['keep_data']:
+                temporary.delete()
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f"{results['sessions']} sessions, concurrency {results['concurrency']}, "
+            f"{results['seconds']:.1f}s ({'HTTP ' + options['base_url'] if options['base_url'] else 'in-process'})"
+        ))
+        self.stdout.write(f"{'endpoint':<14}{'requests':>9}{'errors':>8}{'req/s':>9}"
+                          f"{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'queries':>9}")
+        rows = [*results['endpoints'].items(), ('total', results['overall'])]
+        for endpoint, stats in rows:
+            self.stdout.write(
+                f"{endpoint:<14}{stats['requests']:>9}{stats['errors']:>8}{stats['throughput']:>9.1f}"
+                f"{self._number(stats['p50_ms']):>9}{self._number(stats['p95_ms']):>9}"
+                f"{self._number(stats['p99_ms']):>9}{self._number(stats['queries_per_request']):>9}"
+            )
+        if results['overall']['errors']:
+            self.stdout.write(self.style.ERROR(f"{results['overall']['errors']} requests failed"))
+
+    @staticmethod
+    def _number(value):
+        # None when no request completed
+        return '-' if value is None else f"{value:.1f}"
@@ -0,0 +1,60 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from analytics.routers import shard_aliases
+from analytics.services.partitions import (
+    PARTITIONED_TABLES, drop_partition, ensure_future_partitions, expired_partitions,
+    is_partitioned, list_partitions,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Create upcoming monthly partitions for page views and events, and optionally "
+        "drop partitions older than a cutoff. Schedule daily (e.g. from cron)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--months-ahead', type=int, default=3,
+                            help="Create partitions up to this many months ahead (default: 3)")
+        parser.add_argument('--drop-before', type=date.fromisoformat,
+                            help="Drop partitions that end on or before this date (YYYY-MM-DD)")
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Only report partitions that would be dropped")
+        parser.add_argument('--list', action='store_true',
+                            help="List existing partitions and exit")
+        parser.add_argument('--database', action='append', dest='databases',
+                            help="Only this database alias (repeatable, default: the primary and every shard)")
+
+    def handle(self, *args, **options):
+        for alias in options['databases'] or shard_aliases():
+            if len(shard_aliases()) > 1:
+                self.stdout.write(self.style.MIGRATE_HEADING(alias))
+            self.handle_database(alias, options)
+
+    def handle_database(self, using, options):
+        for table in PARTITIONED_TABLES:
+            if not is_partitioned(table, using=using):
+                raise CommandError(f"{table} is not partitioned; run migrations first")
+
+        if options['list']:
+            for table in PARTITIONED_TABLES:
+                for partition in list_partitions(table, using=using):
+                    self.stdout.write(
+                        f"{partition['name']}: {partition['lower']:%Y-%m-%d} -> {partition['upper']:%Y-%m-%d}"
+                    )
+            return
+
+        for name in ensure_future_partitions(months_ahead=options['months_ahead'], using=using):
+            self.stdout.write(self.style.SUCCESS(f"Created {name}"))
+
+        cutoff = options['drop_before']
+        if cutoff:
+            for table in PARTITIONED_TABLES:
+                for partition in expired_partitions(table, cutoff, using=using):
+                    if options['dry_run']:
+                        self.stdout.write(f"Would drop {partition['name']}")
+                        continue
+                    drop_partition(table, partition['name'], using=using)
+                    self.stdout.write(self.style.WARNING(f"Dropped {partition['name']}"))
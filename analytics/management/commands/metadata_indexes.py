@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from analytics.routers import shard_aliases
+from analytics.services.metadata import (
+    existing_index_keys, metadata_index_name, sync_metadata_indexes,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Create expression indexes on the Event.metadata keys listed in "
+        "ANALYTICS_METADATA_INDEX_KEYS, concurrently and partition by partition."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--key', action='append', dest='keys',
+                            help="Index this metadata key (repeatable, default: the configured keys)")
+        parser.add_argument('--drop-unlisted', action='store_true',
+                            help="Drop metadata key indexes that are no longer listed")
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Only report indexes that would be created or dropped")
+        parser.add_argument('--list', action='store_true',
+                            help="List existing metadata key indexes and exit")
+        parser.add_argument('--database', action='append', dest='databases',
+                            help="Only this database alias (repeatable, default: the primary and every shard)")
+
+    def handle(self, *args, **options):
+        for alias in options['databases'] or shard_aliases():
+            if len(shard_aliases()) > 1:
+                self.stdout.write(self.style.MIGRATE_HEADING(alias))
+            self.handle_database(alias, options)
+
+    def handle_database(self, using, options):
+        if options['list']:
+            for key in existing_index_keys(using=using):
+                self.stdout.write(f"{metadata_index_name(key)} (metadata -> '{key}')")
+            return
+
+        try:
+            created, dropped = sync_metadata_indexes(
+                keys=options['keys'], drop_unlisted=options['drop_unlisted'], dry_run=options['dry_run'],
+                using=using,
+            )
+        except ValueError as exc:
+            raise CommandError(str(exc))
+
+        dry_run = options['dry_run']
+        for name in created:
+            self.stdout.write(self.style.SUCCESS(f"{'Would create' if dry_run else 'Created'} {name}"))
+        for name in dropped:
+            self.stdout.write(self.style.WARNING(f"{'Would drop' if dry_run else 'Dropped'} {name}"))
+        if not created and not dropped:
+            self.stdout.write("Metadata indexes are up to date")
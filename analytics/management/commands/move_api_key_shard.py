@@ -0,0 +1,51 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+from analytics.models import APIKey
+from analytics.services.sharding import DEFAULT_GRACE_SECONDS, move_api_key
+
+
+class Command(BaseCommand):
+    help = (
+        "Move one API key's sessions, page views, events and diagnostic responses to "
+        "another shard while tracking keeps running. Safe to re-run after an interruption."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--api-key', type=int, required=True, help="API key id")
+        parser.add_argument('--to', required=True, dest='target',
+                            help=f"Target database alias ('{DEFAULT_DB_ALIAS}' for the primary)")
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help="Sessions copied per transaction (default: 1000)")
+        parser.add_argument('--grace', type=float, default=DEFAULT_GRACE_SECONDS,
+                            help="Seconds to wait after switching before the catch-up pass "
+                                 f"(default: {DEFAULT_GRACE_SECONDS})")
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Only report how many rows would be moved")
+
+    def handle(self, *args, **options):
+        target = options['target']
+        if target != DEFAULT_DB_ALIAS and target not in settings.ANALYTICS_SHARDS:
+            raise CommandError(f"Unknown shard '{target}' (configured: {', '.join(settings.ANALYTICS_SHARDS) or 'none'})")
+        try:
+            api_key = APIKey.objects.get(pk=options['api_key'])
+        except APIKey.DoesNotExist:
+            raise CommandError(f"API key #{options['api_key']} does not exist")
+
+        source = api_key.shard or DEFAULT_DB_ALIAS
+        if source == target:
+            self.stdout.write(f"{api_key.name} (#{api_key.pk}) is already on {target}")
+            return
+
+        dry_run = options['dry_run']
+        self.stdout.write(self.style.MIGRATE_HEADING(f"{api_key.name} (#{api_key.pk}): {source} -> {target}"))
+        started = time.monotonic()
+        counts = move_api_key(api_key, target, batch_size=options['batch_size'], grace=options['grace'],
+                              dry_run=dry_run, log=self.stdout.write if options['verbosity'] > 1 else None)
+        for table, count in counts.items():
+            self.stdout.write(f"  {table}: {'would move' if dry_run else 'moved'} {count} rows")
+        if not dry_run:
+            self.stdout.write(self.style.SUCCESS(f"Moved to {target} in {time.monotonic() - started:.1f}s"))
@@ -0,0 +1,72 @@
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from analytics.services.profiling import (
+    load_profiles, profile_token, prune_profiles, route_directory, top_frames,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Summarize the request profiles stored by ProfilingMiddleware, merge a route's "
+        "profiles into one collapsed-stack file for a flame graph, prune old profiles, or "
+        "print a token for the X-Analytics-Profile header."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--token', action='store_true',
+                            help="Print a X-Analytics-Profile header value and exit")
+        parser.add_argument('--route', help="Route to report on, e.g. api/track/pageview")
+        parser.add_argument('--top', type=int, default=20, help="Frames to show for --route (default: 20)")
+        parser.add_argument('--output', help="With --route, write the merged samples to this file "
+                                             "(flamegraph.pl / speedscope input)")
+        parser.add_argument('--prune', type=int, metavar='KEEP',
+                            help="Delete all but the newest KEEP profiles of every route (or of --route) and exit")
+
+    def handle(self, *args, **options):
+        if options['token']:
+            self.stdout.write(profile_token())
+            return
+
+        root = Path(settings.ANALYTICS_PROFILE_ROOT)
+        if options['prune'] is not None:
+            if options['route']:
+                directories = [route_directory(options['route'])]
+            else:
+                directories = sorted(path for path in root.glob('*') if path.is_dir()) if root.exists() else []
+            for directory in directories:
+                deleted = prune_profiles(directory, options['prune'])
+                if deleted:
+                    self.stdout.write(f"{directory.name}: deleted {deleted} profiles")
+            return
+
+        if not options['route']:
+            directories = sorted(path for path in root.glob('*') if path.is_dir()) if root.exists() else []
+            if not directories:
+                self.stdout.write(f"No profiles in {root}")
+                return
+            self.stdout.write(f"{'route':<48} {'profiles':>9} {'samples':>9}")
+            for directory in directories:
+                samples = sum(load_profiles(directory).values())
+                profiles = len(list(directory.glob('*.collapsed')))
+                self.stdout.write(f"{directory.name:<48} {profiles:>9} {samples:>9}")
+            return
+
+        directory = route_directory(options['route'])
+        stacks = load_profiles(directory)
+        if not stacks:
+            raise CommandError(f"No profiles for {options['route']} in {directory}")
+
+        total = sum(stacks.values())
+        self.stdout.write(self.style.MIGRATE_HEADING(f"{options['route']}: {total} samples"))
+        self.stdout.write(f"{'self':>7} {'total':>7}  frame")
+        for frame, own, inclusive in top_frames(stacks, limit=options['top']):
+            self.stdout.write(f"{own / total:>7.1%} {inclusive / total:>7.1%}  {frame}")
+
+        if options['output']:
+            Path(options['output']).write_text(
+                ''.join(f'{stack} {count}\n' for stack, count in stacks.most_common())
+            )
+            self.stdout.write(self.style.SUCCESS(f"Wrote {options['output']}"))
@@ -0,0 +1,93 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from analytics.models import APIKey
+from analytics.services.retention import (
+    RETENTION_DATASETS, archive_api_key, delete_api_key, drop_expired_partitions, global_cutoff,
+    retention_cutoff,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Archive tracking data older than each API key's retention_days to compressed "
+        "Parquet day files, then delete it in small batches. Safe to re-run after an "
+        "interruption. Schedule daily (e.g. from cron)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--api-key', type=int, action='append', dest='api_keys',
+                            help="Only prune this API key id (repeatable, default: all with a retention)")
+        parser.add_argument('--archive-dir', default=str(settings.ANALYTICS_ARCHIVE_ROOT),
+                            help="Root directory for the archived day files")
+        parser.add_argument('--batch-size', type=int, default=settings.ANALYTICS_RETENTION_BATCH_SIZE,
+                            help="Rows deleted per statement")
+        parser.add_argument('--sleep', type=float, default=0.1,
+                            help="Seconds to pause between delete batches (default: 0.1)")
+        parser.add_argument('--chunk-size', type=int, default=settings.ANALYTICS_EXPORT_CHUNK_SIZE,
+                            help="Rows per server-side cursor fetch and per Parquet row group")
+        parser.add_argument('--compression', default='zstd',
+                            help="Parquet compression codec (zstd, snappy, gzip, none)")
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Report what would be archived, dropped and deleted without changing anything")
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        root = options['archive_dir']
+        log = self.stdout.write if options['verbosity'] > 1 else None
+
+        api_keys = APIKey.objects.filter(retention_days__isnull=False).order_by('pk')
+        if options['api_keys']:
+            api_keys = api_keys.filter(pk__in=options['api_keys'])
+        api_keys = list(api_keys)
+        if not api_keys:
+            self.stdout.write("No API keys with a retention policy")
+            return
+
+        # Archive everything first: partitions can only be dropped once every
+        # key's rows in them are on disk
+        for api_key in api_keys:
+            self.stdout.write(self.style.MIGRATE_HEADING(
+                f"{api_key.name} (#{api_key.pk}): archiving before {retention_cutoff(api_key):%Y-%m-%d}"
+            ))
+            try:
+                results = archive_api_key(api_key, root, dry_run=dry_run, chunk_size=options['chunk_size'],
+                                          compression=options['compression'], log=log)
+            except RuntimeError as exc:
+                raise CommandError(str(exc))
+            for dataset in RETENTION_DATASETS:
+                result = results[dataset]
+                verb = 'would write' if dry_run else 'wrote'
+                self.stdout.write(
+                    f"  {dataset}: {verb} {result['files']} files ({result['skipped']} already archived), "
+                    f"{result['rows']} rows{self._rate(result['rows'], result['seconds'])}"
+                )
+
+        # Only when every key was processed: a key left out may not be archived yet
+        cutoff = global_cutoff() if not options['api_keys'] else None
+        if cutoff:
+            for name in drop_expired_partitions(cutoff, dry_run=dry_run, log=log):
+                self.stdout.write(self.style.WARNING(f"{'Would drop' if dry_run else 'Dropped'} {name}"))
+
+        for api_key in api_keys:
+            self.stdout.write(self.style.MIGRATE_HEADING(f"{api_key.name} (#{api_key.pk}): deleting"))
+            results = delete_api_key(api_key, root, options['batch_size'], sleep=options['sleep'],
+                                     dry_run=dry_run, log=log)
+            for dataset in RETENTION_DATASETS:
+                result = results[dataset]
+                verb = 'would delete' if dry_run else 'deleted'
+                self.stdout.write(
+                    f"  {dataset}: {verb} {result['deleted']} rows"
+                    f"{'' if dry_run else self._rate(result['deleted'], result['seconds'])}"
+                )
+
+        if not dry_run:
+            self.stdout.write(self.style.SUCCESS("Retention pruning complete"))
+
+    @staticmethod
+    def _rate(rows, seconds):
+        if not rows:
+            return ''
+        return f" in {seconds:.1f}s ({rows / max(seconds, 0.001):,.0f} rows/s)"
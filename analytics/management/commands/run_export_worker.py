@@ -0,0 +1,24 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from analytics.services.export_jobs import run_worker
+
+
+class Command(BaseCommand):
+    help = "Run queued admin export jobs in the background"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help="Exit once the queue is empty instead of polling")
+        parser.add_argument('--poll-interval', type=float, default=5,
+                            help="Seconds to wait between polls when the queue is empty")
+        parser.add_argument('--chunk-size', type=int, default=settings.ANALYTICS_EXPORT_CHUNK_SIZE,
+                            help="Rows per server-side cursor fetch and progress update")
+
+    def handle(self, *args, **options):
+        run_worker(
+            poll_interval=options['poll_interval'],
+            once=options['once'],
+            chunk_size=options['chunk_size'],
+            log=self.stdout.write,
+        )
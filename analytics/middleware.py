@@ -0,0 +1,243 @@
+import random
+import time
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.handlers.base import BaseHandler
+from django.core.handlers.exception import convert_exception_to_response
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.utils.module_loading import import_string
+
+from analytics.auth import JWTAuth
+from analytics.routers import REPLICA_DB_ALIAS, _read_alias, _shard_alias, replica_alias
+from analytics.services.metrics import QueryTimer, observe_process, observe_request, route_label
+from analytics.services.profiling import SamplingProfiler, check_profile_token, save_profile
+from analytics.services.slow_queries import _route
+
+
+READ_METHODS = ('GET', 'HEAD')
+
+# Per-request override for requests replica_eligible() accepts: "primary" to
+# read your own writes, "replica" (the default) to use it. It is ignored on
+# writes and tracking requests, which always read from the primary.
+READ_FROM_HEADER = 'X-Analytics-Read-From'
+READ_FROM_VALUES = {'primary': DEFAULT_DB_ALIAS, 'replica': REPLICA_DB_ALIAS}
+
+# Asks for the request to be profiled: a token from `manage.py profiles --token`,
+# or any value from a staff user
+PROFILE_HEADER = 'X-Analytics-Profile'
+
+
+def replica_eligible(request, resolver_match) -> bool:
+    """Whether a request only reads analytics data and may be served by the replica"""
+    if request.path.startswith(settings.ANALYTICS_REPLICA_PATH_PREFIXES):
+        return request.method in READ_METHODS
+
+    if resolver_match.namespace == 'admin' and resolver_match.url_name:
+        url_name = resolver_match.url_name
+        if url_name.endswith('_changelist'):
+            return request.method in READ_METHODS
+        # django-import-export's export form POSTs to run the export
+        if url_name.endswith('_export'):
+            return request.method in READ_METHODS + ('POST',)
+    return False
+
+
+def profiling_allowed(request) -> bool:
+    """Whether a request asking to be profiled carries a valid token or comes from a staff user"""
+    if check_profile_token(request.headers.get(PROFILE_HEADER, '')):
+        return True
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return user.is_staff
+    # API clients log in with a bearer token, checked by the view itself later
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    if scheme.lower() == 'bearer' and token:
+        user = JWTAuth().authenticate(request, token)
+        return user is not None and user.is_staff
+    return False
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Choose the database reads of a request go to
+
+    Analytics API reads, admin changelists and exports use the replica
+    (DATABASES['replica']) while its lag is acceptable; everything else,
+    and every write, uses the primary. The X-Analytics-Read-From header
+    can send one of those reads to the primary, but never another request
+    to the replica: a tracking request reading a lagging replica would
+    miss the session it created a moment ago.
+
+    Also scopes the shard chosen by APIKeyAuth to the request.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        token = _read_alias.set(None)
+        shard_token = _shard_alias.set(None)
+        try:
+            return self.get_response(request)
+        finally:
+            _shard_alias.reset(shard_token)
+            _read_alias.reset(token)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if not replica_eligible(request, request.resolver_match):
+            return None
+        override = READ_FROM_VALUES.get(request.headers.get(READ_FROM_HEADER, '').lower())
+        if override == DEFAULT_DB_ALIAS:
+            return None
+        alias = replica_alias()
+        if alias != DEFAULT_DB_ALIAS:
+            _read_alias.set(alias)
+        return None
+
+
+class MetricsMiddleware:
+    """
+    Record latency, response status and database queries/time per route
+    (see analytics.services.metrics, served on /metrics)
+
+    Streamed bodies (exports) are produced after the middleware returns; the
+    queries and time spent sending them are not included.
+    """
+
+    def __init__(self, get_response):
+        if not settings.ANALYTICS_METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        queries = QueryTimer()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(queries))
+            response = self.get_response(request)
+        observe_request(request, response, time.perf_counter() - started, queries)
+        observe_process()
+        return response
+
+
+class SlowQueryMiddleware:
+    """
+    Tag slow queries with the route of the request that ran them; they are
+    stored once the response has been sent (see analytics.signals)
+    """
+
+    def __init__(self, get_response):
+        if not settings.ANALYTICS_SLOW_QUERY_MS:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        token = _route.set('')
+        try:
+            return self.get_response(request)
+        finally:
+            _route.reset(token)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        _route.set(route_label(request))
+
+
+class MiddlewareStack(BaseHandler):
+    """
+    Handler running its own list of middleware around URL resolution and
+    the view, like settings.MIDDLEWARE does for the whole site. Sync only.
+    """
+
+    def __init__(self, middleware):
+        super().__init__()
+        self.middleware = list(middleware)
+        self.load_middleware()
+
+    def load_middleware(self, is_async=False):
+        self._view_middleware = []
+        self._template_response_middleware = []
+        self._exception_middleware = []
+
+        handler = convert_exception_to_response(self._get_response)
+        for middleware_path in reversed(self.middleware):
+            try:
+                instance = import_string(middleware_path)(handler)
+            except MiddlewareNotUsed:
+                continue
+            if hasattr(instance, 'process_view'):
+                self._view_middleware.insert(0, instance.process_view)
+            if hasattr(instance, 'process_template_response'):
+                self._template_response_middleware.append(instance.process_template_response)
+            if hasattr(instance, 'process_exception'):
+                self._exception_middleware.append(instance.process_exception)
+            handler = convert_exception_to_response(instance)
+        self._middleware_chain = handler
+
+    def __call__(self, request):
+        return self._middleware_chain(request)
+
+
+class TrackingFastLaneMiddleware:
+    """
+    Send requests under ANALYTICS_FAST_LANE_PATH_PREFIXES (the tracking
+    beacons) through ANALYTICS_FAST_LANE_MIDDLEWARE instead of the rest of
+    settings.MIDDLEWARE
+
+    Tracking authenticates with API keys and never uses sessions, CSRF
+    cookies, request.user, messages or frame options, so that middleware is
+    skipped. Middleware listed before this one still runs for every request.
+    """
+
+    def __init__(self, get_response):
+        if not settings.ANALYTICS_FAST_LANE_PATH_PREFIXES:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.fast_lane = MiddlewareStack(settings.ANALYTICS_FAST_LANE_MIDDLEWARE)
+
+    def __call__(self, request):
+        if request.path_info.startswith(settings.ANALYTICS_FAST_LANE_PATH_PREFIXES):
+            return self.fast_lane(request)
+        return self.get_response(request)
+
+
+class ProfilingMiddleware:
+    """
+    Run a sampling profiler around the view of an API request and store the
+    samples as collapsed stacks under ANALYTICS_PROFILE_ROOT/<route>/
+
+    A request is profiled when it sends the X-Analytics-Profile header and
+    profiling_allowed() agrees (its response then names the file in
+    X-Analytics-Profile-File), or at random for ANALYTICS_PROFILE_SAMPLE_RATE
+    of requests. Otherwise the cost is a header lookup. Keep it last in
+    MIDDLEWARE: it calls the view itself, so process_view hooks of
+    middleware after it would be skipped.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        return self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if not request.path.startswith(settings.ANALYTICS_PROFILE_PATH_PREFIXES):
+            return None
+        if iscoroutinefunction(view_func):
+            return None  # The live stream: its time is spent after the view returns
+        requested = PROFILE_HEADER in request.headers
+        if requested:
+            if not profiling_allowed(request):
+                return None
+        elif not (settings.ANALYTICS_PROFILE_SAMPLE_RATE and random.random() < settings.ANALYTICS_PROFILE_SAMPLE_RATE):
+            return None
+
+        with SamplingProfiler(interval=settings.ANALYTICS_PROFILE_INTERVAL) as profiler:
+            response = view_func(request, *view_args, **view_kwargs)
+        path = save_profile(route_label(request), profiler, request.method, response.status_code)
+        if requested:
+            response[f'{PROFILE_HEADER}-File'] = str(path.relative_to(settings.ANALYTICS_PROFILE_ROOT))
+        return response
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.11 on 2026-10-19 00:49
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0004_alter_event_event_type'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExportJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dataset', models.CharField(choices=[('sessions', 'Sessions'), ('pageviews', 'Page Views'), ('events', 'Events'), ('diagnostics', 'Diagnostic Responses')], max_length=20)),
+                ('format', models.CharField(choices=[('csv', 'CSV'), ('ndjson', 'NDJSON')], default='csv', max_length=10)),
+                ('start_date', models.DateField(blank=True, help_text='Inclusive, leave empty for no lower bound', null=True)),
+                ('end_date', models.DateField(blank=True, help_text='Inclusive, leave empty for no upper bound', null=True)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('completed', 'Completed'), ('failed', 'Failed')], db_index=True, default='pending', max_length=20)),
+                ('rows_total', models.IntegerField(blank=True, null=True)),
+                ('rows_exported', models.IntegerField(default=0)),
+                ('error', models.TextField(blank=True, null=True)),
+                ('file_path', models.CharField(blank=True, max_length=500, null=True)),
+                ('file_size', models.BigIntegerField(blank=True, help_text='Compressed size in bytes', null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('api_key', models.ForeignKey(blank=True, help_text='Leave empty to export all sites', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='export_jobs', to='analytics.apikey')),
+                ('requested_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='export_jobs', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Export Job',
+                'verbose_name_plural': 'Export Jobs',
+                'db_table': 'analytics_export_jobs',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,80 @@
+# Generated by Django 5.2.11 on 2026-10-19 00:51
+
+import django.contrib.postgres.indexes
+from django.contrib.postgres.operations import AddIndexConcurrently, TrigramExtension
+import django.db.models.functions.text
+from django.conf import settings
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    # Build the GIN indexes without blocking tracking inserts
+    atomic = False
+
+    dependencies = [
+        ("analytics", "0005_exportjob"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        AddIndexConcurrently(
+            model_name="event",
+            index=django.contrib.postgres.indexes.GinIndex(
+                django.contrib.postgres.indexes.OpClass(
+                    django.db.models.functions.text.Upper("element_text"),
+                    name="gin_trgm_ops",
+                ),
+                name="analytics_e_elem_text_trgm",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="event",
+            index=django.contrib.postgres.indexes.GinIndex(
+                django.contrib.postgres.indexes.OpClass(
+                    django.db.models.functions.text.Upper("event_label"),
+                    name="gin_trgm_ops",
+                ),
+                name="analytics_e_label_trgm",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="pageview",
+            index=django.contrib.postgres.indexes.GinIndex(
+                django.contrib.postgres.indexes.OpClass(
+                    django.db.models.functions.text.Upper("page_url"),
+                    name="gin_trgm_ops",
+                ),
+                name="analytics_p_url_trgm",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="pageview",
+            index=django.contrib.postgres.indexes.GinIndex(
+                django.contrib.postgres.indexes.OpClass(
+                    django.db.models.functions.text.Upper("page_title"),
+                    name="gin_trgm_ops",
+                ),
+                name="analytics_p_title_trgm",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="session",
+            index=django.contrib.postgres.indexes.GinIndex(
+                django.contrib.postgres.indexes.OpClass(
+                    django.db.models.functions.text.Upper("landing_page_url"),
+                    name="gin_trgm_ops",
+                ),
+                name="analytics_s_landing_trgm",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="session",
+            index=django.contrib.postgres.indexes.GinIndex(
+                django.contrib.postgres.indexes.OpClass(
+                    django.db.models.functions.text.Upper("email"), name="gin_trgm_ops"
+                ),
+                name="analytics_s_email_trgm",
+            ),
+        ),
+    ]
@@ -0,0 +1,145 @@
+"""
+Convert analytics_page_views and analytics_events into monthly range partitions
+
+Each table is rebuilt as ``PARTITION BY RANGE (viewed_at / occurred_at)``:
+the existing table is renamed, a partitioned copy is created with the same
+columns, monthly partitions are created from the oldest row up to three months
+ahead, rows are copied over, and the indexes and foreign keys of the original
+table are recreated on the new parent (which cascades them to every partition).
+
+The primary key becomes (id, <timestamp>) because Postgres requires unique
+constraints on partitioned tables to include the partition key, and the id
+identity is replaced by a plain sequence owned by the column.
+
+The copy runs in a single transaction and holds an exclusive lock on both
+tables for its duration; on large databases run it in a maintenance window.
+"""
+
+from datetime import datetime, timezone
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+PARTITIONED_TABLES = [
+    # Page views first: dropping the old table also drops the FK events had on it
+    ("analytics_page_views", "viewed_at"),
+    ("analytics_events", "occurred_at"),
+]
+
+MONTHS_AHEAD = 3
+
+
+def _month_start(value):
+    return datetime(value.year, value.month, 1, tzinfo=timezone.utc)
+
+
+def _next_month(value):
+    if value.month == 12:
+        return value.replace(year=value.year + 1, month=1)
+    return value.replace(month=value.month + 1)
+
+
+def _table_ddl(cursor, table):
+    """Index and foreign-key definitions of a table, excluding its primary key"""
+    cursor.execute(
+        """
+        SELECT indexdef FROM pg_indexes
+        WHERE schemaname = current_schema() AND tablename = %s AND indexname <> %s
+        """,
+        [table, f"{table}_pkey"],
+    )
+    indexes = [row[0] for row in cursor.fetchall()]
+
+    cursor.execute(
+        """
+        SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint
+        WHERE conrelid = %s::regclass AND contype = 'f'
+        """,
+        [table],
+    )
+    foreign_keys = cursor.fetchall()
+    return indexes, foreign_keys
+
+
+def _rebuild(cursor, table, column, partition_by):
+    """Copy ``table`` into a new table, partitioned or not, keeping its DDL"""
+    old_table = f"{table}_old"
+    indexes, foreign_keys = _table_ddl(cursor, table)
+
+    cursor.execute(f"ALTER TABLE {table} RENAME TO {old_table}")
+    partition_clause = f"PARTITION BY RANGE ({column})" if partition_by else ""
+    cursor.execute(
+        f"CREATE TABLE {table} (LIKE {old_table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS "
+        f"INCLUDING STORAGE INCLUDING COMMENTS) {partition_clause}"
+    )
+
+    if partition_by:
+        cursor.execute(f"SELECT MIN({column}) FROM {old_table}")
+        oldest = cursor.fetchone()[0] or datetime.now(timezone.utc)
+        month = _month_start(oldest)
+        last = _month_start(datetime.now(timezone.utc))
+        for _ in range(MONTHS_AHEAD):
+            last = _next_month(last)
+        while month <= last:
+            upper = _next_month(month)
+            cursor.execute(
+                f"CREATE TABLE {table}_p{month:%Y%m} PARTITION OF {table} "
+                f"FOR VALUES FROM (%s) TO (%s)",
+                [month, upper],
+            )
+            month = upper
+
+    cursor.execute(f"INSERT INTO {table} SELECT * FROM {old_table}")
+    cursor.execute(f"DROP TABLE {old_table} CASCADE")
+
+    sequence = f"{table}_id_seq"
+    cursor.execute(f"CREATE SEQUENCE {sequence} OWNED BY {table}.id")
+    cursor.execute(
+        f"SELECT setval('{sequence}', COALESCE((SELECT MAX(id) FROM {table}), 0) + 1, false)"
+    )
+    cursor.execute(f"ALTER TABLE {table} ALTER COLUMN id SET DEFAULT nextval('{sequence}')")
+
+    primary_key = f"(id, {column})" if partition_by else "(id)"
+    cursor.execute(f"ALTER TABLE {table} ADD CONSTRAINT {table}_pkey PRIMARY KEY {primary_key}")
+
+    for indexdef in indexes:
+        # Indexes of a partitioned parent are reported as "ON ONLY <table>"
+        cursor.execute(indexdef.replace(" ON ONLY ", " ON ", 1))
+    for name, definition in foreign_keys:
+        cursor.execute(f"ALTER TABLE {table} ADD CONSTRAINT {name} {definition}")
+
+
+def partition_tables(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        for table, column in PARTITIONED_TABLES:
+            _rebuild(cursor, table, column, partition_by=True)
+
+
+def unpartition_tables(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        for table, column in reversed(PARTITIONED_TABLES):
+            _rebuild(cursor, table, column, partition_by=False)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("analytics", "0006_trigram_search_indexes"),
+    ]
+
+    operations = [
+        # Must happen before partitioning: a partitioned page views table
+        # has no unique constraint on id alone for the FK to reference
+        migrations.AlterField(
+            model_name="event",
+            name="page_view",
+            field=models.ForeignKey(
+                blank=True,
+                db_constraint=False,
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="events",
+                to="analytics.pageview",
+            ),
+        ),
+        migrations.RunPython(partition_tables, unpartition_tables),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.2.11 on 2026-10-19 00:55
+
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("analytics", "0007_partition_events_and_page_views"),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="pageview",
+            name="analytics_p_viewed__a5f8fc_idx",
+        ),
+        migrations.AlterField(
+            model_name="event",
+            name="occurred_at",
+            field=models.DateTimeField(auto_now_add=True),
+        ),
+        migrations.AlterField(
+            model_name="pageview",
+            name="viewed_at",
+            field=models.DateTimeField(auto_now_add=True),
+        ),
+        migrations.AlterField(
+            model_name="session",
+            name="created_at",
+            field=models.DateTimeField(auto_now_add=True),
+        ),
+        migrations.AddIndex(
+            model_name="event",
+            index=django.contrib.postgres.indexes.BrinIndex(
+                autosummarize=True,
+                fields=["occurred_at"],
+                name="analytics_e_occurred_brin",
+                pages_per_range=32,
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="pageview",
+            index=django.contrib.postgres.indexes.BrinIndex(
+                autosummarize=True,
+                fields=["viewed_at"],
+                name="analytics_p_viewed_brin",
+                pages_per_range=32,
+            ),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.11 on 2026-10-19 00:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("analytics", "0008_brin_time_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="apikey",
+            name="retention_days",
+            field=models.PositiveIntegerField(
+                blank=True,
+                help_text="Archive and delete tracking data older than this many days (empty keeps it forever)",
+                null=True,
+            ),
+        ),
+    ]
@@ -0,0 +1,129 @@
+"""
+Promote metadata.step_number to a stored generated column and index Event.metadata
+
+Adding the generated column rewrites analytics_events under an exclusive
+lock; on large databases run it in a maintenance window. The two indexes are
+then built partition by partition with CREATE INDEX CONCURRENTLY so tracking
+inserts keep flowing.
+"""
+
+import django.contrib.postgres.indexes
+import django.db.models.fields.json
+import django.db.models.functions.comparison
+import django.db.models.lookups
+from django.db import migrations, models
+
+INDEXES = [
+    ("analytics_e_type_step_idx", "(event_type, step_number)"),
+    ("analytics_e_metadata_gin", "USING gin (metadata jsonb_path_ops)"),
+]
+
+
+def _create_index(cursor, name, definition):
+    # CREATE INDEX CONCURRENTLY is not supported on a partitioned parent: the
+    # parent index is created ON ONLY the parent (catalog only), each
+    # partition is indexed concurrently and attached. Safe to re-run.
+    cursor.execute(f"CREATE INDEX IF NOT EXISTS {name} ON ONLY analytics_events {definition}")
+    cursor.execute(
+        """
+        SELECT c.relname FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'analytics_events'::regclass AND NOT EXISTS (
+            SELECT 1 FROM pg_inherits ii
+            JOIN pg_index x ON x.indexrelid = ii.inhrelid
+            WHERE ii.inhparent = %s::regclass AND x.indrelid = c.oid
+        )
+        ORDER BY 1
+        """,
+        [name],
+    )
+    for (partition,) in cursor.fetchall():
+        child = f"{name[:55]}_{partition.rsplit('_', 1)[-1]}"
+        # Left invalid by an interrupted run
+        cursor.execute("SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(%s)", [child])
+        row = cursor.fetchone()
+        if row and not row[0]:
+            cursor.execute(f"DROP INDEX CONCURRENTLY {child}")
+        cursor.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {child} ON {partition} {definition}")
+        cursor.execute(f"ALTER INDEX {name} ATTACH PARTITION {child}")
+
+
+def create_indexes(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        for name, definition in INDEXES:
+            _create_index(cursor, name, definition)
+
+
+def drop_indexes(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        for name, _ in INDEXES:
+            # Drops the partition indexes with it
+            cursor.execute(f"DROP INDEX IF EXISTS {name}")
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ("analytics", "0009_apikey_retention_days"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="event",
+            name="step_number",
+            field=models.GeneratedField(
+                db_persist=True,
+                expression=models.Case(
+                    models.When(
+                        models.Q(
+                            django.db.models.lookups.Exact(
+                                models.Func(
+                                    django.db.models.fields.json.KeyTransform(
+                                        "step_number", "metadata"
+                                    ),
+                                    function="jsonb_typeof",
+                                ),
+                                models.Value("number"),
+                            ),
+                            django.db.models.lookups.Regex(
+                                django.db.models.fields.json.KeyTextTransform(
+                                    "step_number", "metadata"
+                                ),
+                                "^-?[0-9]{1,9}$",
+                            ),
+                        ),
+                        then=django.db.models.functions.comparison.Cast(
+                            django.db.models.fields.json.KeyTextTransform(
+                                "step_number", "metadata"
+                            ),
+                            models.IntegerField(),
+                        ),
+                    )
+                ),
+                output_field=models.IntegerField(),
+            ),
+        ),
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AddIndex(
+                    model_name="event",
+                    index=models.Index(
+                        fields=["event_type", "step_number"],
+                        name="analytics_e_type_step_idx",
+                    ),
+                ),
+                migrations.AddIndex(
+                    model_name="event",
+                    index=django.contrib.postgres.indexes.GinIndex(
+                        fields=["metadata"],
+                        name="analytics_e_metadata_gin",
+                        opclasses=["jsonb_path_ops"],
+                    ),
+                ),
+            ],
+            database_operations=[
+                migrations.RunPython(create_indexes, drop_indexes),
+            ],
+        ),
+    ]
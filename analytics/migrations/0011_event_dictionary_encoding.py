@@ -0,0 +1,351 @@
+"""
+Store event_type, event_category and page_path of analytics_events as dictionary ids
+
+Each column is replaced by a smallint/int id into analytics_event_types,
+analytics_event_categories or analytics_page_paths:
+
+1. indexes using the old columns are dropped and nullable id columns added
+   (catalog-only changes);
+2. a trigger fills the id columns of rows inserted from then on by code still
+   writing the old columns; the dictionaries are filled from the distinct
+   existing values and the ids back-filled in id-range batches, each committed
+   on its own so no long transaction holds row locks;
+3. a NOT VALID check that event_type's id is set is added and validated, which
+   scans the table without blocking writes; the migration stops here, before
+   any column is dropped, if a row was missed;
+4. the trigger and the old columns are dropped and the id columns take their
+   names (catalog-only); SET NOT NULL is proven by the validated check instead
+   of a scan under an exclusive lock, and the check is dropped;
+5. the indexes are rebuilt concurrently partition by partition.
+
+Code still writing the old columns can insert events until step 4 and fails
+from then on: deploy the new code together with the migration. VACUUM
+analytics_events afterwards: the back-fill rewrites every row once.
+"""
+
+import analytics.fields
+from django.db import migrations, models
+
+BATCH_SIZE = 20000
+
+ENCODE_TRIGGER = "analytics_events_encode"
+EVENT_TYPE_SET = "analytics_events_event_type_set"
+
+# (column, dictionary table)
+DICTIONARY_COLUMNS = [
+    ("event_type", "analytics_event_types"),
+    ("event_category", "analytics_event_categories"),
+    ("page_path", "analytics_page_paths"),
+]
+
+INDEXES = [
+    ("analytics_e_event_t_7b4dc8_idx", "(event_type, occurred_at)"),
+    ("analytics_e_event_c_22bf3e_idx", "(event_category, occurred_at)"),
+    ("analytics_e_page_pa_e148ec_idx", "(page_path, event_type)"),
+    ("analytics_e_type_step_idx", "(event_type, step_number)"),
+]
+
+
+def _batched_update(cursor, assignments, where=""):
+    cursor.execute("SELECT MIN(id), MAX(id) FROM analytics_events")
+    low, high = cursor.fetchone()
+    if low is None:
+        return
+    for start in range(low, high + 1, BATCH_SIZE):
+        cursor.execute(
+            f"UPDATE analytics_events e SET {assignments} WHERE e.id >= %s AND e.id < %s {where}",
+            [start, start + BATCH_SIZE],
+        )
+
+
+def _encode_trigger_sql():
+    steps = "\n".join(
+        f"""
+        IF NEW.{column}_ref IS NULL AND NEW.{column} IS NOT NULL THEN
+            INSERT INTO {table} (name) VALUES (NEW.{column}) ON CONFLICT (name) DO NOTHING;
+            SELECT id INTO NEW.{column}_ref FROM {table} WHERE name = NEW.{column};
+        END IF;"""
+        for column, table in DICTIONARY_COLUMNS
+    )
+    return f"""
+        CREATE OR REPLACE FUNCTION {ENCODE_TRIGGER}() RETURNS trigger AS $$
+        BEGIN {steps}
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql;
+        DROP TRIGGER IF EXISTS {ENCODE_TRIGGER} ON analytics_events;
+        CREATE TRIGGER {ENCODE_TRIGGER} BEFORE INSERT ON analytics_events
+            FOR EACH ROW EXECUTE FUNCTION {ENCODE_TRIGGER}();
+    """
+
+
+def encode_columns(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        # Creating the trigger waits for inserts in progress, so every row the
+        # trigger does not see exists by the time the back-fill reads MAX(id)
+        cursor.execute(_encode_trigger_sql())
+        for column, table in DICTIONARY_COLUMNS:
+            cursor.execute(
+                f"INSERT INTO {table} (name) SELECT DISTINCT {column} FROM analytics_events "
+                f"WHERE {column} IS NOT NULL ON CONFLICT (name) DO NOTHING"
+            )
+        assignments = ", ".join(
+            f"{column}_ref = (SELECT id FROM {table} WHERE name = e.{column})"
+            for column, table in DICTIONARY_COLUMNS
+        )
+        _batched_update(cursor, assignments)
+
+        # Enforced for new rows at once; validating it scans the table with a
+        # lock that lets inserts through, and fails (before any column is
+        # dropped) if a row was left without an id
+        cursor.execute(
+            f"ALTER TABLE analytics_events ADD CONSTRAINT {EVENT_TYPE_SET} "
+            f"CHECK (event_type_ref IS NOT NULL) NOT VALID"
+        )
+        cursor.execute(f"ALTER TABLE analytics_events VALIDATE CONSTRAINT {EVENT_TYPE_SET}")
+
+
+def decode_columns(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(f"ALTER TABLE analytics_events DROP CONSTRAINT IF EXISTS {EVENT_TYPE_SET}")
+        cursor.execute(f"DROP TRIGGER IF EXISTS {ENCODE_TRIGGER} ON analytics_events")
+        cursor.execute(f"DROP FUNCTION IF EXISTS {ENCODE_TRIGGER}()")
+        assignments = ", ".join(
+            f"{column} = (SELECT name FROM {table} WHERE id = e.{column}_ref)"
+            for column, table in DICTIONARY_COLUMNS
+        )
+        _batched_update(cursor, assignments)
+
+
+def _create_index(cursor, name, definition):
+    # CREATE INDEX CONCURRENTLY is not supported on a partitioned parent: the
+    # parent index is created ON ONLY the parent (catalog only), each
+    # partition is indexed concurrently and attached. Safe to re-run.
+    cursor.execute(f"CREATE INDEX IF NOT EXISTS {name} ON ONLY analytics_events {definition}")
+    cursor.execute(
+        """
+        SELECT c.relname FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'analytics_events'::regclass AND NOT EXISTS (
+            SELECT 1 FROM pg_inherits ii
+            JOIN pg_index x ON x.indexrelid = ii.inhrelid
+            WHERE ii.inhparent = %s::regclass AND x.indrelid = c.oid
+        )
+        ORDER BY 1
+        """,
+        [name],
+    )
+    for (partition,) in cursor.fetchall():
+        child = f"{name[:55]}_{partition.rsplit('_', 1)[-1]}"
+        # Left invalid by an interrupted run
+        cursor.execute("SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(%s)", [child])
+        row = cursor.fetchone()
+        if row and not row[0]:
+            cursor.execute(f"DROP INDEX CONCURRENTLY {child}")
+        cursor.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {child} ON {partition} {definition}")
+        cursor.execute(f"ALTER INDEX {name} ATTACH PARTITION {child}")
+
+
+def create_indexes(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        for name, definition in INDEXES:
+            _create_index(cursor, name, definition)
+
+
+def drop_indexes(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        for name, _ in INDEXES:
+            # Drops the partition indexes with it
+            cursor.execute(f"DROP INDEX IF EXISTS {name}")
+
+
+EVENT_TYPE_CHOICES = [
+    ("cta_click", "CTA Click"),
+    ("button_click", "Button Click"),
+    ("link_click", "Link Click"),
+    ("form_submit", "Form Submit"),
+    ("form_start", "Form Started"),
+    ("download", "Download"),
+    ("video_play", "Video Play"),
+    ("video_complete", "Video Complete"),
+    ("scroll", "Scroll Event"),
+    ("outbound_click", "Outbound Link Click"),
+    ("search", "Site Search"),
+    ("conversion", "Conversion"),
+    ("custom", "Custom Event"),
+    # Diagnostic-specific events
+    ("diagnostic_started", "Diagnostic Started"),
+    ("diagnostic_question_shown", "Diagnostic Question Shown"),
+    ("diagnostic_step_completed", "Diagnostic Step Completed"),
+    ("diagnostic_contact_form_shown", "Diagnostic Contact Form Shown"),
+    ("diagnostic_email_submitted", "Diagnostic Email Submitted"),
+    ("diagnostic_contact_skipped", "Diagnostic Contact Skipped"),
+    ("diagnostic_results_viewed", "Diagnostic Results Viewed"),
+    ("diagnostic_restarted", "Diagnostic Restarted"),
+    ("diagnostic_abandoned", "Diagnostic Abandoned"),
+]
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ("analytics", "0010_event_metadata_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="EventCategory",
+            fields=[
+                ("id", models.SmallAutoField(primary_key=True, serialize=False)),
+                ("name", models.CharField(max_length=100, unique=True)),
+            ],
+            options={
+                "verbose_name_plural": "event categories",
+                "db_table": "analytics_event_categories",
+            },
+        ),
+        migrations.CreateModel(
+            name="EventType",
+            fields=[
+                ("id", models.SmallAutoField(primary_key=True, serialize=False)),
+                ("name", models.CharField(max_length=50, unique=True)),
+            ],
+            options={
+                "db_table": "analytics_event_types",
+            },
+        ),
+        migrations.CreateModel(
+            name="PagePath",
+            fields=[
+                ("id", models.AutoField(primary_key=True, serialize=False)),
+                ("name", models.CharField(max_length=1024, unique=True)),
+            ],
+            options={
+                "db_table": "analytics_page_paths",
+            },
+        ),
+        migrations.RemoveIndex(
+            model_name="event", name="analytics_e_event_t_7b4dc8_idx"
+        ),
+        migrations.RemoveIndex(
+            model_name="event", name="analytics_e_event_c_22bf3e_idx"
+        ),
+        migrations.RemoveIndex(
+            model_name="event", name="analytics_e_page_pa_e148ec_idx"
+        ),
+        migrations.RemoveIndex(model_name="event", name="analytics_e_type_step_idx"),
+        # Lets the reverse migration re-add event_type empty before decoding into it
+        migrations.AlterField(
+            model_name="event",
+            name="event_type",
+            field=models.CharField(
+                choices=EVENT_TYPE_CHOICES, max_length=50, null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="event",
+            name="event_type_ref",
+            field=analytics.fields.DictionaryField(
+                dictionary="analytics.EventType", null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="event",
+            name="event_category_ref",
+            field=analytics.fields.DictionaryField(
+                dictionary="analytics.EventCategory", null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="event",
+            name="page_path_ref",
+            field=analytics.fields.DictionaryField(
+                dictionary="analytics.PagePath", null=True
+            ),
+        ),
+        migrations.RunPython(encode_columns, decode_columns),
+        migrations.RunSQL(
+            [
+                f"DROP TRIGGER {ENCODE_TRIGGER} ON analytics_events",
+                f"DROP FUNCTION {ENCODE_TRIGGER}()",
+            ],
+            migrations.RunSQL.noop,
+        ),
+        migrations.RemoveField(model_name="event", name="event_type"),
+        migrations.RemoveField(model_name="event", name="event_category"),
+        migrations.RemoveField(model_name="event", name="page_path"),
+        migrations.RenameField(
+            model_name="event", old_name="event_type_ref", new_name="event_type"
+        ),
+        migrations.RenameField(
+            model_name="event", old_name="event_category_ref", new_name="event_category"
+        ),
+        migrations.RenameField(
+            model_name="event", old_name="page_path_ref", new_name="page_path"
+        ),
+        migrations.AlterField(
+            model_name="event",
+            name="event_type",
+            field=analytics.fields.DictionaryField(
+                choices=EVENT_TYPE_CHOICES, dictionary="analytics.EventType"
+            ),
+        ),
+        # SET NOT NULL above relied on it instead of scanning
+        migrations.RunSQL(
+            f"ALTER TABLE analytics_events DROP CONSTRAINT {EVENT_TYPE_SET}",
+            migrations.RunSQL.noop,
+        ),
+        migrations.AlterField(
+            model_name="event",
+            name="event_category",
+            field=analytics.fields.DictionaryField(
+                blank=True,
+                dictionary="analytics.EventCategory",
+                help_text="e.g., 'Header CTA', 'Footer CTA', 'Pricing'",
+                null=True,
+            ),
+        ),
+        migrations.AlterField(
+            model_name="event",
+            name="page_path",
+            field=analytics.fields.DictionaryField(
+                blank=True, dictionary="analytics.PagePath", null=True
+            ),
+        ),
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AddIndex(
+                    model_name="event",
+                    index=models.Index(
+                        fields=["event_type", "occurred_at"],
+                        name="analytics_e_event_t_7b4dc8_idx",
+                    ),
+                ),
+                migrations.AddIndex(
+                    model_name="event",
+                    index=models.Index(
+                        fields=["event_category", "occurred_at"],
+                        name="analytics_e_event_c_22bf3e_idx",
+                    ),
+                ),
+                migrations.AddIndex(
+                    model_name="event",
+                    index=models.Index(
+                        fields=["page_path", "event_type"],
+                        name="analytics_e_page_pa_e148ec_idx",
+                    ),
+                ),
+                migrations.AddIndex(
+                    model_name="event",
+                    index=models.Index(
+                        fields=["event_type", "step_number"],
+                        name="analytics_e_type_step_idx",
+                    ),
+                ),
+            ],
+            database_operations=[
+                migrations.RunPython(create_indexes, drop_indexes),
+            ],
+        ),
+    ]
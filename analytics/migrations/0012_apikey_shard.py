@@ -0,0 +1,23 @@
+# Generated by Django 5.2.11 on 2026-10-19 01:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("analytics", "0011_event_dictionary_encoding"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="apikey",
+            name="shard",
+            field=models.CharField(
+                blank=True,
+                default="",
+                help_text="Database alias holding this site's tracking data (empty: the primary). Change it with manage.py move_api_key_shard",
+                max_length=64,
+            ),
+        ),
+    ]
@@ -0,0 +1,88 @@
+# Generated by Django 5.2.11 on 2026-10-19 01:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("analytics", "0012_apikey_shard"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SlowQuery",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "fingerprint",
+                    models.CharField(
+                        db_index=True,
+                        help_text="SHA-1 of the normalized SQL",
+                        max_length=40,
+                    ),
+                ),
+                (
+                    "normalized_sql",
+                    models.TextField(help_text="Literals and parameters replaced by ?"),
+                ),
+                (
+                    "sample_sql",
+                    models.TextField(
+                        help_text="One occurrence as sent to the database"
+                    ),
+                ),
+                ("sample_params", models.TextField(blank=True)),
+                ("database", models.CharField(max_length=64)),
+                (
+                    "route",
+                    models.CharField(
+                        blank=True,
+                        help_text="URL pattern or management command",
+                        max_length=255,
+                    ),
+                ),
+                (
+                    "function",
+                    models.CharField(
+                        blank=True,
+                        help_text="Innermost project frame that ran the query",
+                        max_length=255,
+                    ),
+                ),
+                ("calls", models.PositiveIntegerField(default=1)),
+                ("total_ms", models.FloatField()),
+                ("max_ms", models.FloatField()),
+                ("last_ms", models.FloatField()),
+                (
+                    "plan",
+                    models.TextField(
+                        blank=True,
+                        help_text="EXPLAIN output, captured once per fingerprint",
+                    ),
+                ),
+                ("first_seen_at", models.DateTimeField(auto_now_add=True)),
+                ("last_seen_at", models.DateTimeField()),
+            ],
+            options={
+                "verbose_name": "Slow Query",
+                "verbose_name_plural": "Slow Queries",
+                "db_table": "analytics_slow_queries",
+                "ordering": ["-total_ms"],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("fingerprint", "route", "function"),
+                        name="slow_query_call_site",
+                    )
+                ],
+            },
+        ),
+    ]
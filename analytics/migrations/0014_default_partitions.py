@@ -0,0 +1,71 @@
+"""
+Give the partitioned page views and events tables a DEFAULT partition
+
+Without it, an insert whose timestamp no monthly partition covers fails,
+which is every tracking request once ``manage_partitions`` has not run for
+longer than its ``--months-ahead``. Such rows now land in the DEFAULT
+partition, and the next ``manage_partitions`` run moves them to their
+monthly partitions.
+"""
+
+from django.db import migrations
+
+# Partitioned since 0007, with their partition key column
+PARTITIONED_TABLES = [
+    ("analytics_page_views", "viewed_at"),
+    ("analytics_events", "occurred_at"),
+]
+
+
+def _default_partition(cursor, table):
+    cursor.execute(
+        "SELECT partdefid::regclass::text FROM pg_partitioned_table "
+        "WHERE partrelid = %s::regclass AND partdefid <> 0",
+        [table],
+    )
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def create_default_partitions(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        for table, _ in PARTITIONED_TABLES:
+            if not _default_partition(cursor, table):
+                cursor.execute(f"CREATE TABLE {table}_default PARTITION OF {table} DEFAULT")
+
+
+def drop_default_partitions(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        for table, column in PARTITIONED_TABLES:
+            default = _default_partition(cursor, table)
+            if not default:
+                continue
+            # Keep the rows it holds: detach it, create the monthly partitions
+            # they belong to and copy them there
+            cursor.execute(f"ALTER TABLE {table} DETACH PARTITION {default}")
+            cursor.execute(f"SELECT DISTINCT date_trunc('month', {column}, 'UTC') FROM {default}")
+            for (month,) in cursor.fetchall():
+                cursor.execute(
+                    f"CREATE TABLE IF NOT EXISTS {table}_p{month:%Y%m} PARTITION OF {table} "
+                    f"FOR VALUES FROM (%s) TO (%s + interval '1 month')",
+                    [month, month],
+                )
+            # Generated columns are computed again on insert
+            cursor.execute(
+                "SELECT string_agg(quote_ident(attname), ', ' ORDER BY attnum) FROM pg_attribute "
+                "WHERE attrelid = %s::regclass AND attnum > 0 AND NOT attisdropped AND attgenerated = ''",
+                [table],
+            )
+            columns = cursor.fetchone()[0]
+            cursor.execute(f"INSERT INTO {table} ({columns}) SELECT {columns} FROM {default}")
+            cursor.execute(f"DROP TABLE {default}")
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("analytics", "0013_slow_query"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_default_partitions, drop_default_partitions),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.11 on 2026-10-19 02:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("analytics", "0014_default_partitions"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="exportjob",
+            name="heartbeat_at",
+            field=models.DateTimeField(
+                blank=True,
+                help_text="Last progress report of the worker running the job",
+                null=True,
+            ),
+        ),
+    ]
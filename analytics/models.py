@@ -1,15 +1,59 @@
+from django.conf import settings
+from django.core.exceptions import ValidationError
 from django.db import models
-from django.contrib.postgres.indexes import BrinIndex
+from django.db.models import Case, Func, Value, When
+from django.db.models.fields.json import KT, KeyTransform
+from django.db.models.functions import Cast, Upper
+from django.db.models.lookups import Exact, Regex
+from django.contrib.postgres.indexes import BrinIndex, GinIndex, OpClass
 from accounts.models import CustomUser
+from analytics.fields import DictionaryField
 import uuid
 
 
+# JSON type and (optional) text pattern a metadata value must match before it
+# is cast, so a malformed value from a tracking client yields NULL instead of
+# failing the insert
+_PROMOTED_TYPES = {
+    'IntegerField': ('number', r'^-?[0-9]{1,9}$'),
+    'BooleanField': ('boolean', None),
+    'CharField': ('string', None),
+}
+
+
+def promoted_metadata_field(key, output_field, json_field='metadata'):
+    """
+    Stored generated column holding one metadata key as a typed value
+
+    Frequently filtered metadata keys are promoted this way so they can be
+    indexed and compared like ordinary columns. Register the key in the
+    model's PROMOTED_METADATA_KEYS so filter_metadata() uses the column.
+    """
+    json_type, pattern = _PROMOTED_TYPES[output_field.get_internal_type()]
+    text_value = KT(f'{json_field}__{key}')
+    condition = Exact(Func(KeyTransform(key, json_field), function='jsonb_typeof'), Value(json_type))
+    if pattern:
+        condition &= Regex(text_value, pattern)
+    return models.GeneratedField(
+        expression=Case(When(condition, then=Cast(text_value, output_field))),
+        output_field=output_field,
+        db_persist=True,
+    )
+
+
 class APIKey(models.Model):
     """API keys for authenticating tracking requests from different domains"""
     key = models.CharField(max_length=64, unique=True, db_index=True)
     name = models.CharField(max_length=255, help_text="e.g., 'Main Website', 'Landing Page'")
     domain = models.CharField(max_length=255, help_text="Expected origin domain")
     is_active = models.BooleanField(default=True)
+    retention_days = models.PositiveIntegerField(
+        null=True, blank=True,
+        help_text="Archive and delete tracking data older than this many days (empty keeps it forever)")
+    shard = models.CharField(
+        max_length=64, blank=True, default='',
+        help_text="Database alias holding this site's tracking data (empty: the primary). "
+                  "Change it with manage.py move_api_key_shard")
     created_at = models.DateTimeField(auto_now_add=True)
     
     class Meta:
@@ -20,6 +64,61 @@ class APIKey(models.Model):
     def __str__(self):
         return f"{self.name} ({self.domain})"
 
+    def clean(self):
+        if self.shard and self.shard not in settings.ANALYTICS_SHARDS:
+            raise ValidationError({'shard': f"Unknown shard '{self.shard}'"})
+
+
+class DictionaryEntry(models.Model):
+    """Lookup table storing a repeated string once (see analytics.fields.DictionaryField)"""
+    # Small tables are cached in full on first use
+    PRELOAD = True
+    # Entries a table may have; names arriving after that are stored as OVERFLOW_NAME
+    MAX_ENTRIES = None
+    OVERFLOW_NAME = '(other)'
+
+    class Meta:
+        abstract = True
+
+    def __str__(self):
+        return self.name
+
+
+class EventType(DictionaryEntry):
+    # Usually one of Event.EVENT_TYPE_CHOICES, but trackers may send their
+    # own: keep those within the smallint ids, stored as 'custom' past that
+    MAX_ENTRIES = 1000
+    OVERFLOW_NAME = 'custom'
+
+    id = models.SmallAutoField(primary_key=True)
+    name = models.CharField(max_length=50, unique=True)
+
+    class Meta:
+        db_table = 'analytics_event_types'
+
+
+class EventCategory(DictionaryEntry):
+    # Categories are free text sent by tracking clients: keep them within
+    # the smallint ids, and the table small enough to preload
+    MAX_ENTRIES = 2000
+
+    id = models.SmallAutoField(primary_key=True)
+    name = models.CharField(max_length=100, unique=True)
+
+    class Meta:
+        db_table = 'analytics_event_categories'
+        verbose_name_plural = 'event categories'
+
+
+class PagePath(DictionaryEntry):
+    PRELOAD = False
+
+    id = models.AutoField(primary_key=True)
+    name = models.CharField(max_length=1024, unique=True)
+
+    class Meta:
+        db_table = 'analytics_page_paths'
+
 
 class Session(models.Model):
     """Visitor session - groups all activity from one visit"""
@@ -103,7 +202,10 @@ class Session(models.Model):
                                    help_text="Bot likelihood score (0-100)")
     
     # Timestamps
-    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    # No standalone index: (created_at, source) below already leads with created_at
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Incremental Parquet exports and shard moves find changed sessions by
+    # this: saves with update_fields must include it
     last_activity_at = models.DateTimeField(auto_now=True)
     ended_at = models.DateTimeField(null=True, blank=True)
     
@@ -114,6 +216,11 @@ class Session(models.Model):
             models.Index(fields=['created_at', 'source']),
             models.Index(fields=['api_key', 'created_at']),
             models.Index(fields=['user', 'created_at']),
+            # Trigram indexes backing admin search (Django's icontains compares UPPER(column))
+            GinIndex(OpClass(Upper('landing_page_url'), name='gin_trgm_ops'),
+                     name='analytics_s_landing_trgm'),
+            GinIndex(OpClass(Upper('email'), name='gin_trgm_ops'),
+                     name='analytics_s_email_trgm'),
         ]
     
     def __str__(self):
@@ -121,7 +228,11 @@ class Session(models.Model):
 
 
 class PageView(models.Model):
-    """Individual page view within a session (Layer 3: visitor pathway)"""
+    """
+    Individual page view within a session (Layer 3: visitor pathway)
+
+    Stored in monthly range partitions on viewed_at (see manage_partitions).
+    """
     
     session = models.ForeignKey(Session, on_delete=models.CASCADE, related_name='page_views')
     
@@ -139,7 +250,7 @@ class PageView(models.Model):
     scroll_depth_percent = models.IntegerField(default=0, help_text="Max scroll percentage")
     
     # Timestamps
-    viewed_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    viewed_at = models.DateTimeField(auto_now_add=True)
     
     class Meta:
         db_table = 'analytics_page_views'
@@ -147,7 +258,14 @@ class PageView(models.Model):
         indexes = [
             models.Index(fields=['session', 'sequence_number']),
             models.Index(fields=['page_path', 'viewed_at']),
-            models.Index(fields=['viewed_at']),
+            # Append-only and inserted in time order: a BRIN index is a few pages
+            # instead of a btree the size of the table
+            BrinIndex(fields=['viewed_at'], name='analytics_p_viewed_brin', pages_per_range=32,
+                      autosummarize=True),
+            GinIndex(OpClass(Upper('page_url'), name='gin_trgm_ops'),
+                     name='analytics_p_url_trgm'),
+            GinIndex(OpClass(Upper('page_title'), name='gin_trgm_ops'),
+                     name='analytics_p_title_trgm'),
         ]
     
     def __str__(self):
@@ -155,7 +273,13 @@ class PageView(models.Model):
 
 
 class Event(models.Model):
-    """User interactions: clicks, form submits, etc. (Layer 4: CTA tracking)"""
+    """
+    User interactions: clicks, form submits, etc. (Layer 4: CTA tracking)
+
+    Stored in monthly range partitions on occurred_at (see manage_partitions).
+    event_type, event_category and page_path are stored as ids into small
+    dictionary tables but read and filtered as strings.
+    """
     
     EVENT_TYPE_CHOICES = [
         ('cta_click', 'CTA Click'),
@@ -184,12 +308,16 @@ class Event(models.Model):
     ]
     
     session = models.ForeignKey(Session, on_delete=models.CASCADE, related_name='events')
+    # No DB-level constraint: analytics_page_views is partitioned by viewed_at, so its
+    # primary key is (id, viewed_at) and a plain id cannot be referenced
     page_view = models.ForeignKey(PageView, on_delete=models.CASCADE, related_name='events', 
-                                  null=True, blank=True)
+                                  null=True, blank=True, db_constraint=False)
+    
+    DIAGNOSTIC_EVENT_TYPES = [value for value, _ in EVENT_TYPE_CHOICES if value.startswith('diagnostic_')]
     
     # Event details
-    event_type = models.CharField(max_length=50, choices=EVENT_TYPE_CHOICES, db_index=True)
-    event_category = models.CharField(max_length=100, blank=True, null=True, db_index=True,
+    event_type = DictionaryField('analytics.EventType', choices=EVENT_TYPE_CHOICES)
+    event_category = DictionaryField('analytics.EventCategory', blank=True, null=True,
                                      help_text="e.g., 'Header CTA', 'Footer CTA', 'Pricing'")
     event_label = models.CharField(max_length=255, blank=True, null=True,
                                    help_text="e.g., 'Download Brochure', 'Contact Sales'")
@@ -204,7 +332,7 @@ class Event(models.Model):
     
     # Page context
     page_url = models.CharField(max_length=2048)
-    page_path = models.CharField(max_length=1024, blank=True, null=True)
+    page_path = DictionaryField('analytics.PagePath', blank=True, null=True)
     
     # Timing (how long before they clicked)
     time_since_page_load_ms = models.IntegerField(help_text="Milliseconds since page loaded")
@@ -213,9 +341,14 @@ class Event(models.Model):
     # Additional metadata (JSON for flexibility)
     metadata = models.JSONField(default=dict, blank=True, 
                                help_text="Additional event-specific data")
+    # Diagnostic funnel step, promoted out of metadata for indexing
+    step_number = promoted_metadata_field('step_number', models.IntegerField())
     
     # Timestamp
-    occurred_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    occurred_at = models.DateTimeField(auto_now_add=True)
+
+    # metadata key -> promoted column (see filter_metadata)
+    PROMOTED_METADATA_KEYS = {'step_number': 'step_number'}
     
     class Meta:
         db_table = 'analytics_events'
@@ -223,8 +356,17 @@ class Event(models.Model):
         indexes = [
             models.Index(fields=['session', 'occurred_at']),
             models.Index(fields=['event_type', 'occurred_at']),
+            models.Index(fields=['event_type', 'step_number'], name='analytics_e_type_step_idx'),
+            # Containment (metadata__contains) lookups on any key
+            GinIndex(fields=['metadata'], opclasses=['jsonb_path_ops'], name='analytics_e_metadata_gin'),
             models.Index(fields=['event_category', 'occurred_at']),
             models.Index(fields=['page_path', 'event_type']),
+            BrinIndex(fields=['occurred_at'], name='analytics_e_occurred_brin', pages_per_range=32,
+                      autosummarize=True),
+            GinIndex(OpClass(Upper('element_text'), name='gin_trgm_ops'),
+                     name='analytics_e_elem_text_trgm'),
+            GinIndex(OpClass(Upper('event_label'), name='gin_trgm_ops'),
+                     name='analytics_e_label_trgm'),
         ]
     
     def __str__(self):
@@ -310,4 +452,116 @@ class DiagnosticResponse(models.Model):
         ]
     
     def __str__(self):
-        return f"{self.diagnostic_name} - {self.session.session_id}"
\ No newline at end of file
+        return f"{self.diagnostic_name} - {self.session.session_id}"
+
+
+class ExportJob(models.Model):
+    """Bulk export requested from the admin and run by the background export worker"""
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    ]
+
+    DATASET_CHOICES = [
+        ('sessions', 'Sessions'),
+        ('pageviews', 'Page Views'),
+        ('events', 'Events'),
+        ('diagnostics', 'Diagnostic Responses'),
+    ]
+
+    FORMAT_CHOICES = [
+        ('csv', 'CSV'),
+        ('ndjson', 'NDJSON'),
+    ]
+
+    # What to export
+    dataset = models.CharField(max_length=20, choices=DATASET_CHOICES)
+    format = models.CharField(max_length=10, choices=FORMAT_CHOICES, default='csv')
+    api_key = models.ForeignKey(APIKey, on_delete=models.SET_NULL, null=True, blank=True,
+                                related_name='export_jobs',
+                                help_text="Leave empty to export all sites")
+    start_date = models.DateField(null=True, blank=True, help_text="Inclusive, leave empty for no lower bound")
+    end_date = models.DateField(null=True, blank=True, help_text="Inclusive, leave empty for no upper bound")
+
+    # Progress
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending', db_index=True)
+    rows_total = models.IntegerField(null=True, blank=True)
+    rows_exported = models.IntegerField(default=0)
+    error = models.TextField(blank=True, null=True)
+
+    # Result (gzip-compressed file on local storage)
+    file_path = models.CharField(max_length=500, blank=True, null=True)
+    file_size = models.BigIntegerField(null=True, blank=True, help_text="Compressed size in bytes")
+
+    requested_by = models.ForeignKey(CustomUser, on_delete=models.SET_NULL, null=True, blank=True,
+                                     related_name='export_jobs')
+
+    # Timestamps
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True,
+                                        help_text="Last progress report of the worker running the job")
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'analytics_export_jobs'
+        ordering = ['-created_at']
+        verbose_name = 'Export Job'
+        verbose_name_plural = 'Export Jobs'
+
+    def __str__(self):
+        return f"Export #{self.pk} - {self.get_dataset_display()} ({self.status})"
+
+    @property
+    def progress_percent(self):
+        if self.status == 'completed':
+            return 100
+        if not self.rows_total:
+            return 0
+        return min(int(self.rows_exported * 100 / self.rows_total), 99)
+
+
+
+class SlowQuery(models.Model):
+    """
+    Queries slower than ANALYTICS_SLOW_QUERY_MS, one row per statement shape
+    (fingerprint) and call site, recorded by analytics.services.slow_queries
+    """
+    fingerprint = models.CharField(max_length=40, db_index=True, help_text="SHA-1 of the normalized SQL")
+    normalized_sql = models.TextField(help_text="Literals and parameters replaced by ?")
+    sample_sql = models.TextField(help_text="One occurrence as sent to the database")
+    sample_params = models.TextField(blank=True)
+    database = models.CharField(max_length=64)
+
+    # Call site
+    route = models.CharField(max_length=255, blank=True, help_text="URL pattern or management command")
+    function = models.CharField(max_length=255, blank=True, help_text="Innermost project frame that ran the query")
+
+    # Timings
+    calls = models.PositiveIntegerField(default=1)
+    total_ms = models.FloatField()
+    max_ms = models.FloatField()
+    last_ms = models.FloatField()
+
+    plan = models.TextField(blank=True, help_text="EXPLAIN output, captured once per fingerprint")
+
+    first_seen_at = models.DateTimeField(auto_now_add=True)
+    last_seen_at = models.DateTimeField()
+
+    class Meta:
+        db_table = 'analytics_slow_queries'
+        ordering = ['-total_ms']
+        verbose_name = 'Slow Query'
+        verbose_name_plural = 'Slow Queries'
+        constraints = [
+            models.UniqueConstraint(fields=['fingerprint', 'route', 'function'], name='slow_query_call_site'),
+        ]
+
+    def __str__(self):
+        return f"{self.normalized_sql[:80]} ({self.calls}x)"
+
+    @property
+    def avg_ms(self):
+        return self.total_ms / self.calls if self.calls else 0
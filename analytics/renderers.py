@@ -0,0 +1,92 @@
+import json
+import zlib
+
+import msgpack
+import orjson
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from ninja.parser import Parser
+from ninja.renderers import BaseRenderer, JSONRenderer
+from ninja.responses import NinjaJSONEncoder
+
+
+# Dates and times are handed to NinjaJSONEncoder like everything orjson does
+# not serialize itself (Decimal, pydantic models, ...), so responses are the
+# same as with the stdlib renderer: millisecond precision, 'Z' for UTC,
+# Decimal as a string. UUIDs and the rest are serialized natively.
+ORJSON_OPTIONS = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+
+# Request bodies may be sent in MessagePack instead of JSON, and compressed
+MSGPACK_CONTENT_TYPES = ('application/msgpack', 'application/x-msgpack', 'application/vnd.msgpack')
+
+# zlib wbits: gzip header, zlib header (HTTP's "deflate"); raw deflate is tried if the latter fails
+CONTENT_ENCODINGS = {'gzip': 16 + zlib.MAX_WBITS, 'x-gzip': 16 + zlib.MAX_WBITS, 'deflate': zlib.MAX_WBITS}
+
+_encoder = NinjaJSONEncoder()
+
+
+def _inflate(body: bytes, wbits: int) -> bytes:
+    # Decompressed bodies get the same limit Django applies to plain ones
+    limit = settings.DATA_UPLOAD_MAX_MEMORY_SIZE
+    decompressor = zlib.decompressobj(wbits)
+    data = decompressor.decompress(body, limit + 1 if limit is not None else 0)
+    if limit is not None and len(data) > limit:
+        raise ValueError(f"Decompressed request body is larger than {limit} bytes")
+    if not decompressor.eof:
+        raise ValueError("Truncated compressed request body")
+    return data
+
+
+def decoded_body(request) -> bytes:
+    """Request body with its Content-Encoding (gzip or deflate) undone"""
+    encoding = request.headers.get('Content-Encoding', '').strip().lower()
+    if not encoding or encoding == 'identity':
+        return request.body
+    if encoding not in CONTENT_ENCODINGS:
+        raise ValueError(f"Unsupported Content-Encoding: {encoding}")
+    try:
+        return _inflate(request.body, CONTENT_ENCODINGS[encoding])
+    except zlib.error:
+        if encoding != 'deflate':
+            raise
+        # Some clients send raw deflate data without the zlib header
+        return _inflate(request.body, -zlib.MAX_WBITS)
+
+
+class BeaconParser(Parser):
+    """
+    Request bodies in JSON or MessagePack (by Content-Type), optionally
+    gzip/deflate compressed. Anything that cannot be decoded ends as a 400.
+    """
+    loads = staticmethod(json.loads)
+
+    def parse_body(self, request):
+        body = decoded_body(request)
+        if request.content_type in MSGPACK_CONTENT_TYPES:
+            return msgpack.unpackb(body, raw=False)
+        return self.loads(body)
+
+
+class ORJSONParser(BeaconParser):
+    loads = staticmethod(orjson.loads)
+
+
+class ORJSONRenderer(BaseRenderer):
+    media_type = 'application/json'
+
+    def render(self, request, data, *, response_status):
+        return orjson.dumps(data, default=_encoder.default, option=ORJSON_OPTIONS)
+
+
+def api_parser_and_renderer(name: str):
+    """
+    Parser and renderer for NinjaAPI from ANALYTICS_API_JSON
+
+    Returns:
+        (parser, renderer); 'orjson' or 'json' (the stdlib, Ninja's default)
+    """
+    if name == 'orjson':
+        return ORJSONParser(), ORJSONRenderer()
+    if name == 'json':
+        return BeaconParser(), JSONRenderer()
+    raise ImproperlyConfigured(f"Unknown ANALYTICS_API_JSON: {name!r} (expected 'orjson' or 'json')")
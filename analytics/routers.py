@@ -0,0 +1,202 @@
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+
+logger = logging.getLogger(__name__)
+
+REPLICA_DB_ALIAS = 'replica'
+
+# Alias reads are sent to for the current request/task; None means the primary
+_read_alias = ContextVar('analytics_read_alias', default=None)
+
+# Shard alias of the API key the current request/task works on; None when
+# not bound to one key (see ShardRouter)
+_shard_alias = ContextVar('analytics_shard_alias', default=None)
+
+# Tracking data split across shards by API key (APIKey.shard)
+SHARDED_MODELS = {'analytics.session', 'analytics.pageview', 'analytics.event', 'analytics.diagnosticresponse'}
+
+# (checked_at, healthy) from the last replica lag check
+_replica_state = {'checked_at': None, 'healthy': False}
+
+LAG_SQL = """
+SELECT CASE
+    WHEN NOT pg_is_in_recovery() THEN 0
+    WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+END
+"""
+
+
+def replica_configured() -> bool:
+    return REPLICA_DB_ALIAS in settings.DATABASES
+
+
+def replica_lag_seconds():
+    """
+    Replay lag of the replica
+
+    A replica that has replayed everything it received reports 0 even if
+    the primary has been idle. A database that is not in recovery (e.g. a
+    second local database standing in for a replica) always reports 0.
+
+    Returns:
+        Lag in seconds, or None if the replica cannot be reached
+    """
+    try:
+        with connections[REPLICA_DB_ALIAS].cursor() as cursor:
+            cursor.execute(LAG_SQL)
+            return float(cursor.fetchone()[0])
+    except DatabaseError:
+        logger.warning("Replica lag check failed", exc_info=True)
+        connections[REPLICA_DB_ALIAS].close()
+        return None
+
+
+def replica_healthy() -> bool:
+    """
+    Whether reads may go to the replica: configured, reachable and lagging
+    less than ANALYTICS_REPLICA_MAX_LAG_SECONDS
+
+    The result is cached for ANALYTICS_REPLICA_LAG_CHECK_INTERVAL seconds
+    per process so the check costs one query every few seconds at most.
+    """
+    if not replica_configured():
+        return False
+
+    now = time.monotonic()
+    checked_at = _replica_state['checked_at']
+    if checked_at is None or now - checked_at >= settings.ANALYTICS_REPLICA_LAG_CHECK_INTERVAL:
+        lag = replica_lag_seconds()
+        _replica_state['healthy'] = lag is not None and lag <= settings.ANALYTICS_REPLICA_MAX_LAG_SECONDS
+        _replica_state['checked_at'] = now
+        if lag is not None and not _replica_state['healthy']:
+            logger.warning("Replica is %.1fs behind, reading from the primary", lag)
+    return _replica_state['healthy']
+
+
+def replica_alias() -> str:
+    """The replica alias if it can take reads right now, else the primary"""
+    return REPLICA_DB_ALIAS if replica_healthy() else DEFAULT_DB_ALIAS
+
+
+def read_alias() -> str:
+    """Alias the router currently sends reads to"""
+    return _read_alias.get() or DEFAULT_DB_ALIAS
+
+
+@contextmanager
+def reads_from(alias: str = None):
+    """
+    Route reads inside the block to ``alias`` (None or 'default' for the primary)
+
+    Asking for the replica falls back to the primary when it is unhealthy.
+    """
+    if alias == REPLICA_DB_ALIAS:
+        alias = replica_alias()
+    token = _read_alias.set(None if alias == DEFAULT_DB_ALIAS else alias)
+    try:
+        yield
+    finally:
+        _read_alias.reset(token)
+
+
+def shard_aliases() -> list:
+    """Every database holding tracking data, the primary first"""
+    return [DEFAULT_DB_ALIAS, *settings.ANALYTICS_SHARDS]
+
+
+def current_shard() -> str:
+    return _shard_alias.get() or DEFAULT_DB_ALIAS
+
+
+@contextmanager
+def use_shard(alias: str):
+    """Route Session, PageView, Event and DiagnosticResponse queries inside the block to a shard"""
+    token = _shard_alias.set(alias or DEFAULT_DB_ALIAS)
+    try:
+        yield
+    finally:
+        _shard_alias.reset(token)
+
+
+class ShardRouter:
+    """
+    Send tracking models to the shard of the API key being worked on
+
+    The shard comes from use_shard() (set for tracking requests by
+    APIKeyAuth), else from the instance the query starts from. Rows on the
+    primary shard, and every other model, are left to the next router.
+    Dictionary tables, API keys and users live on the primary; API keys
+    and the users sessions link to are mirrored to the shards (see
+    analytics.services.sharding).
+    """
+
+    def _shard(self, model, instance=None):
+        if model._meta.label_lower not in SHARDED_MODELS:
+            return None
+        alias = _shard_alias.get()
+        if alias is None and instance is not None:
+            alias = self._shard_of(instance)
+        return alias if alias in settings.ANALYTICS_SHARDS else None
+
+    @staticmethod
+    def _shard_of(instance):
+        # The instance hint is the row a query or new row is related to
+        if instance._meta.label_lower == 'analytics.apikey':
+            return instance.shard or DEFAULT_DB_ALIAS
+        if instance._state.db is not None:
+            return instance._state.db
+        fields_cache = instance._state.fields_cache
+        if 'session' in fields_cache:
+            return fields_cache['session']._state.db
+        if 'api_key' in fields_cache:
+            return fields_cache['api_key'].shard or DEFAULT_DB_ALIAS
+        return None
+
+    def db_for_read(self, model, **hints):
+        return self._shard(model, hints.get('instance'))
+
+    def db_for_write(self, model, **hints):
+        return self._shard(model, hints.get('instance'))
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Shards carry the full schema so foreign keys to mirrored rows hold
+        return None
+
+
+class ReplicaRouter:
+    """
+    Send reads to the replica where the current request or task opted in
+    (see analytics.middleware.ReplicaRoutingMiddleware and reads_from()),
+    and everything else, including every write, to the primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        alias = _read_alias.get()
+        if alias is None:
+            return DEFAULT_DB_ALIAS
+        # Inside a transaction on the primary, read what it has written
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return alias
+
+    def db_for_write(self, model, **hints):
+        # Explicit, because instances read from the replica would otherwise
+        # be saved back to it
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Same data on both aliases
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db != REPLICA_DB_ALIAS
@@ -1,9 +1,12 @@
+import pydantic
 from ninja import Schema
 from datetime import datetime
 from typing import Optional
 from decimal import Decimal
 from uuid import UUID 
-from typing import Any, Dict
+from typing import Any, Dict, List
+
+from analytics.models import EventCategory, EventType
 
 # ============== ERROR SCHEMAS ==============
 
@@ -53,8 +56,10 @@ class PageViewSchema(Schema):
 class EventSchema(Schema):
     api_key: str
     session_id: str
-    event_type: str
-    event_category: Optional[str] = None
+    event_type: str = pydantic.Field(max_length=EventType._meta.get_field('name').max_length)
+    event_category: Optional[str] = pydantic.Field(
+        None, max_length=EventCategory._meta.get_field('name').max_length,
+    )
     event_label: Optional[str] = None
     event_value: Optional[Decimal] = None
     
@@ -73,6 +78,28 @@ class EventSchema(Schema):
     time_spent_seconds: Optional[int] = None
 
 
+# Batches of events from one session: a positional array sending the
+# session-level fields once,
+#   [BATCH_FORMAT_VERSION, api_key, session_id, page_url, [event, ...]]
+# where each event is an array of BATCH_EVENT_FIELDS values in that order.
+# Trailing fields can be left out; an event's page_url (null for the
+# batch's) is for events sent after navigating.
+BATCH_FORMAT_VERSION = 1
+BATCH_EVENT_FIELDS = (
+    'event_type', 'time_since_page_load_ms', 'time_since_session_start_seconds',
+    'event_category', 'event_label', 'event_value',
+    'element_id', 'element_class', 'element_text', 'element_tag',
+    'page_url', 'page_path', 'metadata', 'time_spent_seconds',
+)
+
+# EventSchema's fields on a plain pydantic model, for batches: Ninja's Schema
+# reads its input through a getter meant for ORM objects, which costs ten
+# times the validation itself (see `manage.py bench_ingestion`)
+BatchEventSchema = pydantic.create_model(
+    'BatchEventSchema', **{name: (field.annotation, field) for name, field in EventSchema.model_fields.items()},
+)
+
+
 # ============== ANALYTICS RESPONSE SCHEMAS ==============
 
 class SessionOut(Schema):
@@ -120,6 +147,22 @@ class DashboardStats(Schema):
     conversion_rate: float
 
 
+class LivePageOut(Schema):
+    page_path: str
+    active_sessions: int
+
+
+class LiveVisitorsOut(Schema):
+    minutes: int
+    active_sessions: int
+    pages: List[LivePageOut]
+
+
+class StreamTokenOut(Schema):
+    token: str
+    expires_in: int
+
+
 # ============== EMAIL & DIAGNOSTIC SCHEMAS ==============
 
 class CaptureEmailSchema(Schema):
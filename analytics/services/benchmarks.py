@@ -0,0 +1,413 @@
+# analytics/services/benchmarks.py
+import gzip
+import json
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+import uuid
+from contextlib import contextmanager
+from decimal import Decimal
+from itertools import cycle
+from datetime import datetime, timezone as dt_timezone
+from pathlib import Path
+
+import msgpack
+from django.conf import settings
+from django.db import transaction
+from django.http import HttpResponse
+from django.test import RequestFactory
+from django.urls import path
+from django.utils import timezone
+from django.views.decorators.csrf import csrf_exempt
+
+from analytics.api.tracking import classify_source, get_or_create_session, parse_event_batch, parse_user_agent
+from analytics.middleware import MiddlewareStack
+from analytics.models import APIKey, DiagnosticResponse, Session
+from analytics.renderers import ORJSONParser, api_parser_and_renderer
+from analytics.schemas import (
+    BATCH_EVENT_FIELDS, BATCH_FORMAT_VERSION, DiagnosticResponseOut, EventSchema, PageViewSchema, SessionOut,
+)
+from analytics.services.bot_detector import calculate_bot_score
+from analytics.services.live import LiveWindow
+
+
+# Each benchmark is a setup function returning the zero-argument callable to
+# time. Setups run inside a transaction that is rolled back afterwards, so
+# benchmarks touching the database leave nothing behind.
+BENCHMARKS = {}
+
+SAMPLE_USER_AGENTS = [
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36',
+    'Mozilla/5.0 (iPhone; CPU iPhone OS 17_1 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Mobile/15E148',
+    'Mozilla/5.0 (Linux; Android 14; Pixel 8) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Mobile Safari/537.36',
+    'Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)',
+]
+
+PAGEVIEW_PAYLOAD = {
+    'api_key': 'bench', 'session_id': '6f1c8a54-4c3e-4d5e-9a43-1b2c3d4e5f60',
+    'page_url': 'https://example.com/pricing?plan=pro', 'page_title': 'Pricing', 'page_path': '/pricing',
+    'referrer_url': 'https://www.google.com/search?q=analytics', 'user_agent': SAMPLE_USER_AGENTS[0],
+    'screen_resolution': '1920x1080', 'language': 'en', 'utm_source': 'google', 'utm_medium': 'cpc',
+}
+
+EVENT_PAYLOAD = {
+    'api_key': 'bench', 'session_id': '6f1c8a54-4c3e-4d5e-9a43-1b2c3d4e5f60',
+    'event_type': 'diagnostic_step_completed', 'event_category': 'Diagnostic', 'event_label': 'Step 2',
+    'event_value': '12.50', 'element_id': 'next', 'element_class': 'btn btn-primary', 'element_text': 'Next',
+    'element_tag': 'button', 'page_url': 'https://example.com/diagnostic', 'page_path': '/diagnostic',
+    'time_since_page_load_ms': 5300, 'time_since_session_start_seconds': 94,
+    'metadata': {'step_number': 2, 'answer': 'b'}, 'time_spent_seconds': 12,
+}
+
+
+def benchmark(name):
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return register
+
+
+def _api_key():
+    return APIKey.objects.create(key=f'bench-{uuid.uuid4().hex}', name='Benchmark', domain='example.com')
+
+
+@benchmark('session.create')
+def _session_create():
+    api_key = _api_key()
+    return lambda: get_or_create_session(api_key, str(uuid.uuid4()), PAGEVIEW_PAYLOAD, '203.0.113.7',
+                                         PAGEVIEW_PAYLOAD['user_agent'])
+
+
+@benchmark('session.existing')
+def _session_existing():
+    api_key = _api_key()
+    session_id = str(uuid.uuid4())
+    args = (api_key, session_id, PAGEVIEW_PAYLOAD, '203.0.113.7', PAGEVIEW_PAYLOAD['user_agent'])
+    get_or_create_session(*args)
+    return lambda: get_or_create_session(*args)
+
+
+@benchmark('parse_user_agent')
+def _parse_user_agent():
+    agents = cycle(SAMPLE_USER_AGENTS)
+    return lambda: parse_user_agent(next(agents))
+
+
+@benchmark('classify_source')
+def _classify_source():
+    return lambda: classify_source(PAGEVIEW_PAYLOAD)
+
+
+@benchmark('calculate_bot_score')
+def _calculate_bot_score():
+    session = Session(user_agent=SAMPLE_USER_AGENTS[0], page_views_count=12, events_count=0,
+                      created_at=timezone.now(), source='direct')
+    return lambda: calculate_bot_score(session, time_spent=1)
+
+
+@benchmark('schema.pageview')
+def _schema_pageview():
+    body = json.dumps(PAGEVIEW_PAYLOAD)
+    return lambda: PageViewSchema.model_validate_json(body)
+
+
+@benchmark('schema.event')
+def _schema_event():
+    body = json.dumps(EVENT_PAYLOAD)
+    return lambda: EventSchema.model_validate_json(body)
+
+
+@benchmark('render.track_response')
+def _render_track_response():
+    from django_project.api import api
+    request = RequestFactory().post('/api/track/pageview')
+    data = {'status': 'success', 'session_id': PAGEVIEW_PAYLOAD['session_id']}
+    return lambda: api.create_response(request, data, status=200)
+
+
+@benchmark('render.sessions')
+def _render_sessions():
+    from django_project.api import api
+    request = RequestFactory().get('/api/analytics/sessions')
+    sessions = [
+        Session(id=i, session_id=uuid.uuid4(), source='organic', device_type='desktop',
+                landing_page_url='https://example.com/', page_views_count=3, events_count=5,
+                has_converted=False, created_at=timezone.now())
+        for i in range(50)
+    ]
+    return lambda: api.create_response(
+        request, [SessionOut.from_orm(session).model_dump() for session in sessions], status=200,
+    )
+
+
+# Rows in the large-payload parser/renderer benchmarks
+LARGE_PAYLOAD_ROWS = 1000
+
+
+def _large_sessions():
+    return [
+        SessionOut.from_orm(Session(
+            id=i, session_id=uuid.uuid4(), source='organic', device_type='desktop',
+            landing_page_url='https://example.com/pricing?plan=pro', page_views_count=3, events_count=5,
+            has_converted=i % 7 == 0, created_at=timezone.now(),
+        )).model_dump()
+        for i in range(LARGE_PAYLOAD_ROWS)
+    ]
+
+
+def _large_diagnostics():
+    return [
+        DiagnosticResponseOut.from_orm(DiagnosticResponse(
+            id=i, diagnostic_name='readiness', result_category='advanced', score=Decimal('72.50'),
+            completed_at=timezone.now(),
+        )).model_dump()
+        for i in range(LARGE_PAYLOAD_ROWS)
+    ]
+
+
+def _register_json_benchmarks(library):
+    parser, renderer = api_parser_and_renderer(library)
+
+    @benchmark(f'render.sessions_{LARGE_PAYLOAD_ROWS}.{library}')
+    def _render_sessions():
+        data = _large_sessions()
+        return lambda: renderer.render(None, data, response_status=200)
+
+    @benchmark(f'render.diagnostics_{LARGE_PAYLOAD_ROWS}.{library}')
+    def _render_diagnostics():
+        data = _large_diagnostics()
+        return lambda: renderer.render(None, data, response_status=200)
+
+    @benchmark(f'parse.events_{LARGE_PAYLOAD_ROWS}.{library}')
+    def _parse_events():
+        request = RequestFactory().post('/api/track/event', data=json.dumps([EVENT_PAYLOAD] * LARGE_PAYLOAD_ROWS),
+                                        content_type='application/json')
+        return lambda: parser.parse_body(request)
+
+
+for _library in ('json', 'orjson'):
+    _register_json_benchmarks(_library)
+
+
+# Events per batch in the batch format benchmarks
+BATCH_EVENTS = 100
+
+
+def _batch_bodies():
+    """The same BATCH_EVENTS events as JSON objects and as a positional batch"""
+    events = [{**EVENT_PAYLOAD, 'time_since_page_load_ms': 5300 + i} for i in range(BATCH_EVENTS)]
+    session_fields = ('api_key', 'session_id', 'page_url')
+    rows = [[event.get(field) for field in BATCH_EVENT_FIELDS] for event in events]
+    for row in rows:
+        row[BATCH_EVENT_FIELDS.index('page_url')] = None
+        while row[-1] is None:
+            row.pop()
+    return events, [BATCH_FORMAT_VERSION, *(EVENT_PAYLOAD[field] for field in session_fields), rows]
+
+
+def _register_batch_benchmark(name, content_type, encode, encoding=None):
+    @benchmark(f'parse.batch_{BATCH_EVENTS}.{name}')
+    def _parse_batch():
+        _, batch = _batch_bodies()
+        body = encode(batch)
+        headers = {'HTTP_CONTENT_ENCODING': encoding} if encoding else {}
+        request = RequestFactory().post('/api/track/batch', data=body, content_type=content_type, **headers)
+        parser = ORJSONParser()
+        return lambda: parser.parse_body(request)
+
+
+_register_batch_benchmark('json', 'application/json', json.dumps)
+_register_batch_benchmark('json_gzip', 'application/json', lambda batch: gzip.compress(json.dumps(batch).encode()),
+                          encoding='gzip')
+_register_batch_benchmark('msgpack', 'application/msgpack', msgpack.packb)
+_register_batch_benchmark('msgpack_gzip', 'application/msgpack', lambda batch: gzip.compress(msgpack.packb(batch)),
+                          encoding='gzip')
+
+
+@benchmark(f'schema.batch_{BATCH_EVENTS}')
+def _schema_batch():
+    _, batch = _batch_bodies()
+    return lambda: parse_event_batch(batch)
+
+
+@benchmark(f'schema.events_{BATCH_EVENTS}')
+def _schema_events():
+    # The same events validated one request at a time, for comparison
+    events, _ = _batch_bodies()
+    return lambda: [EventSchema.model_validate(event) for event in events]
+
+
+def _live_window(sessions: int):
+    # A window of its own, with the configured sizes, and `sessions` already active on 50 pages
+    window = LiveWindow(
+        Path(tempfile.gettempdir()) / 'analytics-live-benchmark', settings.ANALYTICS_LIVE_WINDOW_MINUTES or 30,
+        settings.ANALYTICS_LIVE_MAX_SESSIONS, settings.ANALYTICS_LIVE_MAX_API_KEYS,
+        settings.ANALYTICS_LIVE_PAGES_PER_KEY, settings.ANALYTICS_LIVE_STREAM_SECONDS,
+    )
+    for number in range(sessions):
+        window.touch(1, uuid.uuid4().bytes, f'/page-{number % 50}')
+    return window
+
+
+@benchmark('live.touch')
+def _live_touch():
+    window = _live_window(10000)
+    session_ids = cycle([uuid.uuid4().bytes for _ in range(1000)])
+    pages = cycle([f'/page-{number}' for number in range(50)])
+    return lambda: window.touch(1, next(session_ids), next(pages), page_views=1)
+
+
+@benchmark('live.active')
+def _live_active():
+    window = _live_window(10000)
+    return lambda: window.active(1, minutes=5)
+
+
+@benchmark('live.second_counts')
+def _live_second_counts():
+    # What the live stream reads once a second, for all its clients
+    window = _live_window(10000)
+    second = int(time.time())
+    return lambda: window.second_counts(second - 1, second - 1)
+
+
+@csrf_exempt
+def _noop_view(request):
+    return HttpResponse(status=204)
+
+
+# URLconf of the middleware benchmarks' requests: a tracking URL whose view
+# does nothing (API views are CSRF exempt too), so only middleware is timed
+urlpatterns = [path('api/track/noop', _noop_view)]
+
+
+def _middleware_benchmark(middleware):
+    handler = MiddlewareStack(middleware)
+    factory = RequestFactory()
+
+    def request():
+        request = factory.post('/api/track/noop', data=b'{}', content_type='application/json',
+                               HTTP_ORIGIN='https://example.com')
+        request.urlconf = __name__
+        return handler(request)
+    return request
+
+
+@benchmark('middleware.full_stack')
+def _middleware_full_stack():
+    return _middleware_benchmark(
+        [name for name in settings.MIDDLEWARE if name != 'analytics.middleware.TrackingFastLaneMiddleware']
+    )
+
+
+@benchmark('middleware.fast_lane')
+def _middleware_fast_lane():
+    return _middleware_benchmark(settings.MIDDLEWARE)
+
+
+@contextmanager
+def _rolled_back():
+    with transaction.atomic():
+        try:
+            yield
+        finally:
+            transaction.set_rollback(True)
+
+
+def _calibrate(func, min_time: float) -> int:
+    """Iterations per repeat so that one repeat lasts at least ``min_time`` seconds"""
+    number = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_time or number >= 10 ** 6:
+            return number
+        number = max(number * 2, int(number * min_time / max(elapsed, 1e-9) * 1.2))
+
+
+def run_benchmark(name: str, repeat: int = 5, min_time: float = 0.2) -> dict:
+    """
+    Time one benchmark: ``repeat`` repeats of an auto-calibrated number of calls
+
+    Returns:
+        Dict with per-call times in microseconds (median, min, stdev) and
+        the number of calls per repeat
+    """
+    with _rolled_back():
+        func = BENCHMARKS[name]()
+        func()  # warm-up: imports, caches, prepared statements
+        number = _calibrate(func, min_time)
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            for _ in range(number):
+                func()
+            timings.append((time.perf_counter() - started) / number * 1e6)
+    return {
+        'median_us': round(statistics.median(timings), 3),
+        'min_us': round(min(timings), 3),
+        'stdev_us': round(statistics.stdev(timings), 3) if len(timings) > 1 else 0.0,
+        'number': number,
+        'repeat': repeat,
+    }
+
+
+def _git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(names=None, repeat: int = 5, min_time: float = 0.2, log=None) -> dict:
+    """
+    Run the selected benchmarks (default: all)
+
+    Returns:
+        Dict with run metadata and a ``results`` dict keyed by benchmark name
+    """
+    results = {}
+    for name in names or BENCHMARKS:
+        results[name] = run_benchmark(name, repeat=repeat, min_time=min_time)
+        if log:
+            log(name, results[name])
+    return {
+        'revision': _git_revision(),
+        'created_at': datetime.now(dt_timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'results': results,
+    }
+
+
+def load_results(path) -> dict:
+    with open(Path(path)) as f:
+        return json.load(f)
+
+
+def compare(baseline: dict, current: dict, threshold: float = 0.1) -> list:
+    """
+    Per-benchmark change of the median time between two runs
+
+    Returns:
+        List of dicts with name, baseline_us, current_us, change (fraction)
+        and status ('slower', 'faster', 'same', or 'new'/'removed')
+    """
+    rows = []
+    names = list(dict.fromkeys([*baseline['results'], *current['results']]))
+    for name in names:
+        before = baseline['results'].get(name, {}).get('median_us')
+        after = current['results'].get(name, {}).get('median_us')
+        if before is None or after is None:
+            status = 'new' if before is None else 'removed'
+            rows.append({'name': name, 'baseline_us': before, 'current_us': after, 'change': None, 'status': status})
+            continue
+        change = (after - before) / before if before else 0.0
+        status = 'slower' if change > threshold else 'faster' if change < -threshold else 'same'
+        rows.append({'name': name, 'baseline_us': before, 'current_us': after, 'change': change, 'status': status})
+    return rows
@@ -57,6 +57,6 @@ def update_session_bot_score(session: Session, time_spent: int = None, honeypot_
     
     session.bot_score = score
     session.is_suspected_bot = (score >= 50)  # Threshold: 50+
-    session.save(update_fields=['bot_score', 'is_suspected_bot'])
+    session.save(update_fields=['bot_score', 'is_suspected_bot', 'last_activity_at'])
     
     return score
\ No newline at end of file
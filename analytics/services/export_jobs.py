@@ -0,0 +1,166 @@
+# analytics/services/export_jobs.py
+import gzip
+import os
+import time
+from datetime import timedelta
+from itertools import chain
+from pathlib import Path
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from analytics.models import ExportJob
+from analytics.routers import replica_alias
+from analytics.services.exporter import (
+    EXPORT_DATASETS, export_querysets, iter_rows, stream_csv, stream_ndjson,
+)
+
+
+def fail_stale_jobs(now=None) -> int:
+    """
+    Mark failed the running jobs whose worker stopped reporting progress
+    for ANALYTICS_EXPORT_JOB_TIMEOUT seconds (it crashed or was redeployed)
+
+    Returns:
+        Number of jobs failed
+    """
+    now = now or timezone.now()
+    timeout = settings.ANALYTICS_EXPORT_JOB_TIMEOUT
+    return (
+        ExportJob.objects.filter(status='running')
+        .alias(last_seen=Coalesce('heartbeat_at', 'started_at'))
+        .filter(last_seen__lt=now - timedelta(seconds=timeout))
+        .update(status='failed', error=f"The worker stopped: no progress for {timeout}s", finished_at=now)
+    )
+
+
+def claim_next_job():
+    """
+    Atomically take the oldest pending job and mark it running
+
+    SKIP LOCKED lets several workers poll the same table without
+    picking up the same job. Jobs left running by a dead worker are
+    failed first.
+
+    Returns:
+        ExportJob or None if the queue is empty
+    """
+    fail_stale_jobs()
+    with transaction.atomic():
+        job = (
+            ExportJob.objects.select_for_update(skip_locked=True)
+            .filter(status='pending')
+            .order_by('created_at')
+            .first()
+        )
+        if job is None:
+            return None
+
+        job.status = 'running'
+        job.started_at = job.heartbeat_at = timezone.now()
+        job.save(update_fields=['status', 'started_at', 'heartbeat_at'])
+        return job
+
+
+def job_file_path(job: ExportJob) -> Path:
+    return Path(settings.ANALYTICS_EXPORT_JOB_ROOT) / f"{job.dataset}-{job.pk}.{job.format}.gz"
+
+
+def _with_progress(job: ExportJob, rows, every: int):
+    """Pass rows through, saving rows_exported (and the heartbeat) every ``every`` rows"""
+    count = 0
+    for row in rows:
+        yield row
+        count += 1
+        if count % every == 0:
+            ExportJob.objects.filter(pk=job.pk).update(rows_exported=count, heartbeat_at=timezone.now())
+    job.rows_exported = count
+
+
+def run_export_job(job: ExportJob, chunk_size: int = None):
+    """
+    Write one export job to a gzip-compressed file
+
+    Rows are streamed from a server-side cursor straight into the gzip
+    stream, so memory does not grow with the size of the export. They are
+    read from the replica when it is healthy; job progress is written to
+    the primary.
+    """
+    chunk_size = chunk_size or settings.ANALYTICS_EXPORT_CHUNK_SIZE
+    fields = EXPORT_DATASETS[job.dataset]['fields']
+    querysets = export_querysets(
+        job.dataset,
+        start=job.start_date,
+        end=job.end_date,
+        api_key=job.api_key.key if job.api_key_id else None,
+        using=replica_alias(),
+    )
+
+    job.rows_total = sum(queryset.count() for queryset in querysets)
+    job.heartbeat_at = timezone.now()
+    job.save(update_fields=['rows_total', 'heartbeat_at'])
+
+    path = job_file_path(job)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + '.tmp')
+
+    rows = chain.from_iterable(iter_rows(queryset, fields, chunk_size=chunk_size) for queryset in querysets)
+    rows = _with_progress(job, rows, every=chunk_size)
+    chunks = stream_csv(rows, fields) if job.format == 'csv' else stream_ndjson(rows)
+
+    try:
+        with gzip.open(tmp_path, 'wt', encoding='utf-8', newline='') as f:
+            for chunk in chunks:
+                f.write(chunk)
+        os.replace(tmp_path, path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+    job.status = 'completed'
+    job.file_path = str(path)
+    job.file_size = path.stat().st_size
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'rows_exported', 'file_path', 'file_size', 'finished_at'])
+
+
+def process_next_job(chunk_size: int = None):
+    """
+    Claim and run a single pending job
+
+    Returns:
+        The processed ExportJob, or None if there was nothing to do
+    """
+    job = claim_next_job()
+    if job is None:
+        return None
+
+    try:
+        run_export_job(job, chunk_size=chunk_size)
+    except Exception as exc:
+        job.status = 'failed'
+        job.error = f"{type(exc).__name__}: {exc}"
+        job.finished_at = timezone.now()
+        job.save(update_fields=['status', 'error', 'finished_at'])
+
+    return job
+
+
+def run_worker(poll_interval: float = 5, once: bool = False, chunk_size: int = None, log=None):
+    """
+    Process export jobs until interrupted (or until the queue is empty with once=True)
+    """
+    while True:
+        close_old_connections()
+        job = process_next_job(chunk_size=chunk_size)
+
+        if job is not None:
+            if log:
+                log(f"{job}: {job.rows_exported} rows")
+            continue
+
+        if once:
+            return
+        time.sleep(poll_interval)
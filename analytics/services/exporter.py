@@ -0,0 +1,179 @@
+# analytics/services/exporter.py
+import csv
+import json
+from itertools import chain
+from datetime import date, datetime, time, timedelta
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import DEFAULT_DB_ALIAS
+from django.utils import timezone
+
+from analytics.models import Session, PageView, Event, DiagnosticResponse
+from analytics.routers import shard_aliases
+from analytics.services.sharding import shard_for_key
+
+
+# Datasets that can be bulk exported, with the timestamp used for date ranges
+# and the lookup used to filter by API key
+EXPORT_DATASETS = {
+    'sessions': {
+        'model': Session,
+        'date_field': 'created_at',
+        'api_key_field': 'api_key__key',
+        'fields': (
+            'id', 'session_id', 'api_key__name', 'user__email', 'email',
+            'source', 'referrer_domain', 'utm_source', 'utm_medium', 'utm_campaign',
+            'landing_page_url', 'device_type', 'browser', 'os', 'country',
+            'page_views_count', 'events_count', 'duration_seconds', 'is_bounce',
+            'has_converted', 'conversion_event', 'is_suspected_bot', 'bot_score',
+            'created_at', 'last_activity_at',
+        ),
+    },
+    'pageviews': {
+        'model': PageView,
+        'date_field': 'viewed_at',
+        'api_key_field': 'session__api_key__key',
+        'fields': (
+            'id', 'session__session_id', 'page_url', 'page_title', 'page_path',
+            'sequence_number', 'previous_page_url', 'time_on_page_seconds',
+            'scroll_depth_percent', 'viewed_at',
+        ),
+    },
+    'events': {
+        'model': Event,
+        'date_field': 'occurred_at',
+        'api_key_field': 'session__api_key__key',
+        'fields': (
+            'id', 'session__session_id', 'page_view_id', 'event_type', 'event_category',
+            'event_label', 'event_value', 'element_id', 'element_class', 'element_text',
+            'element_tag', 'page_url', 'page_path', 'time_since_page_load_ms',
+            'time_since_session_start_seconds', 'metadata', 'occurred_at',
+        ),
+    },
+    'diagnostics': {
+        'model': DiagnosticResponse,
+        'date_field': 'completed_at',
+        'api_key_field': 'session__api_key__key',
+        'fields': (
+            'id', 'session__session_id', 'session__email', 'diagnostic_name',
+            'diagnostic_version', 'answers', 'score', 'result_category', 'metadata',
+            'started_at', 'completed_at',
+        ),
+    },
+}
+
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+def day_bounds(start: date = None, end: date = None):
+    """
+    Convert an inclusive date range into aware datetime bounds
+
+    Returns:
+        (lower, upper) where upper is exclusive; either may be None
+    """
+    lower = upper = None
+    if start:
+        lower = timezone.make_aware(datetime.combine(start, time.min))
+    if end:
+        upper = timezone.make_aware(datetime.combine(end + timedelta(days=1), time.min))
+    return lower, upper
+
+
+def get_export_queryset(dataset: str, start: date = None, end: date = None, api_key: str = None,
+                        using: str = None):
+    """
+    Build the queryset for one export dataset
+
+    Filters on the raw timestamp (not __date) so the range stays index-friendly,
+    and orders by primary key so chunked reads are stable. ``using`` pins the
+    database alias, e.g. the read replica.
+    """
+    spec = EXPORT_DATASETS[dataset]
+    date_field = spec['date_field']
+
+    qs = spec['model'].objects.using(using) if using else spec['model'].objects.all()
+    lower, upper = day_bounds(start, end)
+    if lower:
+        qs = qs.filter(**{f'{date_field}__gte': lower})
+    if upper:
+        qs = qs.filter(**{f'{date_field}__lt': upper})
+    if api_key:
+        qs = qs.filter(**{spec['api_key_field']: api_key})
+
+    return qs.order_by('pk')
+
+
+def export_querysets(dataset: str, start: date = None, end: date = None, api_key: str = None,
+                     using: str = None):
+    """
+    Export querysets for every shard holding rows of the dataset (only the
+    key's own shard when filtering by API key)
+
+    ``using`` stands in for the primary shard, e.g. the read replica.
+    """
+    aliases = [shard_for_key(api_key)] if api_key else shard_aliases()
+    return [
+        get_export_queryset(dataset, start=start, end=end, api_key=api_key,
+                            using=using if alias == DEFAULT_DB_ALIAS else alias)
+        for alias in aliases
+    ]
+
+
+def iter_rows(queryset, fields, chunk_size: int = None):
+    """
+    Yield export rows as dicts using a server-side cursor
+
+    Only chunk_size rows are held in memory at a time.
+    """
+    chunk_size = chunk_size or settings.ANALYTICS_EXPORT_CHUNK_SIZE
+    return queryset.values(*fields).iterator(chunk_size=chunk_size)
+
+
+def stream_ndjson(rows):
+    """Serialize rows as newline-delimited JSON"""
+    encoder = DjangoJSONEncoder(ensure_ascii=False)
+    for row in rows:
+        yield encoder.encode(row) + '\n'
+
+
+class _Echo:
+    """File-like object whose write() returns the value, for csv.writer streaming"""
+
+    def write(self, value):
+        return value
+
+
+def _csv_value(value):
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False, cls=DjangoJSONEncoder)
+    return value
+
+
+def stream_csv(rows, fields):
+    """Serialize rows as CSV with a header line"""
+    writer = csv.writer(_Echo())
+    yield writer.writerow(fields)
+    for row in rows:
+        yield writer.writerow([_csv_value(row[field]) for field in fields])
+
+
+def stream_export(dataset: str, fmt: str = 'ndjson', start: date = None, end: date = None,
+                  api_key: str = None, chunk_size: int = None, using: str = None):
+    """
+    Stream one dataset in the requested format
+
+    Returns:
+        Generator of text chunks (one per row, plus the CSV header)
+    """
+    fields = EXPORT_DATASETS[dataset]['fields']
+    querysets = export_querysets(dataset, start=start, end=end, api_key=api_key, using=using)
+    rows = chain.from_iterable(iter_rows(queryset, fields, chunk_size=chunk_size) for queryset in querysets)
+
+    if fmt == 'csv':
+        return stream_csv(rows, fields)
+    return stream_ndjson(rows)
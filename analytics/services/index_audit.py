@@ -0,0 +1,108 @@
+# analytics/services/index_audit.py
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+# Per-index statistics, with partition indexes rolled up to their partitioned
+# parent so a partitioned table reports one row per logical index
+INDEX_USAGE_SQL = """
+WITH leaf AS (
+    SELECT
+        COALESCE(pg_partition_root(s.relid), s.relid) AS table_oid,
+        COALESCE(pg_partition_root(s.indexrelid), s.indexrelid) AS index_oid,
+        pg_relation_size(s.indexrelid) AS size_bytes,
+        s.idx_scan,
+        s.idx_tup_read
+    FROM pg_stat_user_indexes s
+    WHERE s.schemaname = current_schema()
+),
+tables AS (
+    SELECT
+        COALESCE(pg_partition_root(t.relid), t.relid) AS table_oid,
+        SUM(t.n_tup_ins + t.n_tup_upd - t.n_tup_hot_upd) AS index_writes,
+        SUM(t.n_tup_ins + t.n_tup_upd + t.n_tup_del) AS row_writes
+    FROM pg_stat_user_tables t
+    WHERE t.schemaname = current_schema()
+    GROUP BY 1
+)
+SELECT
+    tc.relname AS table_name,
+    ic.relname AS index_name,
+    am.amname AS method,
+    pg_get_indexdef(leaf.index_oid) AS definition,
+    i.indisprimary OR i.indisunique AS is_unique,
+    i.indkey::text AS columns,
+    i.indclass::text AS opclasses,
+    i.indexprs IS NOT NULL OR i.indpred IS NOT NULL AS is_expression,
+    SUM(leaf.size_bytes)::bigint AS size_bytes,
+    SUM(leaf.idx_scan)::bigint AS scans,
+    SUM(leaf.idx_tup_read)::bigint AS tuples_read,
+    COALESCE(MAX(tables.index_writes), 0)::bigint AS index_writes,
+    COALESCE(MAX(tables.row_writes), 0)::bigint AS row_writes
+FROM leaf
+JOIN pg_class tc ON tc.oid = leaf.table_oid
+JOIN pg_class ic ON ic.oid = leaf.index_oid
+JOIN pg_index i ON i.indexrelid = leaf.index_oid
+JOIN pg_am am ON am.oid = ic.relam
+LEFT JOIN tables ON tables.table_oid = leaf.table_oid
+WHERE tc.relname LIKE %s
+GROUP BY tc.relname, ic.relname, am.amname, leaf.index_oid, i.indisprimary, i.indisunique,
+         i.indkey, i.indclass, i.indexprs, i.indpred
+ORDER BY tc.relname, SUM(leaf.size_bytes) DESC
+"""
+
+
+def index_usage(table_pattern: str = 'analytics_%', using: str = DEFAULT_DB_ALIAS):
+    """
+    Collect size, scan and write statistics for every index
+
+    Statistics are cumulative since the last pg_stat_reset(), so read
+    scan counts relative to how long the server has been collecting.
+
+    Returns:
+        List of dicts, one per index (partition indexes summed into their parent)
+    """
+    with connections[using].cursor() as cursor:
+        cursor.execute(INDEX_USAGE_SQL, [table_pattern])
+        columns = [col[0] for col in cursor.description]
+        rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    by_table = {}
+    for row in rows:
+        row['columns'] = [int(c) for c in row['columns'].split()]
+        row['opclasses'] = [int(c) for c in row['opclasses'].split()]
+        row['writes_per_scan'] = round(row['index_writes'] / row['scans'], 1) if row['scans'] else None
+        by_table.setdefault(row['table_name'], []).append(row)
+
+    for table_rows in by_table.values():
+        for row in table_rows:
+            row['indexes_on_table'] = len(table_rows)
+            row['flags'] = _flags(row, table_rows)
+
+    return rows
+
+
+def _flags(row, table_rows):
+    """Heuristic warnings for one index"""
+    flags = []
+    if row['is_unique']:
+        return flags
+
+    if not row['scans']:
+        flags.append('unused')
+    elif row['writes_per_scan'] and row['writes_per_scan'] > 100:
+        flags.append('write-heavy')
+
+    # A plain btree whose columns (and operator classes) are a leading prefix
+    # of another btree is redundant
+    width = len(row['columns'])
+    if row['method'] == 'btree' and not row['is_expression'] and 0 not in row['columns']:
+        for other in table_rows:
+            if other is row or other['method'] != 'btree' or other['is_expression']:
+                continue
+            if other['columns'][:width] == row['columns'] \
+                    and other['opclasses'][:width] == row['opclasses'] \
+                    and (len(other['columns']) > width or other['is_unique']):
+                flags.append(f"redundant with {other['index_name']}")
+                break
+
+    return flags
@@ -0,0 +1,364 @@
+# analytics/services/live.py
+import fcntl
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from collections import defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+
+from django.conf import settings
+
+
+logger = logging.getLogger(__name__)
+
+# Sessions active in the last minutes, per API key and page, kept in a file
+# mapped into memory by every worker on the host (ANALYTICS_LIVE_PATH, in
+# /dev/shm by default). Each API key has one counter per minute of the
+# window (ANALYTICS_LIVE_WINDOW_MINUTES), and so has each of its pages; a
+# session is counted once, in the minute and page it was last seen on. The
+# session table remembers those so the next request of the session can
+# move it. Every table has a fixed size, so updates and reads do a bounded
+# amount of work however busy the site is:
+# - a session is looked up in SESSION_PROBES slots; when all are in use the
+#   one seen longest ago is dropped (and uncounted)
+# - pages beyond ANALYTICS_LIVE_PAGES_PER_KEY per key are not broken down
+# - API keys beyond ANALYTICS_LIVE_MAX_API_KEYS are not counted
+# Reading sums the minute counters of a key and its pages (of every key in
+# use when no key is given).
+#
+# The same requests also add to a ring of per-second counters per API key
+# (page views, events, conversions, sessions flagged as bots), the last
+# ANALYTICS_LIVE_STREAM_SECONDS seconds of it, read by the live stream
+# (analytics.services.live_stream).
+#
+# The layout (MAGIC and the table sizes) is part of the file name: processes
+# started with other settings, e.g. during a rolling deploy, use a file of
+# their own instead of resizing one that others have mapped.
+
+MAGIC = b'ALIVE002'
+HEADER = struct.Struct('<8sIIIII')  # magic, window minutes, sessions, API keys, pages per key, seconds
+BUCKET = struct.Struct('<ii')  # minute, count
+KEY_ID = struct.Struct('<q')  # API key id, 0 for a free entry
+SESSION = struct.Struct('<16siii')  # session id, key index, page index (-1: none), minute
+SECOND = struct.Struct('<iiiii')  # second, page views, events, conversions, bot flags
+COUNTERS = ('page_views', 'events', 'conversions', 'bot_flags')
+PAGE_BYTES = 120
+SESSION_PROBES = 8
+KEY_PROBES = 16
+
+
+def _minute(now: float = None) -> int:
+    return int((now if now is not None else time.time()) // 60)
+
+
+class LiveWindow:
+    """
+    Shared sliding window of active sessions (see the comment above)
+
+    Opened lazily, and again in every process (workers are forked): flock()
+    locks are shared by processes that inherited the same file descriptor.
+    """
+
+    def __init__(self, path, window: int, sessions: int, api_keys: int, pages: int, seconds: int):
+        self.path = Path(path)
+        self.file = self.path.with_name(
+            f"{self.path.name}.{MAGIC.decode().lower()}-{window}-{sessions}-{api_keys}-{pages}-{seconds}"
+        )
+        self.window = window
+        self.sessions = sessions
+        self.api_keys = api_keys
+        self.pages = pages
+        self.seconds = seconds
+        self.key_size = KEY_ID.size + window * BUCKET.size
+        self.page_size = PAGE_BYTES + window * BUCKET.size
+        self.keys_offset = HEADER.size
+        self.pages_offset = self.keys_offset + api_keys * self.key_size
+        self.sessions_offset = self.pages_offset + api_keys * pages * self.page_size
+        self.seconds_offset = self.sessions_offset + sessions * SESSION.size
+        self.size = self.seconds_offset + api_keys * seconds * SECOND.size
+        self._lock = threading.Lock()
+        self._pid = None
+        self._fd = None
+        self._map = None
+
+    @property
+    def config(self) -> tuple:
+        return self.path, self.window, self.sessions, self.api_keys, self.pages, self.seconds
+
+    # ─── File ──────────────────────────────────────────────
+
+    def _open(self):
+        if self._pid == os.getpid():
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd = os.open(self.file, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            header = HEADER.pack(MAGIC, self.window, self.sessions, self.api_keys, self.pages, self.seconds)
+            size = os.fstat(fd).st_size
+            if not size:
+                os.ftruncate(fd, self.size)
+                os.pwrite(fd, header, 0)
+            elif size != self.size or os.pread(fd, HEADER.size, 0) != header:
+                # Never rewritten in place: other processes may have it mapped
+                raise ValueError(f"{self.file} is not a live window of this layout")
+            self._map = mmap.mmap(fd, self.size)
+        except BaseException:
+            os.close(fd)  # and with it the lock
+            raise
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        self._fd = fd
+        self._pid = os.getpid()
+
+    @contextmanager
+    def _locked(self):
+        with self._lock:
+            self._open()
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                yield self._map
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    # ─── Buckets ───────────────────────────────────────────
+
+    def _bucket_offset(self, base: int, minute: int) -> int:
+        return base + (minute % self.window) * BUCKET.size
+
+    def _add(self, buf, base: int, minute: int, delta: int):
+        offset = self._bucket_offset(base, minute)
+        stamp, count = BUCKET.unpack_from(buf, offset)
+        if stamp != minute:
+            if delta < 0:
+                return  # Already expired
+            count = 0
+        BUCKET.pack_into(buf, offset, minute, max(count + delta, 0))
+
+    def _sum(self, buf, base: int, since: int, minute: int) -> int:
+        return sum(count for stamp, count in BUCKET.iter_unpack(buf[base:base + self.window * BUCKET.size])
+                   if since < stamp <= minute)
+
+    def _second_offset(self, key_index: int, second: int) -> int:
+        return self.seconds_offset + (key_index * self.seconds + second % self.seconds) * SECOND.size
+
+    def _key_buckets(self, key_index: int) -> int:
+        return self.keys_offset + key_index * self.key_size + KEY_ID.size
+
+    def _page_offset(self, key_index: int, page_index: int) -> int:
+        return self.pages_offset + (key_index * self.pages + page_index) * self.page_size
+
+    # ─── Lookups ───────────────────────────────────────────
+
+    def _key_index(self, buf, api_key_id: int, create: bool):
+        for probe in range(min(KEY_PROBES, self.api_keys)):
+            index = (api_key_id + probe) % self.api_keys
+            offset = self.keys_offset + index * self.key_size
+            (stored,) = KEY_ID.unpack_from(buf, offset)
+            if stored == api_key_id:
+                return index
+            if stored == 0:
+                if not create:
+                    return None
+                KEY_ID.pack_into(buf, offset, api_key_id)
+                return index
+        return None
+
+    def _page_index(self, buf, key_index: int, page: bytes, minute: int):
+        """Index of a page of a key, taking a free or idle entry for a new one"""
+        start = zlib.crc32(page) % self.pages
+        for probe in range(self.pages):
+            index = (start + probe) % self.pages
+            offset = self._page_offset(key_index, index)
+            stored = buf[offset:offset + PAGE_BYTES].rstrip(b'\0')
+            if stored == page:
+                return index
+            if not stored:
+                break
+        else:
+            # Every entry is taken: reuse one no session was counted on lately
+            for probe in range(self.pages):
+                index = (start + probe) % self.pages
+                offset = self._page_offset(key_index, index)
+                if not self._sum(buf, offset + PAGE_BYTES, minute - self.window, minute):
+                    break
+            else:
+                return -1
+        buf[offset:offset + self.page_size] = bytes(self.page_size)
+        buf[offset:offset + len(page)] = page
+        return index
+
+    def _uncount(self, buf, key_index: int, page_index: int, minute: int):
+        self._add(buf, self._key_buckets(key_index), minute, -1)
+        if page_index >= 0:
+            self._add(buf, self._page_offset(key_index, page_index) + PAGE_BYTES, minute, -1)
+
+    # ─── API ───────────────────────────────────────────────
+
+    def _count(self, buf, key_index: int, second: int, deltas: tuple):
+        if not self.seconds or not any(deltas):
+            return
+        offset = self._second_offset(key_index, second)
+        stored, *counts = SECOND.unpack_from(buf, offset)
+        if stored != second:
+            counts = [0] * len(COUNTERS)
+        SECOND.pack_into(buf, offset, second, *(count + delta for count, delta in zip(counts, deltas)))
+
+    def count(self, api_key_id: int, now: float = None,
+              page_views: int = 0, events: int = 0, conversions: int = 0, bot_flags: int = 0):
+        """Add to the counters of the current second of an API key"""
+        deltas = (page_views, events, conversions, bot_flags)
+        if not any(deltas):
+            return
+        second = int(time.time() if now is None else now)
+        with self._locked() as buf:
+            key_index = self._key_index(buf, api_key_id, create=True)
+            if key_index is not None:
+                self._count(buf, key_index, second, deltas)
+
+    def touch(self, api_key_id: int, session_id: bytes, page: str, now: float = None,
+              page_views: int = 0, events: int = 0, conversions: int = 0, bot_flags: int = 0):
+        """
+        Record that a session of an API key was just active on a page, and
+        add to the counters of the current second
+        """
+        now = time.time() if now is None else now
+        minute = _minute(now)
+        page = page.encode()[:PAGE_BYTES]
+        with self._locked() as buf:
+            key_index = self._key_index(buf, api_key_id, create=True)
+            if key_index is None:
+                return
+            self._count(buf, key_index, int(now), (page_views, events, conversions, bot_flags))
+            page_index = self._page_index(buf, key_index, page, minute) if page else -1
+
+            start = int.from_bytes(session_id[:8], 'little') % self.sessions
+            slot = oldest = None
+            for probe in range(min(SESSION_PROBES, self.sessions)):
+                offset = self.sessions_offset + (start + probe) % self.sessions * SESSION.size
+                stored_id, old_key, old_page, old_minute = SESSION.unpack_from(buf, offset)
+                if stored_id == session_id:
+                    slot = offset
+                    break
+                if oldest is None or old_minute < oldest[1]:
+                    oldest = (offset, old_minute)
+            if slot is None:
+                slot = oldest[0]
+            stored_id, old_key, old_page, old_minute = SESSION.unpack_from(buf, slot)
+            if old_minute > minute - self.window:
+                # Seen within the window (or evicted while still active): uncount it there
+                self._uncount(buf, old_key, old_page, old_minute)
+
+            self._add(buf, self._key_buckets(key_index), minute, 1)
+            if page_index >= 0:
+                self._add(buf, self._page_offset(key_index, page_index) + PAGE_BYTES, minute, 1)
+            SESSION.pack_into(buf, slot, session_id, key_index, page_index, minute)
+
+    def _key_indexes(self, buf, api_key_id):
+        if api_key_id is not None:
+            key_index = self._key_index(buf, api_key_id, create=False)
+            return [] if key_index is None else [key_index]
+        return [index for index in range(self.api_keys)
+                if KEY_ID.unpack_from(buf, self.keys_offset + index * self.key_size)[0]]
+
+    def active(self, api_key_id: int = None, minutes: int = None, pages: int = 20, now: float = None) -> dict:
+        """
+        Sessions seen in the last ``minutes`` minutes, of one API key or all
+
+        Returns:
+            Dict with ``sessions`` and ``pages``: list of (page, sessions),
+            most sessions first, at most ``pages`` of them
+        """
+        minute = _minute(now)
+        since = minute - min(minutes or self.window, self.window)
+        sessions = 0
+        by_page = defaultdict(int)
+        with self._locked() as buf:
+            for key_index in self._key_indexes(buf, api_key_id):
+                sessions += self._sum(buf, self._key_buckets(key_index), since, minute)
+                for page_index in range(self.pages):
+                    offset = self._page_offset(key_index, page_index)
+                    page = buf[offset:offset + PAGE_BYTES].rstrip(b'\0')
+                    if page:
+                        count = self._sum(buf, offset + PAGE_BYTES, since, minute)
+                        if count:
+                            by_page[page.decode(errors='replace')] += count
+        top = sorted(by_page.items(), key=lambda item: (-item[1], item[0]))[:pages]
+        return {'sessions': sessions, 'pages': top}
+
+    def second_counts(self, first: int, last: int) -> dict:
+        """
+        Counters of the seconds ``first`` to ``last`` (Unix times), those
+        still in the ring
+
+        Returns:
+            Dict of second: {api_key_id: (page_views, events, conversions,
+            bot_flags)}, with the API keys that had any
+        """
+        first = max(first, last - self.seconds + 1)
+        counts = {second: {} for second in range(first, last + 1)}
+        with self._locked() as buf:
+            for key_index in self._key_indexes(buf, None):
+                (api_key_id,) = KEY_ID.unpack_from(buf, self.keys_offset + key_index * self.key_size)
+                for second in counts:
+                    stored, *values = SECOND.unpack_from(buf, self._second_offset(key_index, second))
+                    if stored == second and any(values):
+                        counts[second][api_key_id] = tuple(values)
+        return counts
+
+
+_window = None
+_window_lock = threading.Lock()
+
+
+def live_window():
+    """The process's LiveWindow, None when ANALYTICS_LIVE_WINDOW_MINUTES is 0"""
+    global _window
+    if not settings.ANALYTICS_LIVE_WINDOW_MINUTES:
+        return None
+    config = (
+        Path(settings.ANALYTICS_LIVE_PATH), settings.ANALYTICS_LIVE_WINDOW_MINUTES,
+        settings.ANALYTICS_LIVE_MAX_SESSIONS, settings.ANALYTICS_LIVE_MAX_API_KEYS,
+        settings.ANALYTICS_LIVE_PAGES_PER_KEY, settings.ANALYTICS_LIVE_STREAM_SECONDS,
+    )
+    if _window is None or _window.config != config:
+        with _window_lock:
+            if _window is None or _window.config != config:
+                _window = LiveWindow(*config)
+    return _window
+
+
+def record_activity(api_key_id: int, session_id, page: str, **counts):
+    """
+    Count a session as active on a page (called by the tracking endpoints),
+    and add ``counts`` (see COUNTERS) to the current second
+
+    Never fails the tracking request: errors are logged.
+    """
+    window = live_window()
+    if window is None:
+        return
+    try:
+        window.touch(api_key_id, session_id.bytes, page or '', **counts)
+    except (OSError, ValueError):
+        logger.warning("Could not update the live visitors window", exc_info=True)
+
+
+def record_counts(api_key_id: int, **counts):
+    """
+    Add ``counts`` (see COUNTERS) to the current second, for tracking
+    requests that do not tell which page the session is on
+
+    Never fails the tracking request: errors are logged.
+    """
+    window = live_window()
+    if window is None:
+        return
+    try:
+        window.count(api_key_id, **counts)
+    except (OSError, ValueError):
+        logger.warning("Could not update the live counters", exc_info=True)
@@ -0,0 +1,164 @@
+# analytics/services/live_stream.py
+import asyncio
+import logging
+import time
+import weakref
+from datetime import datetime, timezone as dt_timezone
+
+import orjson
+from django.conf import settings
+from django.core.signing import BadSignature, TimestampSigner
+
+from analytics.services.live import COUNTERS, LiveWindow, live_window
+
+
+logger = logging.getLogger(__name__)
+
+# Server-Sent Events with the per-second counters the tracking endpoints add
+# to (see analytics.services.live). Each event loop, i.e. each ASGI worker
+# process, has one Broadcaster: it reads every second once, when it is over,
+# and hands the same encoded frame to all the clients following the same
+# API key (or all of them). A client only reads the counters itself for the
+# seconds it missed, when it connects.
+
+# A second is read this long after it ended, so requests finishing in it are counted
+SETTLE_SECONDS = 0.25
+
+# Browsers wait this long before reconnecting a stream that ended
+RETRY_MS = 2000
+
+TOKEN_SALT = 'analytics.stream'
+
+_broadcasters = weakref.WeakKeyDictionary()
+
+
+def stream_token(user_id: int) -> str:
+    """
+    Token for ?token= on the stream, valid for ANALYTICS_LIVE_STREAM_TOKEN_MAX_AGE seconds
+
+    Only opens the stream: unlike an access token it is fine in URLs,
+    and so in access logs.
+    """
+    return TimestampSigner(salt=TOKEN_SALT).sign(str(user_id))
+
+
+def stream_token_user_id(value: str):
+    """The user a stream token was issued to, None if it is invalid or expired"""
+    try:
+        user_id = TimestampSigner(salt=TOKEN_SALT).unsign(value, max_age=settings.ANALYTICS_LIVE_STREAM_TOKEN_MAX_AGE)
+    except BadSignature:
+        return None
+    return int(user_id)
+
+
+def totals(by_key: dict, api_key_id: int = None) -> tuple:
+    """Counters of one API key, or of all of them, from a second of LiveWindow.second_counts()"""
+    if api_key_id is not None:
+        return by_key.get(api_key_id, (0,) * len(COUNTERS))
+    return tuple(sum(column) for column in zip(*by_key.values())) if by_key else (0,) * len(COUNTERS)
+
+
+def encode_frame(second: int, counts: tuple) -> bytes:
+    """An SSE 'tick' event, with the second (Unix time) as its id"""
+    data = {'time': datetime.fromtimestamp(second, dt_timezone.utc), **dict(zip(COUNTERS, counts))}
+    return b'id: %d\nevent: tick\ndata: %s\n\n' % (second, orjson.dumps(data, option=orjson.OPT_UTC_Z))
+
+
+def last_complete_second(now: float = None) -> int:
+    return int((time.time() if now is None else now) - SETTLE_SECONDS) - 1
+
+
+class Broadcaster:
+    """Reads each second once and queues its frames for the clients of an event loop"""
+
+    def __init__(self, window: LiveWindow):
+        self.window = window
+        self.clients = {}  # asyncio.Queue: API key id, None for all keys
+        self.next_second = None
+        self._task = None
+
+    def subscribe(self, api_key_id: int = None):
+        """
+        Queue receiving a frame per second from now on (None when the client
+        falls ANALYTICS_LIVE_STREAM_MAX_BACKLOG seconds behind)
+
+        Returns:
+            (queue, last second before its first frame)
+        """
+        if self._task is None or self._task.done():
+            self.next_second = last_complete_second() + 1
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        queue = asyncio.Queue()
+        self.clients[queue] = api_key_id
+        return queue, self.next_second - 1
+
+    def unsubscribe(self, queue):
+        self.clients.pop(queue, None)
+
+    async def _run(self):
+        # Ends with the last client; the next one starts it again
+        while self.clients:
+            await asyncio.sleep(max(self.next_second + 1 + SETTLE_SECONDS - time.time(), 0))
+            last = last_complete_second()
+            if last < self.next_second:
+                continue
+            try:
+                # More than one second only when the loop was held up
+                counts = await asyncio.to_thread(self.window.second_counts, self.next_second, last)
+            except (OSError, ValueError):
+                logger.warning("Could not read the live counters", exc_info=True)
+                counts = {}
+            for second, by_key in counts.items():
+                self.publish(second, by_key)
+            self.next_second = last + 1
+
+    def publish(self, second: int, by_key: dict):
+        frames = {}
+        for queue, api_key_id in list(self.clients.items()):
+            if queue.qsize() >= settings.ANALYTICS_LIVE_STREAM_MAX_BACKLOG:
+                self.unsubscribe(queue)
+                queue.put_nowait(None)
+                continue
+            if api_key_id not in frames:
+                frames[api_key_id] = encode_frame(second, totals(by_key, api_key_id))
+            queue.put_nowait(frames[api_key_id])
+
+
+def broadcaster() -> Broadcaster:
+    """The running event loop's Broadcaster (the live window must be on)"""
+    loop = asyncio.get_running_loop()
+    window = live_window()
+    hub = _broadcasters.get(loop)
+    if hub is None or hub.window is not window:
+        hub = _broadcasters[loop] = Broadcaster(window)
+    return hub
+
+
+async def stream(api_key_id: int = None, last_event_id: int = None, backfill: int = 0):
+    """
+    SSE frames for one client, until ANALYTICS_LIVE_STREAM_MAX_AGE
+
+    Starts with the seconds after ``last_event_id`` (a reconnecting
+    browser), else the last ``backfill`` seconds, as far as they are kept.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + settings.ANALYTICS_LIVE_STREAM_MAX_AGE
+    hub = broadcaster()
+    queue, last = hub.subscribe(api_key_id)
+    try:
+        yield b'retry: %d\n\n' % RETRY_MS
+        first = last_event_id + 1 if last_event_id is not None else last - backfill + 1
+        if first <= last:
+            missed = await asyncio.to_thread(hub.window.second_counts, first, last)
+            for second, by_key in missed.items():
+                yield encode_frame(second, totals(by_key, api_key_id))
+        while True:
+            try:
+                frame = await asyncio.wait_for(queue.get(), timeout=max(deadline - loop.time(), 0))
+            except asyncio.TimeoutError:
+                return
+            if frame is None:
+                return
+            yield frame
+    finally:
+        hub.unsubscribe(queue)
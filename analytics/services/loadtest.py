@@ -0,0 +1,246 @@
+# analytics/services/loadtest.py
+import json
+import math
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from django.test import Client
+
+from analytics.services.metrics import QueryTimer
+
+
+TRACKING_PREFIX = '/api/track'
+
+USER_AGENTS = [
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36',
+    'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.1 Safari/605.1.15',
+    'Mozilla/5.0 (iPhone; CPU iPhone OS 17_1 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Mobile/15E148',
+    'Mozilla/5.0 (Linux; Android 14; Pixel 8) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Mobile Safari/537.36',
+    'Mozilla/5.0 (iPad; CPU OS 17_1 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Mobile/15E148',
+]
+
+REFERRERS = [
+    None, None, 'https://www.google.com/', 'https://www.linkedin.com/', 'https://news.example.org/post',
+]
+
+PAGES = ['/', '/pricing', '/features', '/blog/how-to-choose', '/about', '/contact']
+
+CTA_EVENTS = [('cta_click', 'Header CTA'), ('button_click', 'Pricing'), ('link_click', None), ('scroll', None)]
+
+DIAGNOSTIC_STEPS = 5
+
+
+def visitor_journey(api_key: str, site: str = 'https://loadtest.example.com', rng=None):
+    """
+    Requests made by one simulated visitor, in order
+
+    A visitor views a few pages with clicks on each; about half of them
+    start the diagnostic, answer every step, leave their email and submit.
+
+    Returns:
+        List of (endpoint, payload) tuples, endpoint relative to /api/track
+    """
+    rng = rng or random
+    session_id = str(uuid.uuid4())
+    user_agent = rng.choice(USER_AGENTS)
+    referrer = rng.choice(REFERRERS)
+    utm = {'utm_source': 'newsletter', 'utm_medium': 'email', 'utm_campaign': 'launch'} if rng.random() < 0.2 else {}
+    started = 0
+
+    def event(event_type, page_url, category=None, **metadata):
+        return ('/event', {
+            'api_key': api_key, 'session_id': session_id, 'event_type': event_type,
+            'event_category': category, 'page_url': page_url,
+            'time_since_page_load_ms': rng.randint(200, 20000),
+            'time_since_session_start_seconds': started, 'metadata': metadata,
+        })
+
+    steps = []
+    for path in rng.sample(PAGES, rng.randint(1, 4)):
+        page_url = site + path
+        steps.append(('/pageview', {
+            'api_key': api_key, 'session_id': session_id, 'page_url': page_url,
+            'page_title': path.strip('/').title() or 'Home', 'page_path': path,
+            'referrer_url': referrer if not steps else None, 'user_agent': user_agent,
+            'screen_resolution': '1920x1080', 'language': 'en', **(utm if not steps else {}),
+        }))
+        for event_type, category in rng.sample(CTA_EVENTS, rng.randint(0, 2)):
+            steps.append(event(event_type, page_url, category))
+        started += rng.randint(5, 60)
+
+    if rng.random() < 0.5:
+        page_url = site + '/diagnostic'
+        steps.append(event('diagnostic_started', page_url))
+        for step in range(1, DIAGNOSTIC_STEPS + 1):
+            steps.append(event('diagnostic_question_shown', page_url, step_number=step))
+            steps.append(event('diagnostic_step_completed', page_url, step_number=step))
+        steps.append(event('diagnostic_contact_form_shown', page_url))
+        steps.append(('/email', {
+            'api_key': api_key, 'session_id': session_id,
+            'email': f'visitor-{session_id[:8]}@loadtest.example.com',
+            'name': 'Load Test', 'time_spent_seconds': rng.randint(5, 120),
+        }))
+        steps.append(event('diagnostic_email_submitted', page_url))
+        steps.append(('/diagnostic', {
+            'api_key': api_key, 'session_id': session_id, 'diagnostic_name': 'loadtest',
+            'answers': {f'q{step}': rng.choice('abcd') for step in range(1, DIAGNOSTIC_STEPS + 1)},
+            'score': str(rng.randint(0, 100)), 'result_category': rng.choice(['Beginner', 'Advanced']),
+        }))
+        steps.append(event('diagnostic_results_viewed', page_url))
+    return steps
+
+
+def allowed_host() -> str:
+    """A Host header ALLOWED_HOSTS accepts (the test client's default, "testserver", may not be)"""
+    for host in settings.ALLOWED_HOSTS:
+        if host != '*':
+            # ".example.com" also matches example.com itself
+            return host.lstrip('.')
+    return 'localhost'
+
+
+class InProcessTransport:
+    """Sends requests through Django's test client, counting the queries each one runs"""
+
+    def __init__(self, api_key: str):
+        self.api_key = api_key
+        self.local = threading.local()
+        self.host = allowed_host()
+
+    def send(self, endpoint: str, payload: dict):
+        client = getattr(self.local, 'client', None)
+        if client is None:
+            client = self.local.client = Client(HTTP_HOST=self.host, HTTP_X_ANALYTICS_KEY=self.api_key)
+        queries = QueryTimer()
+        with ExitStack() as stack:
+            # Every alias: tracking data may live on a shard
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(queries))
+            started = time.perf_counter()
+            response = client.post(TRACKING_PREFIX + endpoint, data=json.dumps(payload),
+                                   content_type='application/json')
+            elapsed = time.perf_counter() - started
+        return response.status_code, elapsed, queries.count
+
+    def close(self):
+        connections.close_all()
+
+
+class HTTPTransport:
+    """Sends requests to a running server; query counts are not available"""
+
+    def __init__(self, api_key: str, base_url: str, timeout: float = 30):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+
+    def send(self, endpoint: str, payload: dict):
+        request = urllib.request.Request(
+            self.base_url + TRACKING_PREFIX + endpoint,
+            data=json.dumps(payload).encode(),
+            headers={'Content-Type': 'application/json', 'X-Analytics-Key': self.api_key},
+            method='POST',
+        )
+        started = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                response.read()
+                status = response.status
+        except urllib.error.HTTPError as exc:
+            status = exc.code
+        except (urllib.error.URLError, TimeoutError):
+            status = 0
+        return status, time.perf_counter() - started, None
+
+    def close(self):
+        pass
+
+
+def percentile(values, pct: float):
+    """Nearest-rank percentile of an unsorted list (None when empty)"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(math.ceil(pct / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+def run_load(transport, sessions: int, concurrency: int = 4, duration: float = None, seed: int = None,
+             site: str = 'https://loadtest.example.com', log=None) -> dict:
+    """
+    Replay ``sessions`` visitor journeys with ``concurrency`` visitors at a time
+
+    Each worker plays one visitor's requests in order, then starts the next
+    visitor, until all sessions are done or ``duration`` seconds have passed.
+
+    Returns:
+        Dict with the overall and per-endpoint request statistics
+    """
+    lock = threading.Lock()
+    samples = []  # (endpoint, status, seconds, queries)
+    remaining = [sessions]
+    deadline = time.monotonic() + duration if duration else None
+
+    def worker(index):
+        rng = random.Random(None if seed is None else seed + index)
+        try:
+            while deadline is None or time.monotonic() < deadline:
+                with lock:
+                    if remaining[0] <= 0:
+                        return
+                    remaining[0] -= 1
+                for endpoint, payload in visitor_journey(transport.api_key, site, rng):
+                    status, elapsed, queries = transport.send(endpoint, payload)
+                    with lock:
+                        samples.append((endpoint, status, elapsed, queries))
+                if log:
+                    log(f'{sessions - remaining[0]} sessions started, {len(samples)} requests')
+        finally:
+            transport.close()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='loadtest') as executor:
+        for future in [executor.submit(worker, index) for index in range(concurrency)]:
+            future.result()
+    wall = time.perf_counter() - started
+
+    endpoints = sorted({endpoint for endpoint, *_ in samples})
+    return {
+        'sessions': sessions - max(remaining[0], 0),
+        'concurrency': concurrency,
+        'seconds': wall,
+        'overall': summarize(samples, wall),
+        'endpoints': {
+            endpoint: summarize([sample for sample in samples if sample[0] == endpoint], wall)
+            for endpoint in endpoints
+        },
+    }
+
+
+def summarize(samples, wall: float) -> dict:
+    latencies = [elapsed for _, _, elapsed, _ in samples]
+    queries = [count for *_, count in samples if count is not None]
+    errors = sum(1 for _, status, *_ in samples if not 200 <= status < 300)
+    return {
+        'requests': len(samples),
+        'errors': errors,
+        'throughput': len(samples) / wall if wall else 0,
+        'p50_ms': _ms(percentile(latencies, 50)),
+        'p95_ms': _ms(percentile(latencies, 95)),
+        'p99_ms': _ms(percentile(latencies, 99)),
+        'max_ms': _ms(max(latencies) if latencies else None),
+        'queries_per_request': sum(queries) / len(queries) if queries else None,
+        'max_queries': max(queries) if queries else None,
+    }
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 2)
@@ -0,0 +1,105 @@
+# analytics/services/metadata.py
+import re
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from analytics.services.partitions import create_index, drop_index
+
+
+# Expression indexes on single metadata keys of analytics_events
+INDEX_TABLE = 'analytics_events'
+INDEX_PREFIX = 'analytics_e_mkey_'
+
+_KEY_RE = re.compile(r'^[a-z][a-z0-9_]{0,37}$')
+
+
+def metadata_index_name(key: str) -> str:
+    return f'{INDEX_PREFIX}{key}'
+
+
+def metadata_index_definition(key: str) -> str:
+    """
+    Index expression matching what the ORM emits for ``metadata__<key>=value``,
+    i.e. ``("metadata" -> '<key>') = '<value>'::jsonb``
+    """
+    return f"((metadata -> '{key}'))"
+
+
+def validate_key(key: str) -> str:
+    """Keys end up in index names and DDL, so only lowercase identifiers are accepted"""
+    if not _KEY_RE.match(key):
+        raise ValueError(f"Invalid metadata key '{key}' (lowercase letters, digits and _ only)")
+    return key
+
+
+def existing_index_keys(using: str = DEFAULT_DB_ALIAS):
+    """Metadata keys that currently have an expression index"""
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT c.relname FROM pg_index i
+            JOIN pg_class c ON c.oid = i.indexrelid
+            WHERE i.indrelid = to_regclass(%s) AND c.relname LIKE %s
+            ORDER BY c.relname
+            """,
+            [INDEX_TABLE, INDEX_PREFIX.replace('_', r'\_') + '%'],
+        )
+        return [row[0][len(INDEX_PREFIX):] for row in cursor.fetchall()]
+
+
+def sync_metadata_indexes(keys=None, drop_unlisted: bool = False, dry_run: bool = False,
+                          using: str = DEFAULT_DB_ALIAS):
+    """
+    Create the expression indexes for ``keys`` (default: the configured keys)
+
+    Indexes are built concurrently, partition by partition. Indexes for keys
+    no longer listed are only dropped with ``drop_unlisted``.
+
+    Returns:
+        (created, dropped) lists of index names
+    """
+    if keys is None:
+        keys = settings.ANALYTICS_METADATA_INDEX_KEYS
+    keys = [validate_key(key) for key in keys]
+    existing = set(existing_index_keys(using=using))
+
+    created, dropped = [], []
+    for key in keys:
+        # Re-run create_index for existing names too: it finishes an
+        # interrupted build (unattached or invalid partition indexes)
+        name = metadata_index_name(key)
+        if not dry_run:
+            create_index(INDEX_TABLE, name, metadata_index_definition(key), using=using)
+        if key not in existing:
+            created.append(name)
+
+    if drop_unlisted:
+        for key in sorted(existing - set(keys)):
+            name = metadata_index_name(key)
+            if not dry_run:
+                drop_index(INDEX_TABLE, name, using=using)
+            dropped.append(name)
+
+    return created, dropped
+
+
+def filter_metadata(queryset, **values):
+    """
+    Filter a queryset on metadata key equality
+
+    Keys promoted to generated columns (the model's PROMOTED_METADATA_KEYS)
+    are compared on the column; the rest become one containment lookup
+    (``metadata @> {...}``), which the jsonb_path_ops GIN index serves.
+
+    Example:
+        filter_metadata(Event.objects.all(), step_number=2, variant='b')
+    """
+    promoted = getattr(queryset.model, 'PROMOTED_METADATA_KEYS', {})
+    columns = {promoted[key]: value for key, value in values.items() if key in promoted}
+    contained = {key: value for key, value in values.items() if key not in promoted}
+    if columns:
+        queryset = queryset.filter(**columns)
+    if contained:
+        queryset = queryset.filter(metadata__contains=contained)
+    return queryset
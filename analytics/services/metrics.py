@@ -0,0 +1,116 @@
+# analytics/services/metrics.py
+import os
+import time
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess,
+)
+
+from analytics.fields import dictionary_caches
+from analytics.routers import REPLICA_DB_ALIAS, _replica_state, replica_configured
+
+
+# With several gunicorn workers each process writes its samples to files in
+# this directory and /metrics adds them up (see gunicorn.conf.py)
+MULTIPROCESS_DIR_ENV = 'PROMETHEUS_MULTIPROC_DIR'
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+
+REQUEST_LATENCY = Histogram(
+    'analytics_http_request_duration_seconds', 'Time to build the response, by route',
+    ['route', 'method'], buckets=LATENCY_BUCKETS,
+)
+REQUESTS = Counter(
+    'analytics_http_requests', 'Requests by route and response status',
+    ['route', 'method', 'status'],
+)
+DB_QUERIES = Histogram(
+    'analytics_db_queries_per_request', 'Database queries run by one request, by route',
+    ['route'], buckets=QUERY_COUNT_BUCKETS,
+)
+DB_TIME = Histogram(
+    'analytics_db_time_per_request_seconds', 'Time one request spent in database queries, by route',
+    ['route'], buckets=LATENCY_BUCKETS,
+)
+DICTIONARY_LOOKUPS = Counter(
+    'analytics_dictionary_cache_lookups', 'Dictionary name/id lookups, by cache result',
+    ['dictionary', 'result'],
+)
+DICTIONARY_ENTRIES = Gauge(
+    'analytics_dictionary_cache_entries', 'Entries held by the largest dictionary cache of any worker',
+    ['dictionary'], multiprocess_mode='livemax',
+)
+REPLICA_HEALTHY = Gauge(
+    'analytics_replica_healthy', '1 while every worker sends eligible reads to the replica',
+    ['alias'], multiprocess_mode='livemin',
+)
+
+# Cache counters already added to DICTIONARY_LOOKUPS, per dictionary
+_reported_lookups = {}
+
+
+class QueryTimer:
+    """execute_wrapper counting the queries of a request and the time spent in them"""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.seconds += time.perf_counter() - started
+
+
+def route_label(request) -> str:
+    """URL pattern that served a request, so labels stay few (e.g. 'api/analytics/export/<dataset>')"""
+    match = getattr(request, 'resolver_match', None)
+    return match.route if match is not None else 'unmatched'
+
+
+def observe_request(request, response, seconds: float, queries: QueryTimer):
+    route = route_label(request)
+    REQUEST_LATENCY.labels(route, request.method).observe(seconds)
+    REQUESTS.labels(route, request.method, str(response.status_code)).inc()
+    DB_QUERIES.labels(route).observe(queries.count)
+    DB_TIME.labels(route).observe(queries.seconds)
+
+
+def observe_process():
+    """
+    Report this process's cache and replica state
+
+    Dictionary caches count lookups as plain integers (they run once per row
+    read); the increase since the last call is added here.
+    """
+    for cache in dictionary_caches():
+        label = cache.model_label
+        hits, misses = _reported_lookups.get(label, (0, 0))
+        if cache.hits > hits:
+            DICTIONARY_LOOKUPS.labels(label, 'hit').inc(cache.hits - hits)
+        if cache.misses > misses:
+            DICTIONARY_LOOKUPS.labels(label, 'miss').inc(cache.misses - misses)
+        _reported_lookups[label] = (cache.hits, cache.misses)
+        DICTIONARY_ENTRIES.labels(label).set(len(cache.ids))
+
+    if replica_configured() and _replica_state['checked_at'] is not None:
+        REPLICA_HEALTHY.labels(REPLICA_DB_ALIAS).set(1 if _replica_state['healthy'] else 0)
+
+
+def render_metrics():
+    """
+    Current metrics in the Prometheus text format
+
+    Returns:
+        (body, content type)
+    """
+    if os.environ.get(MULTIPROCESS_DIR_ENV):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
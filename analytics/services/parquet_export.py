@@ -0,0 +1,274 @@
+# analytics/services/parquet_export.py
+import json
+import os
+import uuid
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+from pathlib import Path
+
+from django.conf import settings
+from django.db.models import F
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from analytics.models import Session, PageView, Event, DiagnosticResponse
+from analytics.routers import shard_aliases, use_shard
+
+
+# Tables written to Parquet. ``change_field`` is the timestamp used to find
+# partitions touched since the previous run.
+PARQUET_DATASETS = {
+    'analytics_sessions': {
+        'model': Session,
+        'date_field': 'created_at',
+        'api_key_field': 'api_key_id',
+        'change_field': 'last_activity_at',
+    },
+    'analytics_page_views': {
+        'model': PageView,
+        'date_field': 'viewed_at',
+        'api_key_field': 'session__api_key_id',
+        # time_on_page_seconds is back-filled by the next page view, which
+        # also bumps the session's last_activity_at
+        'change_field': 'session__last_activity_at',
+    },
+    'analytics_events': {
+        'model': Event,
+        'date_field': 'occurred_at',
+        'api_key_field': 'session__api_key_id',
+        'change_field': 'occurred_at',
+    },
+    'analytics_diagnostic_responses': {
+        'model': DiagnosticResponse,
+        'date_field': 'completed_at',
+        'api_key_field': 'session__api_key_id',
+        'change_field': 'completed_at',
+    },
+}
+
+STATE_FILENAME = '_export_state.json'
+
+# Rows committed slightly before the previous run started may not have been
+# visible to it, so every incremental run looks back a little further
+CHANGE_OVERLAP = timedelta(minutes=10)
+
+
+def import_pyarrow():
+    """pyarrow, with pyarrow.parquet loaded; RuntimeError when it is not installed"""
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError as exc:
+        raise RuntimeError("pyarrow is required for Parquet export (pip install pyarrow)") from exc
+    return pyarrow
+
+
+def dataset_columns(dataset: str):
+    """
+    Column names (DB attnames) written for a dataset
+
+    Child tables get an extra ``api_key_id`` column so every file can be
+    filtered by site without a join.
+    """
+    spec = PARQUET_DATASETS[dataset]
+    columns = [field.attname for field in spec['model']._meta.concrete_fields]
+    if spec['api_key_field'] not in columns:
+        columns.append('api_key_id')
+    return columns
+
+
+def arrow_schema(dataset: str):
+    """Build the Arrow schema for a dataset from its Django model fields"""
+    pa = import_pyarrow()
+    spec = PARQUET_DATASETS[dataset]
+    fields_by_attname = {field.attname: field for field in spec['model']._meta.concrete_fields}
+
+    arrow_fields = []
+    for column in dataset_columns(dataset):
+        field = fields_by_attname.get(column)
+        arrow_fields.append(pa.field(column, _arrow_type(pa, field)))
+    return pa.schema(arrow_fields)
+
+
+def _arrow_type(pa, field):
+    if field is None:
+        return pa.int64()
+    if field.is_relation:
+        field = field.target_field
+
+    internal_type = field.get_internal_type()
+    if internal_type in ('AutoField', 'BigAutoField', 'BigIntegerField'):
+        return pa.int64()
+    if internal_type in ('IntegerField', 'PositiveIntegerField'):
+        return pa.int32()
+    if internal_type in ('SmallIntegerField', 'PositiveSmallIntegerField'):
+        return pa.int16()
+    if internal_type == 'BooleanField':
+        return pa.bool_()
+    if internal_type == 'DecimalField':
+        return pa.decimal128(field.max_digits, field.decimal_places)
+    if internal_type == 'DateTimeField':
+        return pa.timestamp('us', tz='UTC')
+    if internal_type == 'DateField':
+        return pa.date32()
+    return pa.string()
+
+
+def _to_arrow_value(value):
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False)
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    return value
+
+
+def partition_queryset(dataset: str, day, api_key_id: int):
+    """Rows of a dataset in one (UTC day, API key) partition"""
+    spec = PARQUET_DATASETS[dataset]
+    lower = datetime.combine(day, time.min, tzinfo=dt_timezone.utc)
+    upper = lower + timedelta(days=1)
+    return spec['model'].objects.filter(**{
+        f"{spec['date_field']}__gte": lower,
+        f"{spec['date_field']}__lt": upper,
+        spec['api_key_field']: api_key_id,
+    })
+
+
+def changed_partitions(dataset: str, since: datetime = None):
+    """
+    List (day, api_key_id) partitions with rows changed since ``since``
+
+    Days are UTC calendar days. With no ``since`` every partition is returned.
+    """
+    spec = PARQUET_DATASETS[dataset]
+    qs = spec['model'].objects.all()
+    if since is not None:
+        qs = qs.filter(**{f"{spec['change_field']}__gte": since})
+
+    partitions = (
+        qs.annotate(
+            day=TruncDate(spec['date_field'], tzinfo=dt_timezone.utc),
+            partition_key=F(spec['api_key_field']),
+        )
+        .values_list('day', 'partition_key')
+        .order_by('day', 'partition_key')
+        .distinct()
+    )
+    return list(partitions)
+
+
+def partition_path(root, dataset: str, day, api_key_id: int) -> Path:
+    """Hive-style path: <root>/<table>/date=YYYY-MM-DD/api_key=<id>/part-0.parquet"""
+    return Path(root) / dataset / f'date={day.isoformat()}' / f'api_key={api_key_id}' / 'part-0.parquet'
+
+
+def write_partition(dataset: str, day, api_key_id: int, path, chunk_size: int = None,
+                    compression: str = 'zstd', queryset=None, prepend=None) -> int:
+    """
+    Write one (day, api_key) partition to a Parquet file
+
+    Rows are read with a server-side cursor and written one row group per
+    chunk, so memory stays bounded by chunk_size. ``prepend`` is an Arrow
+    table with the dataset's schema written before them. The file is
+    written to a temporary name and renamed into place once complete.
+
+    Returns:
+        Number of rows written
+    """
+    pa = import_pyarrow()
+    chunk_size = chunk_size or settings.ANALYTICS_EXPORT_CHUNK_SIZE
+    spec = PARQUET_DATASETS[dataset]
+    schema = arrow_schema(dataset)
+    columns = dataset_columns(dataset)
+    lookups = [spec['api_key_field'] if column == 'api_key_id' else column for column in columns]
+
+    if queryset is None:
+        queryset = partition_queryset(dataset, day, api_key_id)
+    rows = queryset.order_by('pk').values_list(*lookups).iterator(chunk_size=chunk_size)
+
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + '.tmp')
+
+    written = 0
+    batch = []
+    with pa.parquet.ParquetWriter(tmp_path, schema, compression=compression) as writer:
+        if prepend is not None and prepend.num_rows:
+            writer.write_table(prepend.cast(schema))
+            written += prepend.num_rows
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= chunk_size:
+                writer.write_table(_rows_to_table(pa, schema, batch))
+                written += len(batch)
+                batch = []
+        if batch or not written:
+            writer.write_table(_rows_to_table(pa, schema, batch))
+            written += len(batch)
+
+    os.replace(tmp_path, path)
+    return written
+
+
+def _rows_to_table(pa, schema, rows):
+    columns = list(zip(*rows)) if rows else [[] for _ in schema]
+    arrays = [
+        pa.array([_to_arrow_value(value) for value in column], type=field.type)
+        for column, field in zip(columns, schema)
+    ]
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+
+def load_state(root, filename: str = STATE_FILENAME) -> dict:
+    state_path = Path(root) / filename
+    if not state_path.exists():
+        return {}
+    with open(state_path) as f:
+        return json.load(f)
+
+
+def save_state(root, state: dict, filename: str = STATE_FILENAME):
+    state_path = Path(root) / filename
+    state_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = state_path.with_name(filename + '.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_path, state_path)
+
+
+def export_dataset(dataset: str, root, full: bool = False, chunk_size: int = None,
+                   compression: str = 'zstd', log=None) -> dict:
+    """
+    Incrementally export one table to partitioned Parquet files
+
+    Only partitions with rows changed since the previous run are rewritten,
+    unless ``full`` is set.
+
+    Returns:
+        Dict with partitions and rows written
+    """
+    state = load_state(root)
+    started_at = timezone.now()
+
+    since = None
+    previous = state.get(dataset, {}).get('started_at')
+    if previous and not full:
+        since = datetime.fromisoformat(previous) - CHANGE_OVERLAP
+
+    # Every API key lives on exactly one shard, so their partitions never overlap
+    partitions = rows = 0
+    for alias in shard_aliases():
+        with use_shard(alias):
+            changed = changed_partitions(dataset, since=since)
+            for day, api_key_id in changed:
+                path = partition_path(root, dataset, day, api_key_id)
+                count = write_partition(dataset, day, api_key_id, path,
+                                        chunk_size=chunk_size, compression=compression)
+                rows += count
+                if log:
+                    log(f'{dataset}: {path} ({count} rows)')
+        partitions += len(changed)
+
+    state[dataset] = {'started_at': started_at.isoformat()}
+    save_state(root, state)
+
+    return {'partitions': partitions, 'rows': rows}
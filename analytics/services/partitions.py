@@ -0,0 +1,273 @@
+# analytics/services/partitions.py
+import re
+from datetime import date, datetime, timezone as dt_timezone
+
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+
+# Tables stored as monthly range partitions, with their partition key column
+PARTITIONED_TABLES = {
+    'analytics_page_views': 'viewed_at',
+    'analytics_events': 'occurred_at',
+}
+
+_BOUND_RE = re.compile(r"FROM \('([^']+)'\) TO \('([^']+)'\)")
+
+
+def month_start(value) -> datetime:
+    """First instant (UTC) of the month containing ``value``"""
+    return datetime(value.year, value.month, 1, tzinfo=dt_timezone.utc)
+
+
+def add_months(value: datetime, months: int) -> datetime:
+    month_index = value.year * 12 + value.month - 1 + months
+    return value.replace(year=month_index // 12, month=month_index % 12 + 1)
+
+
+def partition_name(table: str, month: datetime) -> str:
+    return f"{table}_p{month:%Y%m}"
+
+
+def default_partition_name(table: str) -> str:
+    return f"{table}_default"
+
+
+def is_partitioned(table: str, using: str = DEFAULT_DB_ALIAS) -> bool:
+    with connections[using].cursor() as cursor:
+        cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", [table])
+        row = cursor.fetchone()
+    return bool(row) and row[0] == 'p'
+
+
+def default_partition(table: str, using: str = DEFAULT_DB_ALIAS):
+    """Name of the DEFAULT partition of a table, None when it has none"""
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            "SELECT partdefid::regclass::text FROM pg_partitioned_table "
+            "WHERE partrelid = to_regclass(%s) AND partdefid <> 0",
+            [table],
+        )
+        row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def ensure_default_partition(table: str, using: str = DEFAULT_DB_ALIAS):
+    """
+    Create the DEFAULT partition of a table, which takes the rows no monthly
+    partition covers (so inserts keep working when partition maintenance
+    falls behind) until ensure_partitions() moves them to their month
+
+    Returns:
+        Name of the partition when it was created, else None
+    """
+    if default_partition(table, using=using):
+        return None
+    name = default_partition_name(table)
+    with connections[using].cursor() as cursor:
+        cursor.execute(f"CREATE TABLE {name} PARTITION OF {table} DEFAULT")
+    return name
+
+
+def default_partition_months(table: str, using: str = DEFAULT_DB_ALIAS):
+    """First instant (UTC) of each month having rows in the DEFAULT partition, oldest first"""
+    default = default_partition(table, using=using)
+    if not default:
+        return []
+    column = PARTITIONED_TABLES[table]
+    with connections[using].cursor() as cursor:
+        cursor.execute(f"SELECT DISTINCT date_trunc('month', {column}, 'UTC') FROM {default} ORDER BY 1")
+        return [month_start(row[0].astimezone(dt_timezone.utc)) for row in cursor.fetchall()]
+
+
+def list_partitions(table: str, using: str = DEFAULT_DB_ALIAS):
+    """
+    List the monthly partitions of a table (not the DEFAULT one)
+
+    Returns:
+        List of dicts with name, lower and upper bounds (upper exclusive), oldest first
+    """
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = to_regclass(%s)
+            """,
+            [table],
+        )
+        rows = cursor.fetchall()
+
+    partitions = []
+    for name, bound in rows:
+        match = _BOUND_RE.search(bound or '')
+        if not match:
+            continue
+        partitions.append({
+            'name': name,
+            'lower': datetime.fromisoformat(match.group(1)),
+            'upper': datetime.fromisoformat(match.group(2)),
+        })
+    return sorted(partitions, key=lambda p: p['lower'])
+
+
+def ensure_partitions(table: str, start, end, using: str = DEFAULT_DB_ALIAS):
+    """
+    Create the monthly partitions covering ``start`` through ``end`` (inclusive)
+
+    Rows of these months already in the DEFAULT partition are moved to them.
+
+    Returns:
+        Names of the partitions that were created
+    """
+    existing = {p['name'] for p in list_partitions(table, using=using)}
+    default = default_partition(table, using=using)
+    created = []
+
+    month = month_start(start)
+    last = month_start(end)
+    while month <= last:
+        name = partition_name(table, month)
+        if name not in existing:
+            _create_partition(table, name, month, add_months(month, 1), default, using)
+            created.append(name)
+        month = add_months(month, 1)
+    return created
+
+
+def _create_partition(table, name, lower, upper, default, using):
+    if not default:
+        with connections[using].cursor() as cursor:
+            cursor.execute(
+                f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {table} FOR VALUES FROM (%s) TO (%s)",
+                [lower, upper],
+            )
+        return
+
+    # CREATE ... PARTITION OF fails when the DEFAULT partition has rows in the
+    # new range: build the table, move those rows into it and attach it. The
+    # lock only holds up the inserts routed to the DEFAULT partition.
+    column = PARTITIONED_TABLES[table]
+    with transaction.atomic(using=using), connections[using].cursor() as cursor:
+        cursor.execute(f"LOCK TABLE {default} IN ACCESS EXCLUSIVE MODE")
+        cursor.execute(
+            f"CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS INCLUDING GENERATED "
+            f"INCLUDING STORAGE)"
+        )
+        # Generated columns (promoted metadata keys) are computed again on insert
+        cursor.execute(
+            "SELECT string_agg(quote_ident(attname), ', ' ORDER BY attnum) FROM pg_attribute "
+            "WHERE attrelid = to_regclass(%s) AND attnum > 0 AND NOT attisdropped AND attgenerated = ''",
+            [table],
+        )
+        columns = cursor.fetchone()[0]
+        cursor.execute(
+            f"WITH moved AS (DELETE FROM {default} WHERE {column} >= %s AND {column} < %s RETURNING *) "
+            f"INSERT INTO {name} ({columns}) SELECT {columns} FROM moved",
+            [lower, upper],
+        )
+        cursor.execute(f"ALTER TABLE {table} ATTACH PARTITION {name} FOR VALUES FROM (%s) TO (%s)", [lower, upper])
+
+
+def ensure_future_partitions(months_ahead: int = 3, using: str = DEFAULT_DB_ALIAS):
+    """
+    Create partitions from the current month to ``months_ahead`` months ahead
+    for every partitioned table, and for the months with rows in the DEFAULT
+    partition
+
+    Rows no partition covers go to the DEFAULT partition, which every query
+    scans, so schedule this (daily is plenty) well before the last partition
+    runs out.
+    """
+    now = datetime.now(dt_timezone.utc)
+    created = []
+    for table in PARTITIONED_TABLES:
+        if is_partitioned(table, using=using):
+            for month in default_partition_months(table, using=using):
+                created += ensure_partitions(table, month, month, using=using)
+            created += ensure_partitions(table, now, add_months(now, months_ahead), using=using)
+    return created
+
+
+def expired_partitions(table: str, cutoff, using: str = DEFAULT_DB_ALIAS):
+    """Partitions whose whole range ends on or before ``cutoff``"""
+    if isinstance(cutoff, date) and not isinstance(cutoff, datetime):
+        cutoff = datetime(cutoff.year, cutoff.month, cutoff.day, tzinfo=dt_timezone.utc)
+    return [p for p in list_partitions(table, using=using) if p['upper'] <= cutoff]
+
+
+def drop_partition(table: str, name: str, using: str = DEFAULT_DB_ALIAS):
+    """
+    Detach and drop one partition
+
+    Without a DEFAULT partition, DETACH ... CONCURRENTLY only takes a SHARE
+    UPDATE EXCLUSIVE lock on the parent, so tracking inserts keep flowing; it
+    cannot run inside a transaction block, so call this outside atomic().
+    Postgres refuses it when the table has a DEFAULT partition: then a plain
+    DETACH takes an ACCESS EXCLUSIVE lock on the parent (and the DEFAULT
+    partition), holding up inserts until the drop commits.
+    """
+    if default_partition(table, using=using):
+        with transaction.atomic(using=using), connections[using].cursor() as cursor:
+            cursor.execute(f"ALTER TABLE {table} DETACH PARTITION {name}")
+            cursor.execute(f"DROP TABLE {name}")
+        return
+    with connections[using].cursor() as cursor:
+        cursor.execute(f"ALTER TABLE {table} DETACH PARTITION {name} CONCURRENTLY")
+        cursor.execute(f"DROP TABLE {name}")
+
+
+def _drop_invalid_index(cursor, name: str):
+    """Drop an index left invalid by an interrupted CREATE INDEX CONCURRENTLY"""
+    cursor.execute("SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(%s)", [name])
+    row = cursor.fetchone()
+    if row and not row[0]:
+        cursor.execute(f"DROP INDEX CONCURRENTLY {name}")
+
+
+def create_index(table: str, name: str, definition: str, using: str = DEFAULT_DB_ALIAS):
+    """
+    Create an index without blocking writes, on a plain or partitioned table
+
+    ``definition`` is everything after the table name, e.g.
+    ``USING gin (metadata jsonb_path_ops)``. CREATE INDEX CONCURRENTLY is not
+    supported on a partitioned parent, so the parent index is created ON ONLY
+    the parent (catalog only), each partition is indexed concurrently and
+    attached, and the parent index becomes valid once all are attached.
+    Partitions created later get the index automatically. Safe to re-run
+    after an interruption; must run outside a transaction block.
+    """
+    with connections[using].cursor() as cursor:
+        if not is_partitioned(table, using=using):
+            _drop_invalid_index(cursor, name)
+            cursor.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} {definition}")
+            return
+
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS {name} ON ONLY {table} {definition}")
+        partitions = [p['name'] for p in list_partitions(table, using=using)]
+        default = default_partition(table, using=using)
+        for partition in partitions + ([default] if default else []):
+            # Partitions created after the parent index already have a clone attached
+            cursor.execute(
+                """
+                SELECT 1 FROM pg_inherits i
+                JOIN pg_index x ON x.indexrelid = i.inhrelid
+                WHERE i.inhparent = to_regclass(%s) AND x.indrelid = to_regclass(%s)
+                """,
+                [name, partition],
+            )
+            if cursor.fetchone():
+                continue
+
+            # <name>_pYYYYMM (or _default), kept within the 63 character identifier limit
+            child = f"{name[:55]}_{partition.rsplit('_', 1)[-1]}"
+            _drop_invalid_index(cursor, child)
+            cursor.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {child} ON {partition} {definition}")
+            cursor.execute(f"ALTER INDEX {name} ATTACH PARTITION {child}")
+
+
+def drop_index(table: str, name: str, using: str = DEFAULT_DB_ALIAS):
+    """Drop an index created by create_index() (and its partition indexes)"""
+    concurrently = '' if is_partitioned(table, using=using) else ' CONCURRENTLY'
+    with connections[using].cursor() as cursor:
+        cursor.execute(f"DROP INDEX{concurrently} IF EXISTS {name}")
@@ -0,0 +1,164 @@
+# analytics/services/profiling.py
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+
+from django.conf import settings
+from django.core.signing import BadSignature, TimestampSigner
+
+
+SIGNER_SALT = 'analytics.profile'
+
+# Frames from these directories are shown relative to them
+_PATH_ROOTS = sorted({str(settings.BASE_DIR), *(path for path in sys.path if path.endswith('-packages'))},
+                     key=len, reverse=True)
+
+
+def profile_token() -> str:
+    """Value for the X-Analytics-Profile header, valid for ANALYTICS_PROFILE_TOKEN_MAX_AGE seconds"""
+    return TimestampSigner(salt=SIGNER_SALT).sign('profile')
+
+
+def check_profile_token(value: str) -> bool:
+    try:
+        TimestampSigner(salt=SIGNER_SALT).unsign(value, max_age=settings.ANALYTICS_PROFILE_TOKEN_MAX_AGE)
+    except BadSignature:
+        return False
+    return True
+
+
+class SamplingProfiler:
+    """
+    Record the Python stack of one thread every ``interval`` seconds
+
+    A background thread takes the samples, so the profiled code runs
+    unmodified; its cost is roughly one stack walk per sample. Use as a
+    context manager around the code to profile, on the thread running it.
+    """
+
+    def __init__(self, interval: float = 0.001, thread_id: int = None):
+        self.interval = interval
+        self.thread_id = thread_id or threading.get_ident()
+        self.stacks = Counter()
+        self.seconds = 0.0
+        self._labels = {}
+        self._stop = threading.Event()
+        self._sampler = None
+        self._started = None
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        self._sampler = threading.Thread(target=self._run, name='profiler', daemon=True)
+        self._sampler.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._sampler.join()
+        self.seconds = time.perf_counter() - self._started
+        return False
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.stacks[self._stack(frame)] += 1
+
+    def _stack(self, frame) -> str:
+        labels = []
+        while frame is not None:
+            code = frame.f_code
+            label = self._labels.get(code)
+            if label is None:
+                label = self._labels[code] = _frame_label(code)
+            labels.append(label)
+            frame = frame.f_back
+        return ';'.join(reversed(labels))
+
+    @property
+    def samples(self) -> int:
+        return sum(self.stacks.values())
+
+    def collapsed(self) -> str:
+        """Samples in the collapsed-stack format read by flamegraph.pl and speedscope"""
+        return ''.join(f'{stack} {count}\n' for stack, count in self.stacks.most_common())
+
+
+def _frame_label(code) -> str:
+    filename = code.co_filename
+    for root in _PATH_ROOTS:
+        if filename.startswith(root + os.sep):
+            filename = filename[len(root) + 1:]
+            break
+    return f'{code.co_qualname} ({filename}:{code.co_firstlineno})'.replace(';', ':')
+
+
+def route_directory(route: str) -> Path:
+    """Directory holding the profiles of one URL pattern, e.g. api/analytics/export/<dataset>"""
+    name = re.sub(r'[^A-Za-z0-9_.-]+', '_', route.strip('/')).strip('_') or 'root'
+    return Path(settings.ANALYTICS_PROFILE_ROOT) / name
+
+
+def save_profile(route: str, profiler: SamplingProfiler, method: str, status: int) -> Path:
+    """
+    Write a request's samples to ANALYTICS_PROFILE_ROOT/<route>/, keeping
+    the newest ANALYTICS_PROFILE_MAX_FILES of the route
+
+    Returns:
+        Path of the .collapsed file
+    """
+    directory = route_directory(route)
+    directory.mkdir(parents=True, exist_ok=True)
+    stamp = datetime.now().strftime('%Y%m%dT%H%M%S.%f')
+    path = directory / f'{stamp}-{os.getpid()}-{method}-{status}-{profiler.seconds * 1000:.0f}ms.collapsed'
+    path.write_text(profiler.collapsed())
+    prune_profiles(directory, settings.ANALYTICS_PROFILE_MAX_FILES)
+    return path
+
+
+def prune_profiles(route_dir: Path, keep: int) -> int:
+    """
+    Delete all but the newest ``keep`` profiles of a route
+
+    Returns:
+        Number of files deleted
+    """
+    # File names start with their timestamp, so they sort oldest first
+    paths = sorted(route_dir.glob('*.collapsed'))
+    expired = paths[:max(len(paths) - keep, 0)]
+    for path in expired:
+        # Another process may be pruning the same route
+        path.unlink(missing_ok=True)
+    return len(expired)
+
+
+def load_profiles(route_dir: Path) -> Counter:
+    """All samples stored for one route, merged"""
+    stacks = Counter()
+    for path in route_dir.glob('*.collapsed'):
+        for line in path.read_text().splitlines():
+            stack, _, count = line.rpartition(' ')
+            if stack:
+                stacks[stack] += int(count)
+    return stacks
+
+
+def top_frames(stacks: Counter, limit: int = 20) -> list:
+    """
+    Frames by samples spent in them (self) and under them (total)
+
+    Returns:
+        List of (frame, self samples, total samples), most self time first
+    """
+    own, total = Counter(), Counter()
+    for stack, count in stacks.items():
+        frames = stack.split(';')
+        own[frames[-1]] += count
+        for frame in set(frames):
+            total[frame] += count
+    return [(frame, samples, total[frame]) for frame, samples in own.most_common(limit)]
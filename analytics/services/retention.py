@@ -0,0 +1,298 @@
+# analytics/services/retention.py
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.db.models import Exists, OuterRef
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from analytics.models import APIKey, PageView, Event, DiagnosticResponse
+from analytics.routers import shard_aliases, use_shard
+from analytics.services.parquet_export import (
+    PARQUET_DATASETS, import_pyarrow, load_state, partition_path, partition_queryset, save_state,
+    write_partition,
+)
+from analytics.services.partitions import (
+    PARTITIONED_TABLES, drop_partition, expired_partitions, is_partitioned,
+)
+
+
+# Children first, so sessions are only deleted once nothing references them
+RETENTION_DATASETS = [
+    'analytics_events',
+    'analytics_page_views',
+    'analytics_diagnostic_responses',
+    'analytics_sessions',
+]
+
+STATE_FILENAME = '_archive_state.json'
+
+
+def retention_cutoff(api_key: APIKey, now: datetime = None):
+    """
+    Start of the oldest UTC day kept for an API key
+
+    Returns:
+        Aware datetime, or None when the key keeps data forever
+    """
+    if api_key.retention_days is None:
+        return None
+    today = (now or timezone.now()).astimezone(dt_timezone.utc).date()
+    first_kept = today - timedelta(days=api_key.retention_days)
+    return datetime(first_kept.year, first_kept.month, first_kept.day, tzinfo=dt_timezone.utc)
+
+
+def expired_queryset(dataset: str, api_key_id: int, cutoff: datetime):
+    """Rows of one API key dated before ``cutoff``"""
+    spec = PARQUET_DATASETS[dataset]
+    qs = spec['model'].objects.filter(**{
+        spec['api_key_field']: api_key_id,
+        f"{spec['date_field']}__lt": cutoff,
+    })
+    if dataset == 'analytics_sessions':
+        # A session that started before the cutoff stays until its last page
+        # view, event and diagnostic have expired too, and until it has not
+        # been written to since the cutoff (archive_expired() only archives
+        # a session as it was before then)
+        qs = qs.filter(
+            ~Exists(PageView.objects.filter(session=OuterRef('pk'))),
+            ~Exists(Event.objects.filter(session=OuterRef('pk'))),
+            ~Exists(DiagnosticResponse.objects.filter(session=OuterRef('pk'))),
+            last_activity_at__lt=cutoff,
+        )
+    return qs
+
+
+def expired_days(dataset: str, api_key_id: int, cutoff: datetime):
+    """UTC days with rows of one API key dated before ``cutoff``"""
+    spec = PARQUET_DATASETS[dataset]
+    qs = spec['model'].objects.filter(**{
+        spec['api_key_field']: api_key_id,
+        f"{spec['date_field']}__lt": cutoff,
+    })
+    days = (
+        qs.annotate(day=TruncDate(spec['date_field'], tzinfo=dt_timezone.utc))
+        .values_list('day', flat=True)
+        .order_by('day')
+        .distinct()
+    )
+    return list(days)
+
+
+def archive_expired(dataset: str, api_key_id: int, cutoff: datetime, root, dry_run: bool = False,
+                    chunk_size: int = None, compression: str = 'zstd', log=None) -> dict:
+    """
+    Write every expired day of one API key to a compressed Parquet day file
+
+    Days that already have a file are skipped, so an interrupted run picks
+    up where it stopped. Child rows are never written to once expired, but
+    a session of an archived day can still be updated while later activity
+    keeps it in the database: its day file is rewritten, keeping the rows
+    of the sessions deleted since, until the session has expired too.
+
+    Returns:
+        Dict with files written, files skipped and rows written
+    """
+    result = {'files': 0, 'skipped': 0, 'rows': 0}
+    for day in expired_days(dataset, api_key_id, cutoff):
+        path = partition_path(root, dataset, day, api_key_id)
+        prepend = None
+        if path.exists():
+            if dataset != 'analytics_sessions':
+                result['skipped'] += 1
+                continue
+            prepend = _stale_sessions_file(day, api_key_id, path)
+            if prepend is None:
+                result['skipped'] += 1
+                continue
+        result['files'] += 1
+        if dry_run:
+            if log:
+                log(f'{dataset}: would write {path}')
+            continue
+        count = write_partition(dataset, day, api_key_id, path,
+                                chunk_size=chunk_size, compression=compression, prepend=prepend)
+        result['rows'] += count
+        if log:
+            log(f'{dataset}: {path} ({count} rows)')
+    return result
+
+
+def _stale_sessions_file(day, api_key_id: int, path):
+    """
+    Check a sessions day file against the sessions of that day still in the
+    database
+
+    Returns:
+        None when it holds all of them as they are now, else an Arrow table
+        with its rows of the sessions deleted since (to write again)
+    """
+    pa = import_pyarrow()
+    archived = pa.parquet.read_table(path, partitioning=None)
+    archived_activity = dict(zip(archived['id'].to_pylist(), archived['last_activity_at'].to_pylist()))
+    current = dict(partition_queryset('analytics_sessions', day, api_key_id).values_list('pk', 'last_activity_at'))
+    if all(archived_activity.get(pk) == last_activity_at for pk, last_activity_at in current.items()):
+        return None
+    deleted = pa.array([pk not in current for pk in archived['id'].to_pylist()], type=pa.bool_())
+    return archived.filter(deleted)
+
+
+def _detach_events(page_views, occurred_from=None):
+    """Events are kept by their own timestamp, so unlink them from page views being deleted"""
+    events = Event.objects.filter(page_view_id__in=page_views)
+    if occurred_from is not None:
+        events = events.filter(occurred_at__gte=occurred_from)
+    events.update(page_view=None)
+
+
+def delete_expired(dataset: str, api_key_id: int, cutoff: datetime, batch_size: int,
+                   sleep: float = 0, log=None) -> int:
+    """
+    Delete the expired rows of one API key in small batches
+
+    Each batch is its own short transaction, selected by primary key and
+    still bounded by the date column so partitioned tables only touch the
+    partitions that hold expired rows.
+
+    Returns:
+        Number of rows deleted
+    """
+    spec = PARQUET_DATASETS[dataset]
+    model = spec['model']
+    queryset = expired_queryset(dataset, api_key_id, cutoff)
+
+    deleted = 0
+    while True:
+        ids = list(queryset.order_by().values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            break
+        if model is PageView:
+            _detach_events(ids)
+        _, per_model = model.objects.filter(pk__in=ids, **{f"{spec['date_field']}__lt": cutoff}).delete()
+        deleted += per_model.get(model._meta.label, 0)
+        if log:
+            log(f'{dataset}: deleted {deleted} rows')
+        if sleep:
+            time.sleep(sleep)
+    return deleted
+
+
+def global_cutoff():
+    """
+    Cutoff shared by every API key, i.e. the newest date before which all
+    data has expired
+
+    Returns:
+        Aware datetime, or None if any key keeps data forever
+    """
+    cutoffs = [retention_cutoff(api_key) for api_key in APIKey.objects.all()]
+    if not cutoffs or None in cutoffs:
+        return None
+    return min(cutoffs)
+
+
+def drop_expired_partitions(cutoff: datetime, dry_run: bool = False, log=None):
+    """
+    Drop whole monthly partitions that end on or before ``cutoff``
+
+    Much cheaper than deleting their rows one batch at a time. Only safe
+    once every API key's rows in them have been archived. Done on every shard.
+
+    Returns:
+        Names of the dropped partitions
+    """
+    dropped = []
+    for alias in shard_aliases():
+        for table in PARTITIONED_TABLES:
+            if not is_partitioned(table, using=alias):
+                continue
+            for partition in expired_partitions(table, cutoff, using=alias):
+                if dry_run:
+                    if log:
+                        log(f'would drop {partition["name"]} ({alias})')
+                    dropped.append(partition['name'])
+                    continue
+                if table == 'analytics_page_views':
+                    with use_shard(alias):
+                        page_views = PageView.objects.filter(
+                            viewed_at__gte=partition['lower'], viewed_at__lt=partition['upper'],
+                        ).values('pk')
+                        _detach_events(page_views, occurred_from=partition['upper'])
+                drop_partition(table, partition['name'], using=alias)
+                dropped.append(partition['name'])
+                if log:
+                    log(f'dropped {partition["name"]} ({alias})')
+    return dropped
+
+
+def archive_api_key(api_key: APIKey, root, dry_run: bool = False, chunk_size: int = None,
+                    compression: str = 'zstd', log=None) -> dict:
+    """
+    Archive every expired dataset of one API key
+
+    Returns:
+        Dict keyed by dataset with files, skipped, rows and seconds
+    """
+    cutoff = retention_cutoff(api_key)
+    results = {}
+    if cutoff is None:
+        return results
+
+    with use_shard(api_key.shard):
+        for dataset in RETENTION_DATASETS:
+            started = time.monotonic()
+            archived = archive_expired(dataset, api_key.pk, cutoff, root, dry_run=dry_run,
+                                       chunk_size=chunk_size, compression=compression, log=log)
+            results[dataset] = {**archived, 'seconds': time.monotonic() - started}
+    return results
+
+
+def delete_api_key(api_key: APIKey, root, batch_size: int, sleep: float = 0,
+                   dry_run: bool = False, log=None) -> dict:
+    """
+    Delete everything of one API key older than its retention
+
+    Call only after archive_api_key() has completed for the key. Once every
+    dataset is pruned the key's archive boundary is recorded in the archive
+    state file.
+
+    Returns:
+        Dict keyed by dataset with rows deleted (or that would be) and seconds
+    """
+    cutoff = retention_cutoff(api_key)
+    results = {}
+    if cutoff is None:
+        return results
+
+    with use_shard(api_key.shard):
+        for dataset in RETENTION_DATASETS:
+            started = time.monotonic()
+            if dry_run:
+                deleted = expired_queryset(dataset, api_key.pk, cutoff).count()
+            else:
+                deleted = delete_expired(dataset, api_key.pk, cutoff, batch_size, sleep=sleep, log=log)
+            results[dataset] = {'deleted': deleted, 'seconds': time.monotonic() - started}
+
+    if not dry_run:
+        state = load_state(root, STATE_FILENAME)
+        state[str(api_key.pk)] = {
+            'archived_before': cutoff.date().isoformat(),
+            'pruned_at': timezone.now().isoformat(),
+        }
+        save_state(root, state, STATE_FILENAME)
+
+    return results
+
+
+def archived_before(root) -> dict:
+    """
+    Archive boundary per API key
+
+    Returns:
+        Dict mapping api_key_id to the first date still held in the database
+    """
+    state = load_state(root, STATE_FILENAME)
+    return {
+        int(api_key_id): datetime.fromisoformat(entry['archived_before']).date()
+        for api_key_id, entry in state.items()
+    }
@@ -0,0 +1,266 @@
+# analytics/services/sharding.py
+import contextvars
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import Max, Min
+from django.db.models.constants import OnConflict
+from django.utils import timezone
+
+from accounts.models import CustomUser
+from analytics.models import APIKey, Session, PageView, Event, DiagnosticResponse
+from analytics.routers import shard_aliases, use_shard
+from analytics.services.partitions import PARTITIONED_TABLES, ensure_future_partitions, ensure_partitions
+
+
+# Moved with their session, children first when deleting
+SESSION_CHILDREN = [
+    ('analytics_page_views', PageView),
+    ('analytics_events', Event),
+    ('analytics_diagnostic_responses', DiagnosticResponse),
+]
+
+# Requests that picked up the old shard before a move flipped it can still be
+# writing there; the catch-up pass runs after this many seconds
+DEFAULT_GRACE_SECONDS = 5
+
+
+def shard_for(api_key_id: int) -> str:
+    """Database alias holding an API key's tracking data"""
+    shard = APIKey.objects.filter(pk=api_key_id).values_list('shard', flat=True).first()
+    return shard or DEFAULT_DB_ALIAS
+
+
+def shard_for_key(key: str) -> str:
+    """Database alias holding the tracking data of an API key, by key string"""
+    shard = APIKey.objects.filter(key=key).values_list('shard', flat=True).first()
+    return shard or DEFAULT_DB_ALIAS
+
+
+def shards_for(api_key_id: int = None) -> list:
+    """Shards a report has to read: the key's own, or all of them"""
+    if api_key_id is not None:
+        return [shard_for(api_key_id)]
+    return shard_aliases()
+
+
+def _call_on_shard(alias, func):
+    with use_shard(alias):
+        return func()
+
+
+def _run_on_shard(context, alias, func):
+    try:
+        return context.run(_call_on_shard, alias, func)
+    finally:
+        # Each worker thread opened its own connections
+        connections.close_all()
+
+
+def fan_out(func, aliases=None) -> list:
+    """
+    Call ``func()`` once per shard, in parallel, with its queries routed to
+    that shard
+
+    With a single shard (the default setup) ``func`` runs inline. The
+    caller's context (e.g. the replica choice for the request) is copied
+    into every worker.
+
+    Returns:
+        Results in the order of ``aliases``
+    """
+    aliases = list(aliases or shard_aliases())
+    if len(aliases) == 1:
+        return [_call_on_shard(aliases[0], func)]
+
+    workers = min(len(aliases), settings.ANALYTICS_SHARD_WORKERS)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='shard') as executor:
+        futures = [
+            executor.submit(_run_on_shard, contextvars.copy_context(), alias, func)
+            for alias in aliases
+        ]
+        return [future.result() for future in futures]
+
+
+def mirror_api_key(api_key: APIKey, aliases=None):
+    """Copy an API key row to the shards, so sessions there can reference it"""
+    values = {
+        field.attname: getattr(api_key, field.attname)
+        for field in APIKey._meta.concrete_fields if not field.primary_key
+    }
+    for alias in aliases or settings.ANALYTICS_SHARDS:
+        APIKey.objects.using(alias).update_or_create(pk=api_key.pk, defaults=values)
+
+
+def mirror_user(user_id: int, alias: str):
+    """
+    Make sure a user row exists on a shard, so a session there can link to it
+
+    Only identifying columns are copied; the shard copy cannot log in.
+    """
+    if CustomUser.objects.using(alias).filter(pk=user_id).exists():
+        return
+    user = CustomUser.objects.using(DEFAULT_DB_ALIAS).get(pk=user_id)
+    CustomUser.objects.using(alias).bulk_create([
+        CustomUser(pk=user.pk, username=user.username, email=user.email, password='!', is_active=False),
+    ], ignore_conflicts=True)
+
+
+def prepare_shard(alias: str):
+    """
+    Get a shard ready to take tracking data: API keys mirrored, partitions
+    created and row ids allocated from the shard's own block
+
+    Safe to call repeatedly.
+    """
+    for api_key in APIKey.objects.using(DEFAULT_DB_ALIAS).all():
+        mirror_api_key(api_key, [alias])
+    ensure_future_partitions(using=alias)
+
+    floor = shard_aliases().index(alias) * settings.ANALYTICS_SHARD_ID_BLOCK
+    if not floor:
+        return
+    with connections[alias].cursor() as cursor:
+        for model in (Session, PageView, Event, DiagnosticResponse):
+            cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [model._meta.db_table])
+            sequence = cursor.fetchone()[0]
+            cursor.execute(f"SELECT last_value FROM {sequence}")
+            if cursor.fetchone()[0] < floor:
+                cursor.execute("SELECT setval(%s, %s, false)", [sequence, floor])
+
+
+def _insert(model, objs, target: str):
+    """
+    Insert rows into another shard exactly as they were read, skipping those already there
+
+    bulk_create() would stamp the auto_now / auto_now_add columns
+    (created_at, viewed_at, last_activity_at) with the current time, and
+    viewed_at is part of the page views' primary key: a raw insert, as
+    loaddata does, keeps the source values.
+    """
+    fields = [field for field in model._meta.concrete_fields if not field.generated]
+    queryset = model._base_manager.using(target)
+    size = max(connections[target].ops.bulk_batch_size(fields, objs), 1)
+    for i in range(0, len(objs), size):
+        queryset._insert(objs[i:i + size], fields, raw=True, on_conflict=OnConflict.IGNORE)
+
+
+def _copy(model, queryset, target: str, batch_size: int):
+    """Insert rows read from one shard into another, keeping their ids; rows already there are skipped"""
+    batch = []
+    for obj in queryset.order_by('pk').iterator(chunk_size=batch_size):
+        batch.append(obj)
+        if len(batch) >= batch_size:
+            _insert(model, batch, target)
+            batch = []
+    if batch:
+        _insert(model, batch, target)
+
+
+def _ensure_target_partitions(api_key: APIKey, source: str, target: str):
+    for table, model in SESSION_CHILDREN:
+        if table not in PARTITIONED_TABLES:
+            continue
+        date_field = PARTITIONED_TABLES[table]
+        bounds = model.objects.using(source).filter(session__api_key=api_key).aggregate(
+            first=Min(date_field), last=Max(date_field),
+        )
+        if bounds['first']:
+            ensure_partitions(table, bounds['first'], bounds['last'], using=target)
+
+
+def _copy_sessions(session_ids, source: str, target: str, batch_size: int):
+    """Copy a batch of sessions and everything recorded in them, as one transaction on the target"""
+    with transaction.atomic(using=target):
+        user_ids = Session.objects.using(source).filter(pk__in=session_ids, user__isnull=False) \
+            .values_list('user_id', flat=True).distinct()
+        for user_id in user_ids:
+            mirror_user(user_id, target)
+        _copy(Session, Session.objects.using(source).filter(pk__in=session_ids), target, batch_size)
+        for _, model in SESSION_CHILDREN:
+            _copy(model, model.objects.using(source).filter(session_id__in=session_ids), target, batch_size)
+
+
+def _source_counts(api_key: APIKey, source: str) -> dict:
+    counts = {'analytics_sessions': Session.objects.using(source).filter(api_key=api_key).count()}
+    for table, model in SESSION_CHILDREN:
+        counts[table] = model.objects.using(source).filter(session__api_key=api_key).count()
+    return counts
+
+
+def _sync_sessions(session_ids, source: str, target: str):
+    """Bring target copies of sessions up to date with changes made on the source after they were copied"""
+    fields = [field.name for field in Session._meta.concrete_fields if not field.primary_key]
+    latest = dict(
+        Session.objects.using(target).filter(pk__in=session_ids).values_list('pk', 'last_activity_at')
+    )
+    changed = [
+        session for session in Session.objects.using(source).filter(pk__in=session_ids)
+        if session.pk in latest and session.last_activity_at > latest[session.pk]
+    ]
+    if changed:
+        Session.objects.using(target).bulk_update(changed, fields)
+
+
+def _batches(queryset, batch_size: int):
+    ids = list(queryset.order_by('pk').values_list('pk', flat=True))
+    for i in range(0, len(ids), batch_size):
+        yield ids[i:i + batch_size]
+
+
+def move_api_key(api_key: APIKey, target: str, batch_size: int = 1000, grace: float = DEFAULT_GRACE_SECONDS,
+                 dry_run: bool = False, log=None) -> dict:
+    """
+    Move an API key's sessions, page views, events and diagnostic responses
+    to another shard
+
+    Rows keep their ids. Tracking keeps running: everything is copied, the
+    key is switched to the target, and once requests that were already
+    running on the old shard have finished, rows and session updates they
+    added are copied too. Only then is the data deleted from the source.
+    An interrupted move can simply be run again.
+
+    Returns:
+        Dict of rows moved per table (or that would be, with dry_run)
+    """
+    source = api_key.shard or DEFAULT_DB_ALIAS
+    target = target or DEFAULT_DB_ALIAS
+    sessions = Session.objects.using(source).filter(api_key=api_key)
+
+    if dry_run:
+        return _source_counts(api_key, source)
+
+    if target != DEFAULT_DB_ALIAS:
+        prepare_shard(target)
+    _ensure_target_partitions(api_key, source, target)
+
+    started_at = timezone.now()
+    copied = 0
+    for session_ids in _batches(sessions, batch_size):
+        _copy_sessions(session_ids, source, target, batch_size)
+        copied += len(session_ids)
+        if log:
+            log(f"copied {copied} sessions")
+
+    APIKey.objects.filter(pk=api_key.pk).update(shard='' if target == DEFAULT_DB_ALIAS else target)
+    api_key.refresh_from_db(fields=['shard'])
+    mirror_api_key(api_key)
+    if log:
+        log(f"switched to {target}, waiting {grace:g}s for requests still on {source}")
+    time.sleep(grace)
+
+    # Sessions started or active on the source since the copy began
+    _ensure_target_partitions(api_key, source, target)
+    recent = sessions.filter(last_activity_at__gte=started_at)
+    for session_ids in _batches(recent, batch_size):
+        _copy_sessions(session_ids, source, target, batch_size)
+        _sync_sessions(session_ids, source, target)
+
+    counts = _source_counts(api_key, source)
+    for session_ids in _batches(sessions, batch_size):
+        Session.objects.using(source).filter(pk__in=session_ids).delete()
+        if log:
+            log(f"deleted {len(session_ids)} sessions from {source}")
+    return counts
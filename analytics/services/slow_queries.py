@@ -0,0 +1,184 @@
+# analytics/services/slow_queries.py
+import hashlib
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, connections, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from analytics.models import SlowQuery
+
+
+logger = logging.getLogger(__name__)
+
+# Route of the request being served (set by SlowQueryMiddleware)
+_route = ContextVar('analytics_slow_query_route', default=None)
+
+# Per thread: slow queries not stored yet, and whether they are being stored
+_local = threading.local()
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PLACEHOLDER_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+_VALUES_ROWS = re.compile(r'VALUES \(\.\.\.\)(?:, \(\.\.\.\))+')
+_SAVEPOINT = re.compile(r'^(?:SAVEPOINT|RELEASE SAVEPOINT|ROLLBACK TO SAVEPOINT)\b', re.IGNORECASE)
+
+# SQLSTATE of statements that write in a read-only transaction
+READ_ONLY_SQL_TRANSACTION = '25006'
+
+_PROJECT_ROOT = str(settings.BASE_DIR) + os.sep
+_THIS_FILE = __file__
+
+
+def normalize_sql(sql: str) -> str:
+    """SQL with literals and parameters replaced by ?, lists and multi-row VALUES collapsed"""
+    sql = _STRING.sub('?', sql)
+    sql = sql.replace('%s', '?')
+    sql = _NUMBER.sub('?', sql)
+    sql = re.sub(r'\s+', ' ', sql).strip()
+    sql = _PLACEHOLDER_LIST.sub('(...)', sql)
+    return _VALUES_ROWS.sub('VALUES (...)', sql)
+
+
+def fingerprint(normalized_sql: str) -> str:
+    return hashlib.sha1(normalized_sql.encode()).hexdigest()
+
+
+def current_route() -> str:
+    """URL pattern of the current request, else the management command being run"""
+    route = _route.get()
+    if route is not None:
+        return route
+    if len(sys.argv) > 1 and os.path.basename(sys.argv[0]) == 'manage.py':
+        return f'manage.py {sys.argv[1]}'
+    return ''
+
+
+def call_site() -> str:
+    """Innermost frame from the project's own code, e.g. 'analytics/api/tracking.py:140 track_pageview'"""
+    frame = sys._getframe(1)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if filename.startswith(_PROJECT_ROOT) and filename != _THIS_FILE and '-packages' not in filename:
+            return f'{filename[len(_PROJECT_ROOT):]}:{frame.f_lineno} {frame.f_code.co_qualname}'
+        frame = frame.f_back
+    return ''
+
+
+def slow_query_wrapper(execute, sql, params, many, context):
+    """
+    execute_wrapper noting queries slower than ANALYTICS_SLOW_QUERY_MS
+
+    Installed on every connection when it is opened (see analytics.signals).
+    Queries are stored right away outside transactions; inside a request or
+    a transaction they wait for flush(), so the EXPLAIN never adds to the
+    response time and the log survives a rollback.
+    """
+    if getattr(_local, 'flushing', False):
+        return execute(sql, params, many, context)
+
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        if elapsed_ms >= settings.ANALYTICS_SLOW_QUERY_MS and not _SAVEPOINT.match(sql):
+            connection = context['connection']
+            pending = getattr(_local, 'pending', None)
+            if pending is None:
+                pending = _local.pending = []
+            pending.append({
+                'database': connection.alias, 'sql': sql, 'params': None if many else params,
+                'many': many, 'ms': elapsed_ms, 'route': current_route(), 'function': call_site(),
+            })
+            if _route.get() is None and not connection.in_atomic_block:
+                flush()
+
+
+def flush():
+    """Store the slow queries noted by this thread"""
+    pending = getattr(_local, 'pending', None)
+    if not pending:
+        return
+    _local.pending = []
+    _local.flushing = True
+    try:
+        for entry in pending:
+            _store(entry)
+    except DatabaseError:
+        logger.warning("Could not store slow queries", exc_info=True)
+    finally:
+        _local.flushing = False
+
+
+def explain(database: str, sql: str, params) -> str:
+    """
+    Plan of a query: EXPLAIN (ANALYZE, BUFFERS) for reads, plain EXPLAIN
+    otherwise, since ANALYZE runs the statement. ANALYZE runs in a read-only
+    transaction: a SELECT that writes anyway (nextval(), setval(), FOR
+    UPDATE, functions that modify data) fails there, before a rollback could
+    miss its effects on sequences, and gets a plain EXPLAIN instead. Limited
+    to ANALYTICS_SLOW_QUERY_EXPLAIN_TIMEOUT_MS.
+    """
+    if sql.lstrip()[:6].upper() == 'SELECT':
+        try:
+            return _explain(database, 'EXPLAIN (ANALYZE, BUFFERS) ', sql, params, read_only=True)
+        except DatabaseError as exc:
+            if getattr(exc.__cause__, 'pgcode', None) != READ_ONLY_SQL_TRANSACTION:
+                return f'EXPLAIN failed: {exc}'
+    try:
+        return _explain(database, 'EXPLAIN ', sql, params)
+    except DatabaseError as exc:
+        return f'EXPLAIN failed: {exc}'
+
+
+def _explain(database: str, prefix: str, sql: str, params, read_only: bool = False) -> str:
+    # In a transaction (or savepoint) that is always rolled back
+    with transaction.atomic(using=database):
+        with connections[database].cursor() as cursor:
+            if read_only:
+                cursor.execute('SET LOCAL transaction_read_only = on')
+            cursor.execute('SET LOCAL statement_timeout = %s',
+                           [int(settings.ANALYTICS_SLOW_QUERY_EXPLAIN_TIMEOUT_MS)])
+            cursor.execute(prefix + sql, params)
+            plan = '\n'.join(row[0] for row in cursor.fetchall())
+        transaction.set_rollback(True, using=database)
+    return plan
+
+
+def _store(entry: dict):
+    normalized = normalize_sql(entry['sql'])
+    digest = fingerprint(normalized)
+    now = timezone.now()
+    call_site_rows = SlowQuery.objects.filter(fingerprint=digest, route=entry['route'][:255],
+                                              function=entry['function'][:255])
+    changes = {
+        'calls': F('calls') + 1, 'total_ms': F('total_ms') + entry['ms'],
+        'max_ms': Greatest('max_ms', Value(entry['ms'])), 'last_ms': entry['ms'], 'last_seen_at': now,
+    }
+    if call_site_rows.update(**changes):
+        return
+
+    plan = SlowQuery.objects.filter(fingerprint=digest).exclude(plan='').values_list('plan', flat=True).first()
+    if plan is None:
+        plan = 'Not captured: executemany()' if entry['many'] else explain(entry['database'], entry['sql'],
+                                                                           entry['params'])
+    try:
+        with transaction.atomic():
+            SlowQuery.objects.create(
+                fingerprint=digest, normalized_sql=normalized, sample_sql=entry['sql'],
+                sample_params=repr(entry['params'])[:2000] if entry['params'] is not None else '',
+                database=entry['database'], route=entry['route'][:255], function=entry['function'][:255],
+                total_ms=entry['ms'], max_ms=entry['ms'], last_ms=entry['ms'], plan=plan, last_seen_at=now,
+            )
+    except IntegrityError:
+        # Another process recorded the same call site first
+        call_site_rows.update(**changes)
@@ -0,0 +1,158 @@
+# analytics/services/startup.py
+import re
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import connections
+
+
+# Any user agent: parsing one loads and compiles the parser's regex tables
+PRELOAD_USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0'
+
+# What a worker does before it can answer, in order. Each stage runs in the
+# same fresh interpreter after the previous ones, so its cost is only what
+# it adds on top of them.
+STAGES = [
+    ('django.setup', "import django\ndjango.setup()"),
+    ('wsgi', "from django.core.wsgi import get_wsgi_application\nget_wsgi_application()"),
+    ('urlconf', "from django.urls import get_resolver\nget_resolver().url_patterns"),
+    ('first tracking request', "from analytics.api.tracking import parse_user_agent\n"
+                               f"parse_user_agent({PRELOAD_USER_AGENT!r})"),
+    ('first dashboard request', "from rest_framework_simplejwt.tokens import AccessToken"),
+    ('admin', "from django.urls import resolve\nresolve('/admin/').func"),
+]
+
+_STAGE_MARKER = '# analytics-startup-stage '
+_IMPORT_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+
+
+def preload():
+    """
+    Load in the gunicorn master what API workers otherwise load on their
+    first requests, so that with --preload forked workers share it
+
+    The URLconf (the API and its schemas) and the user agent tables are
+    loaded; the admin stays lazy. No query is run, and any connection
+    opened anyway is closed so that no worker inherits its socket.
+    """
+    from django.urls import get_resolver
+
+    from analytics.api.tracking import parse_user_agent
+
+    get_resolver().url_patterns
+    parse_user_agent(PRELOAD_USER_AGENT)
+    connections.close_all()
+
+
+def _script(stages) -> str:
+    lines = [
+        'import os, sys, time',
+        f"os.environ.setdefault('DJANGO_SETTINGS_MODULE', {settings.SETTINGS_MODULE!r})",
+        'started = time.perf_counter()',
+    ]
+    for name, code in stages:
+        lines.append(code)
+        lines.append(f"print({_STAGE_MARKER!r} + {name!r} + ' ' + repr(time.perf_counter() - started),"
+                     " file=sys.stderr, flush=True)")
+        lines.append('started = time.perf_counter()')
+    return '\n'.join(lines)
+
+
+def _parse(stderr: str) -> dict:
+    """Stage wall times and per-module import times (microseconds) from one -X importtime run"""
+    stages = {}
+    modules = {}
+    stage_modules = []
+    for line in stderr.splitlines():
+        if line.startswith(_STAGE_MARKER):
+            name, _, seconds = line[len(_STAGE_MARKER):].rpartition(' ')
+            stages[name] = {'seconds': float(seconds), 'modules': stage_modules}
+            stage_modules = []
+            continue
+        match = _IMPORT_LINE.match(line)
+        if match:
+            own, cumulative, indent, module = match.groups()
+            modules[module] = {'self_us': int(own), 'cumulative_us': int(cumulative)}
+            stage_modules.append(module)
+    return {'stages': stages, 'modules': modules}
+
+
+def measure_once(stages=STAGES) -> dict:
+    """
+    Run the startup stages in a fresh interpreter with -X importtime
+
+    Returns:
+        Dict with ``stages`` (seconds and modules imported, per stage) and
+        ``modules`` (self and cumulative import time, per module)
+    """
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', _script(stages)],
+        cwd=settings.BASE_DIR, capture_output=True, text=True,
+    )
+    if result.returncode:
+        raise RuntimeError(f"Startup benchmark failed:\n{result.stderr[-2000:]}")
+    return _parse(result.stderr)
+
+
+def package_of(module: str) -> str:
+    return module.partition('.')[0]
+
+
+def measure(repeat: int = 5, stages=STAGES) -> dict:
+    """
+    Median of ``repeat`` fresh-interpreter runs
+
+    Returns:
+        Dict with ``stages``: {name: {seconds, packages: {package: ms}}},
+        ``packages``: {package: ms} over all stages, and ``modules``:
+        {module: {self_ms, cumulative_ms}}, all medians across runs
+    """
+    runs = [measure_once(stages) for _ in range(repeat)]
+
+    stage_seconds = defaultdict(list)
+    stage_packages = defaultdict(lambda: defaultdict(list))
+    package_ms = defaultdict(list)
+    module_self = defaultdict(list)
+    module_cumulative = defaultdict(list)
+    for run in runs:
+        totals = defaultdict(float)
+        for name, stage in run['stages'].items():
+            stage_seconds[name].append(stage['seconds'])
+            per_package = defaultdict(float)
+            for module in stage['modules']:
+                per_package[package_of(module)] += run['modules'][module]['self_us'] / 1000
+            for package, ms in per_package.items():
+                stage_packages[name][package].append(ms)
+                totals[package] += ms
+        for package, ms in totals.items():
+            package_ms[package].append(ms)
+        for module, timing in run['modules'].items():
+            module_self[module].append(timing['self_us'] / 1000)
+            module_cumulative[module].append(timing['cumulative_us'] / 1000)
+
+    # A package missing from some runs counts as 0 there
+    def median(values):
+        return round(statistics.median(values + [0.0] * (repeat - len(values))), 3)
+
+    return {
+        'stages': {
+            name: {
+                'seconds': round(statistics.median(stage_seconds[name]), 4),
+                'packages': dict(sorted(((package, median(values)) for package, values in
+                                         stage_packages[name].items()), key=lambda item: -item[1])),
+            }
+            for name, _ in stages
+        },
+        'packages': dict(sorted(((package, median(values)) for package, values in package_ms.items()),
+                                key=lambda item: -item[1])),
+        'modules': {
+            module: {'self_ms': median(module_self[module]), 'cumulative_ms': median(module_cumulative[module])}
+            for module in module_self
+        },
+        'python': sys.version.split()[0],
+        'created_at': datetime.now(dt_timezone.utc).isoformat(),
+    }
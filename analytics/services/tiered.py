@@ -0,0 +1,284 @@
+# analytics/services/tiered.py
+import json
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from functools import reduce
+from operator import or_
+from pathlib import Path
+
+from django.conf import settings
+from django.db.models import Count, Q, Sum
+
+from analytics.models import Event
+from analytics.services.exporter import day_bounds
+from analytics.services.parquet_export import PARQUET_DATASETS, import_pyarrow
+from analytics.services.retention import archived_before
+from analytics.services.sharding import fan_out, shards_for
+
+
+# Reports are computed as additive partial aggregates so the live (hot) and
+# archived (cold) parts of a date range can be answered separately and summed.
+#
+# For an API key pruned by prune_retention, rows dated before its archive
+# boundary are read from the Parquet day files and excluded from Postgres
+# (sessions that outlived the boundary are still in the database but were
+# archived with their start day). Everything else is read from Postgres,
+# from every shard in parallel (or just the key's shard) and summed.
+
+DASHBOARD_TOTALS = ('sessions', 'conversions', 'bounces', 'duration_sum', 'page_views', 'events')
+
+# Event types whose per-step counts the diagnostic funnel reports
+FUNNEL_STEP_TYPES = ('diagnostic_question_shown', 'diagnostic_step_completed')
+MAX_FUNNEL_STEPS = 9
+
+
+def _import_dataset():
+    pa = import_pyarrow()
+    import pyarrow.compute
+    import pyarrow.dataset
+    import pyarrow.fs
+    return pa
+
+
+def _utc_midnight(day: date) -> datetime:
+    return datetime(day.year, day.month, day.day, tzinfo=dt_timezone.utc)
+
+
+def archive_boundaries(api_key_id: int = None, root=None) -> dict:
+    """
+    Archive boundary of every pruned API key, optionally restricted to one key
+
+    Returns:
+        Dict mapping api_key_id to the first date still held in Postgres
+    """
+    boundaries = archived_before(root or settings.ANALYTICS_ARCHIVE_ROOT)
+    if api_key_id is not None:
+        boundaries = {key: day for key, day in boundaries.items() if key == api_key_id}
+    return boundaries
+
+
+def hot_queryset(dataset: str, lower=None, upper=None, api_key_id: int = None, boundaries=None):
+    """Postgres rows of a dataset in [lower, upper), excluding what is served from the archive"""
+    spec = PARQUET_DATASETS[dataset]
+    date_field, api_key_field = spec['date_field'], spec['api_key_field']
+
+    qs = spec['model'].objects.all()
+    if lower:
+        qs = qs.filter(**{f'{date_field}__gte': lower})
+    if upper:
+        qs = qs.filter(**{f'{date_field}__lt': upper})
+    if api_key_id is not None:
+        qs = qs.filter(**{api_key_field: api_key_id})
+    for key, boundary in (boundaries or {}).items():
+        qs = qs.exclude(**{api_key_field: key, f'{date_field}__lt': _utc_midnight(boundary)})
+    return qs
+
+
+def archive_dataset(dataset: str, root=None):
+    """
+    Open the archived day files of a dataset as a memory-mapped Arrow dataset
+
+    Returns:
+        pyarrow.dataset.Dataset, or None if nothing has been archived
+    """
+    pa = _import_dataset()
+    path = Path(root or settings.ANALYTICS_ARCHIVE_ROOT) / dataset
+    if not path.is_dir():
+        return None
+    partitioning = pa.dataset.partitioning(
+        pa.schema([('date', pa.date32()), ('api_key', pa.int64())]), flavor='hive',
+    )
+    return pa.dataset.dataset(
+        str(path.resolve()),
+        format='parquet',
+        partitioning=partitioning,
+        filesystem=pa.fs.LocalFileSystem(use_mmap=True),
+    )
+
+
+def archive_filter(dataset: str, lower=None, upper=None, boundaries=None):
+    """
+    Arrow filter expression selecting the archived rows of a dataset in [lower, upper)
+
+    The ``date`` and ``api_key`` terms are on partition directories, so
+    files outside the range or belonging to other keys are never opened;
+    the timestamp terms are checked against row group statistics.
+
+    Returns:
+        pyarrow.dataset.Expression, or None when no archived rows can match
+    """
+    pa = _import_dataset()
+    field = pa.dataset.field
+    date_field = PARQUET_DATASETS[dataset]['date_field']
+
+    terms = [
+        (field('api_key') == key) & (field('date') < boundary)
+        for key, boundary in (boundaries or {}).items()
+        if lower is None or lower < _utc_midnight(boundary)
+    ]
+    if not terms:
+        return None
+
+    expression = reduce(or_, terms)
+    if lower:
+        expression &= (field('date') >= lower.astimezone(dt_timezone.utc).date()) \
+            & (field(date_field) >= pa.scalar(lower, pa.timestamp('us', tz='UTC')))
+    if upper:
+        last_day = (upper - timedelta(microseconds=1)).astimezone(dt_timezone.utc).date()
+        expression &= (field('date') <= last_day) \
+            & (field(date_field) < pa.scalar(upper, pa.timestamp('us', tz='UTC')))
+    return expression
+
+
+def archive_filter_needed(lower, boundaries) -> bool:
+    """Whether any pruned key has archived data at or after ``lower``"""
+    return any(lower is None or lower < _utc_midnight(boundary) for boundary in boundaries.values())
+
+
+def _hot_dashboard_totals(lower, upper, api_key_id, boundaries) -> dict:
+    totals = hot_queryset('analytics_sessions', lower, upper, api_key_id, boundaries).aggregate(
+        sessions=Count('id'),
+        conversions=Count('id', filter=Q(has_converted=True)),
+        bounces=Count('id', filter=Q(is_bounce=True)),
+        duration_sum=Sum('duration_seconds'),
+    )
+    totals['duration_sum'] = totals['duration_sum'] or 0
+    totals['page_views'] = hot_queryset('analytics_page_views', lower, upper, api_key_id, boundaries).count()
+    totals['events'] = hot_queryset('analytics_events', lower, upper, api_key_id, boundaries).count()
+    return totals
+
+
+def _archive_dashboard_totals(lower, upper, boundaries, root) -> dict:
+    pa = _import_dataset()
+    pc = pa.compute
+    totals = dict.fromkeys(DASHBOARD_TOTALS, 0)
+
+    sessions = archive_dataset('analytics_sessions', root)
+    expression = archive_filter('analytics_sessions', lower, upper, boundaries)
+    if sessions is not None and expression is not None:
+        table = sessions.to_table(columns=['has_converted', 'is_bounce', 'duration_seconds'],
+                                  filter=expression)
+        totals['sessions'] = table.num_rows
+        totals['conversions'] = pc.sum(pc.cast(table['has_converted'], pa.int64())).as_py() or 0
+        totals['bounces'] = pc.sum(pc.cast(table['is_bounce'], pa.int64())).as_py() or 0
+        totals['duration_sum'] = pc.sum(table['duration_seconds']).as_py() or 0
+
+    for dataset, total in (('analytics_page_views', 'page_views'), ('analytics_events', 'events')):
+        archived = archive_dataset(dataset, root)
+        expression = archive_filter(dataset, lower, upper, boundaries)
+        if archived is not None and expression is not None:
+            totals[total] = archived.count_rows(filter=expression)
+    return totals
+
+
+def dashboard_totals(start: date = None, end: date = None, api_key_id: int = None, root=None) -> dict:
+    """
+    Session, page view and event totals over an inclusive date range,
+    combining Postgres with the archive
+
+    Returns:
+        Dict with the DASHBOARD_TOTALS keys
+    """
+    lower, upper = day_bounds(start, end)
+    boundaries = archive_boundaries(api_key_id, root)
+
+    parts = fan_out(lambda: _hot_dashboard_totals(lower, upper, api_key_id, boundaries), shards_for(api_key_id))
+    totals = {key: sum(part[key] for part in parts) for key in DASHBOARD_TOTALS}
+    if archive_filter_needed(lower, boundaries):
+        archived = _archive_dashboard_totals(lower, upper, boundaries, root)
+        totals = {key: totals[key] + archived[key] for key in DASHBOARD_TOTALS}
+    return totals
+
+
+def _step_number(value):
+    """Same rule as the Event.step_number generated column: JSON integers only"""
+    if isinstance(value, int) and not isinstance(value, bool) and abs(value) < 10 ** 9:
+        return value
+    return None
+
+
+def _hot_funnel_counts(lower, upper, api_key_id, boundaries, diagnostic_name) -> dict:
+    events = hot_queryset('analytics_events', lower, upper, api_key_id, boundaries).filter(
+        event_type__in=Event.DIAGNOSTIC_EVENT_TYPES,
+    )
+    if diagnostic_name:
+        events = events.filter(event_label=diagnostic_name)
+
+    rows = events.values('event_type', 'step_number').annotate(count=Count('id')).order_by()
+    counts = {}
+    for row in rows:
+        step = row['step_number'] if row['event_type'] in FUNNEL_STEP_TYPES else None
+        counts[(row['event_type'], step)] = counts.get((row['event_type'], step), 0) + row['count']
+    return counts
+
+
+def _archive_funnel_counts(lower, upper, boundaries, diagnostic_name, root) -> dict:
+    pa = _import_dataset()
+    archived = archive_dataset('analytics_events', root)
+    expression = archive_filter('analytics_events', lower, upper, boundaries)
+    if archived is None or expression is None:
+        return {}
+
+    expression &= pa.compute.starts_with(pa.dataset.field('event_type'), pattern='diagnostic_')
+    if diagnostic_name:
+        expression &= pa.dataset.field('event_label') == diagnostic_name
+    table = archived.to_table(columns=['event_type', 'metadata'], filter=expression)
+
+    counts = {}
+    for event_type, metadata in zip(table['event_type'].to_pylist(), table['metadata'].to_pylist()):
+        step = None
+        if event_type in FUNNEL_STEP_TYPES and metadata:
+            step = _step_number(json.loads(metadata).get('step_number'))
+        counts[(event_type, step)] = counts.get((event_type, step), 0) + 1
+    return counts
+
+
+def diagnostic_funnel(diagnostic_name: str = None, start: date = None, end: date = None,
+                      api_key_id: int = None, root=None) -> dict:
+    """
+    Diagnostic funnel and per-step drop-off, combining Postgres with the archive
+
+    Returns:
+        Dict with diagnostic_name, funnel, steps and conversion_rate
+    """
+    lower, upper = day_bounds(start, end)
+    boundaries = archive_boundaries(api_key_id, root)
+
+    parts = fan_out(lambda: _hot_funnel_counts(lower, upper, api_key_id, boundaries, diagnostic_name),
+                    shards_for(api_key_id))
+    if archive_filter_needed(lower, boundaries):
+        parts.append(_archive_funnel_counts(lower, upper, boundaries, diagnostic_name, root))
+    counts = {}
+    for part in parts:
+        for key, count in part.items():
+            counts[key] = counts.get(key, 0) + count
+
+    def total(event_type):
+        return sum(count for (kind, _), count in counts.items() if kind == event_type)
+
+    funnel = {
+        'started': counts.get(('diagnostic_question_shown', 1), 0),
+        'completed_all_questions': total('diagnostic_contact_form_shown'),
+        'submitted_email': total('diagnostic_email_submitted'),
+        'skipped_email': total('diagnostic_contact_skipped'),
+        'viewed_results': total('diagnostic_results_viewed'),
+    }
+
+    steps = []
+    for i in range(1, MAX_FUNNEL_STEPS + 1):
+        step_shown = counts.get(('diagnostic_question_shown', i), 0)
+        step_completed = counts.get(('diagnostic_step_completed', i), 0)
+        if step_shown == 0:
+            break
+        steps.append({
+            'step_number': i,
+            'shown': step_shown,
+            'completed': step_completed,
+            'dropoff_rate': round((1 - step_completed / step_shown) * 100, 2),
+        })
+
+    return {
+        'diagnostic_name': diagnostic_name,
+        'funnel': funnel,
+        'steps': steps,
+        'conversion_rate': round(funnel['submitted_email'] / funnel['started'] * 100, 2) if funnel['started'] > 0 else 0,
+    }
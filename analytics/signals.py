@@ -0,0 +1,51 @@
+from django.conf import settings
+from django.core.signals import request_finished
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from analytics.models import APIKey, Session
+from analytics.services.sharding import mirror_api_key, mirror_user, prepare_shard
+from analytics.services.slow_queries import flush, slow_query_wrapper
+
+
+# API keys and linked users are referenced by sessions on every shard, so
+# changes on the primary are copied over (see analytics.services.sharding)
+
+@receiver(post_save, sender=APIKey)
+def mirror_api_key_to_shards(sender, instance, using, created=False, **kwargs):
+    if settings.ANALYTICS_SHARDS and using not in settings.ANALYTICS_SHARDS:
+        mirror_api_key(instance)
+        if created and instance.shard:
+            prepare_shard(instance.shard)
+
+
+@receiver(post_delete, sender=APIKey)
+def delete_api_key_from_shards(sender, instance, using, **kwargs):
+    if using not in settings.ANALYTICS_SHARDS:
+        for alias in settings.ANALYTICS_SHARDS:
+            APIKey.objects.using(alias).filter(pk=instance.pk).delete()
+
+
+@receiver(pre_save, sender=Session)
+def mirror_session_user(sender, instance, using, update_fields=None, **kwargs):
+    if update_fields is not None and 'user' not in update_fields:
+        return
+    if instance.user_id is not None and using in settings.ANALYTICS_SHARDS:
+        mirror_user(instance.user_id, using)
+
+
+# Slow query log (see analytics.services.slow_queries)
+
+@receiver(connection_created)
+def watch_slow_queries(sender, connection, **kwargs):
+    # First in the list, so it times the other wrappers too and survives
+    # execute_wrapper() blocks that were entered before the connection opened
+    if settings.ANALYTICS_SLOW_QUERY_MS and slow_query_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, slow_query_wrapper)
+
+
+@receiver(request_finished)
+def store_slow_queries(sender, **kwargs):
+    # After the response has been sent, so EXPLAINs do not delay it
+    flush()
@@ -1,3 +1,867 @@
-from django.test import TestCase
+import gzip
+import json
+import re
+import tempfile
+import uuid
+import zlib
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from itertools import cycle
+from pathlib import Path
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import msgpack
+import pyarrow.parquet
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import resolve
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from accounts.models import CustomUser
+from analytics.fields import DictionaryCache, dictionary_cache
+from analytics.middleware import ReplicaRoutingMiddleware
+from analytics.models import (
+    APIKey, DiagnosticResponse, Event, EventCategory, EventType, ExportJob, PagePath, PageView, Session, SlowQuery,
+)
+from analytics.routers import read_alias, use_shard
+from analytics.services.export_jobs import claim_next_job
+from analytics.services.live import LiveWindow
+from analytics.services.live_stream import stream_token, stream_token_user_id
+from analytics.services.metadata import (
+    existing_index_keys, filter_metadata, metadata_index_name, sync_metadata_indexes, validate_key,
+)
+from analytics.services.parquet_export import partition_path
+from analytics.services.profiling import route_directory, save_profile
+from analytics.services.partitions import (
+    default_partition, drop_partition, ensure_partitions, list_partitions, partition_name,
+)
+from analytics.services.retention import archive_api_key, delete_api_key, drop_expired_partitions, global_cutoff
+from analytics.services.sharding import fan_out, move_api_key
+from analytics.services.slow_queries import _store, explain
+from django_project.api import api
+
+
+# Tracking data in the test database, see EndpointQueryBudgetTests.setUpTestData
+SESSIONS = 60
+EVENT_TYPES = ['diagnostic_started', 'diagnostic_step_completed', 'diagnostic_email_submitted']
+
+# Most queries and rows each API endpoint may use for the requests made in
+# EndpointQueryBudgetTests. Lower a budget when a change makes an endpoint
+# cheaper; raise it only together with the change that needs it. The
+# failure output lists the queries that were issued.
+QUERY_BUDGETS = {
+    'login': {'queries': 2, 'rows': 2},
+    'refresh_token': {'queries': 1, 'rows': 0},
+    'track_pageview': {'queries': 8, 'rows': 5},
+    'capture_email': {'queries': 6, 'rows': 3},
+    'track_event': {'queries': 7, 'rows': 4},
+    # One page view lookup per page in the batch (two here) and a single
+    # insert returning the ids of the 20 events
+    'track_batch': {'queries': 8, 'rows': 3 + 20},
+    'submit_diagnostic': {'queries': 4, 'rows': 3},
+    'get_dashboard_stats': {'queries': 4, 'rows': 4},
+    # One lookup per funnel event type that has no dictionary entry yet
+    'get_diagnostic_analytics': {'queries': 8, 'rows': 4},
+    # The user and the API key: the counts come from the live window
+    'get_live_visitors': {'queries': 2, 'rows': 2},
+    'get_stream_token': {'queries': 1, 'rows': 1},
+    # The same, once per stream
+    'stream_live': {'queries': 2, 'rows': 2},
+    # Rows grow with the page size (50) and the export with the data; the
+    # budgets catch reading more rows than are returned
+    'get_sessions': {'queries': 2, 'rows': 50 + 1},
+    'export_dataset': {'queries': 2, 'rows': SESSIONS + 1},
+}
+
+# Live visitors window of the tests, apart from the one of a running server
+LIVE_PATH = Path(tempfile.gettempdir()) / 'analytics-live-tests'
+
+# Shard of the sharding tests: they run when ANALYTICS_SHARD_DATABASES names
+# one, e.g. "shard1=analytics_shard1" (a second database on the local server)
+SHARD = settings.ANALYTICS_SHARDS[0] if settings.ANALYTICS_SHARDS else None
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36'
+
+
+class RecordedQuery:
+    def __init__(self, alias, sql):
+        self.alias = alias
+        self.sql = sql
+        self.rows = 0
+
+
+def _counting(cursor, name, fetch):
+    # Rows are counted as they are fetched, which also covers server-side
+    # cursors (exports) read in chunks after execute() has returned
+    def counted(*args):
+        result = fetch(*args)
+        if name == 'fetchone':
+            cursor._recorded_query.rows += result is not None
+        else:
+            cursor._recorded_query.rows += len(result)
+        return result
+    return counted
+
+
+class QueryRecorder:
+    """execute_wrapper recording every query run on a connection, with the rows fetched from it"""
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        query = RecordedQuery(context['connection'].alias, sql)
+        self.queries.append(query)
+        cursor = context['cursor']
+        if '_recorded_query' not in vars(cursor):
+            for name in ('fetchone', 'fetchmany', 'fetchall'):
+                setattr(cursor, name, _counting(cursor, name, getattr(cursor, name)))
+        cursor._recorded_query = query
+        return execute(sql, params, many, context)
+
+    @property
+    def rows(self) -> int:
+        return sum(query.rows for query in self.queries)
+
+
+@contextmanager
+def record_queries():
+    """Record queries on every database alias inside the block"""
+    recorder = QueryRecorder()
+    with ExitStack() as stack:
+        for alias in connections:
+            stack.enter_context(connections[alias].execute_wrapper(recorder))
+        yield recorder
+
+
+def readable_sql(sql: str) -> str:
+    """One-line SQL with the select list elided and literals kept short"""
+    sql = re.sub(r'\s+', ' ', sql).strip()
+    sql = re.sub(r'^SELECT (?:DISTINCT )?.+? FROM ', 'SELECT ... FROM ', sql)
+    return sql if len(sql) <= 160 else sql[:157] + '...'
+
+
+def budget_report(endpoint: str, recorder: QueryRecorder, budget: dict) -> str:
+    """
+    The queries an endpoint ran, diff-style: queries past the budget are
+    marked '+', and repeated statements are listed at the end
+    """
+    lines = [
+        f"{endpoint}: {len(recorder.queries)} queries (budget {budget['queries']}), "
+        f"{recorder.rows} rows fetched (budget {budget['rows']})",
+    ]
+    for number, query in enumerate(recorder.queries, start=1):
+        marker = '+' if number > budget['queries'] else ' '
+        lines.append(f"{marker} {number:>3}. [{query.alias}] {readable_sql(query.sql)}  ({query.rows} rows)")
+    repeated = Counter(readable_sql(query.sql) for query in recorder.queries)
+    for sql, count in repeated.most_common():
+        if count > 1:
+            lines.append(f"  repeated {count}x: {sql}")
+    return '\n'.join(lines)
+
+
+def api_endpoints() -> set:
+    """Names of the view functions behind every route of the API"""
+    return {
+        operation.view_func.__name__
+        for _, router in api._routers
+        for path_view in router.path_operations.values()
+        for operation in path_view.operations
+    }
+
+
+# Budgets are for a single database: with shards, reports fan out to
+# worker threads whose queries the recorder does not see
+@override_settings(ANALYTICS_SHARDS=[], ANALYTICS_LIVE_PATH=LIVE_PATH)
+class EndpointQueryBudgetTests(TestCase):
+    """
+    Query count and rows-fetched budgets for every endpoint in analytics/api,
+    against the test database with SESSIONS sessions of tracking data
+    """
+    databases = '__all__'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.api_key = APIKey.objects.create(key='budget-key', name='Budget', domain='example.com')
+        cls.user = CustomUser.objects.create_user(
+            username='budget', email='budget@example.com', password='budget-password', is_staff=True,
+        )
+        refresh = RefreshToken.for_user(cls.user)
+        cls.refresh_token = str(refresh)
+        cls.access_token = str(refresh.access_token)
+
+        sessions = Session.objects.bulk_create([
+            Session(api_key=cls.api_key, landing_page_url='https://example.com/', ip_address='203.0.113.7',
+                    user_agent=USER_AGENT, page_views_count=1, events_count=1)
+            for _ in range(SESSIONS)
+        ])
+        PageView.objects.bulk_create([
+            PageView(session=session, page_url='https://example.com/', page_path='/', sequence_number=1)
+            for session in sessions
+        ])
+        Event.objects.bulk_create([
+            Event(session=session, event_type=event_type, event_category='Diagnostic',
+                  page_url='https://example.com/diagnostic', page_path='/diagnostic',
+                  time_since_page_load_ms=1500, time_since_session_start_seconds=3)
+            for session, event_type in zip(sessions, cycle(EVENT_TYPES))
+        ])
+        DiagnosticResponse.objects.bulk_create([
+            DiagnosticResponse(session=session, diagnostic_name='budget', answers={'q1': 'a'}, score='50')
+            for session in sessions[:10]
+        ])
+        cls.session = sessions[0]
+
+    def setUp(self):
+        # Dictionary caches are process-wide, and entries created inside a
+        # test transaction are never cached: start every test with all
+        # entries cached, as in a worker that has been up for a while
+        for model in (EventType, EventCategory, PagePath):
+            cache = dictionary_cache(model._meta.label)
+            self.addCleanup(cache.restore, cache.snapshot())
+            cache.reset(model.objects.values_list('pk', 'name'))
+
+    def assertWithinBudget(self, endpoint, request):
+        """Run ``request()`` (which returns a response) and check it against QUERY_BUDGETS[endpoint]"""
+        budget = QUERY_BUDGETS[endpoint]
+        with record_queries() as recorder:
+            response = request()
+            if response.streaming:
+                b''.join(response.streaming_content)
+        self.assertLess(response.status_code, 300, response.content if not response.streaming else '')
+        if len(recorder.queries) > budget['queries'] or recorder.rows > budget['rows']:
+            self.fail('\n' + budget_report(endpoint, recorder, budget))
+        return response
+
+    def track(self, endpoint, payload):
+        payload = {'api_key': self.api_key.key, **payload}
+        return self.client.post(f'/api/track/{endpoint}', data=json.dumps(payload),
+                                content_type='application/json', HTTP_X_ANALYTICS_KEY=self.api_key.key)
+
+    def track_batch(self, batch):
+        return self.client.post('/api/track/batch', data=json.dumps(batch), content_type='application/json',
+                                HTTP_X_ANALYTICS_KEY=self.api_key.key)
+
+    def get(self, path):
+        # Read from the primary: a replica cannot see rows written inside
+        # the test transaction, and its lag check (cached per process) would
+        # make the counts depend on test order
+        return self.client.get(path, HTTP_AUTHORIZATION=f'Bearer {self.access_token}',
+                               HTTP_X_ANALYTICS_READ_FROM='primary')
+
+    def pageview(self, session_id):
+        return self.track('pageview', {
+            'session_id': session_id, 'page_url': 'https://example.com/pricing', 'page_path': '/pricing',
+            'referrer_url': 'https://www.google.com/', 'user_agent': USER_AGENT,
+        })
+
+    def test_every_endpoint_has_a_budget(self):
+        self.assertEqual(api_endpoints(), set(QUERY_BUDGETS))
+
+    def test_login(self):
+        self.assertWithinBudget('login', lambda: self.client.post(
+            '/api/auth/login', data=json.dumps({'username': 'budget', 'password': 'budget-password'}),
+            content_type='application/json',
+        ))
+
+    def test_refresh_token(self):
+        self.assertWithinBudget('refresh_token', lambda: self.client.post(
+            '/api/auth/refresh', data=json.dumps({'refresh_token': self.refresh_token}),
+            content_type='application/json',
+        ))
+
+    def test_track_pageview_new_session(self):
+        self.assertWithinBudget('track_pageview', lambda: self.pageview('6f1c8a54-4c3e-4d5e-9a43-1b2c3d4e5f60'))
+
+    def test_track_pageview_existing_session(self):
+        self.assertWithinBudget('track_pageview', lambda: self.pageview(str(self.session.session_id)))
+
+    def test_capture_email(self):
+        self.assertWithinBudget('capture_email', lambda: self.track('email', {
+            'session_id': str(self.session.session_id), 'email': 'budget@example.com', 'name': 'Budget',
+            'time_spent_seconds': 40,
+        }))
+
+    def test_track_event(self):
+        self.assertWithinBudget('track_event', lambda: self.track('event', {
+            'session_id': str(self.session.session_id), 'event_type': 'diagnostic_step_completed',
+            'event_category': 'Diagnostic', 'page_url': 'https://example.com/diagnostic',
+            'time_since_page_load_ms': 5300, 'time_since_session_start_seconds': 94,
+            'metadata': {'step_number': 1}, 'time_spent_seconds': 12,
+        }))
+
+    def test_track_batch(self):
+        rows = [['diagnostic_step_completed', 5300 + step, 94 + step, 'Diagnostic', None, None, None, None, None,
+                 None, None, None, {'step_number': step}, 12] for step in range(20)]
+        rows[-1][10] = 'https://example.com/diagnostic?step=results'
+        self.assertWithinBudget('track_batch', lambda: self.track_batch(
+            [1, self.api_key.key, str(self.session.session_id), 'https://example.com/diagnostic', rows],
+        ))
+
+    def post_batch(self, body, content_type='application/json', **headers):
+        return self.client.post('/api/track/batch', data=body, content_type=content_type,
+                                HTTP_X_ANALYTICS_KEY=self.api_key.key, **headers)
+
+    def batch(self, events=1):
+        return [1, self.api_key.key, str(self.session.session_id), 'https://example.com/diagnostic',
+                [['diagnostic_step_completed', 5300, 94]] * events]
+
+    def test_track_batch_compressed(self):
+        body = json.dumps(self.batch()).encode()
+        raw_deflate = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+        for encoding, compressed in [
+            ('gzip', gzip.compress(body)),
+            ('deflate', zlib.compress(body)),
+            ('deflate', raw_deflate.compress(body) + raw_deflate.flush()),
+        ]:
+            with self.subTest(encoding=encoding, header=compressed[:2]):
+                response = self.post_batch(compressed, HTTP_CONTENT_ENCODING=encoding)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(response.json()['event_ids']), 1)
+
+    def test_track_batch_msgpack(self):
+        response = self.post_batch(msgpack.packb(self.batch(events=2)), content_type='application/msgpack')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['event_ids']), 2)
+
+    def test_track_batch_undecodable(self):
+        body = json.dumps(self.batch(events=100)).encode()
+        cases = {
+            'too large once decompressed': (gzip.compress(body), 'gzip', len(body) - 1),
+            'truncated': (gzip.compress(body)[:-8], 'gzip', None),
+            'not compressed': (body, 'deflate', None),
+            'unsupported encoding': (body, 'br', None),
+        }
+        events = self.session.events.count()
+        for case, (data, encoding, limit) in cases.items():
+            with self.subTest(case), self.settings(DATA_UPLOAD_MAX_MEMORY_SIZE=limit):
+                response = self.post_batch(data, HTTP_CONTENT_ENCODING=encoding)
+                self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.session.events.count(), events)
+
+    def test_track_batch_return_minimal(self):
+        events = self.session.events.count()
+        response = self.post_batch(json.dumps(self.batch()), HTTP_PREFER='return=minimal')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['Preference-Applied'], 'return=minimal')
+        self.assertEqual(self.session.events.count(), events + 1)
+
+    def test_submit_diagnostic(self):
+        self.assertWithinBudget('submit_diagnostic', lambda: self.track('diagnostic', {
+            'session_id': str(self.session.session_id), 'diagnostic_name': 'budget',
+            'answers': {'q1': 'b'}, 'score': '75',
+        }))
+
+    def test_get_dashboard_stats(self):
+        self.assertWithinBudget('get_dashboard_stats', lambda: self.get('/api/analytics/dashboard'))
+
+    def test_get_sessions(self):
+        self.assertWithinBudget('get_sessions', lambda: self.get('/api/analytics/sessions?limit=50'))
+
+    def test_get_diagnostic_analytics(self):
+        self.assertWithinBudget('get_diagnostic_analytics', lambda: self.get('/api/analytics/diagnostics'))
+
+    def test_get_live_visitors(self):
+        # An empty window, whatever the other tests tracked
+        with tempfile.TemporaryDirectory() as directory, self.settings(ANALYTICS_LIVE_PATH=Path(directory) / 'live'):
+            self.pageview(str(self.session.session_id))
+            response = self.assertWithinBudget('get_live_visitors', lambda: self.get(
+                f'/api/analytics/live?api_key={self.api_key.key}',
+            ))
+        self.assertEqual(response.json(), {
+            'minutes': 5, 'active_sessions': 1, 'pages': [{'page_path': '/pricing', 'active_sessions': 1}],
+        })
+
+    def test_get_stream_token(self):
+        response = self.assertWithinBudget('get_stream_token', lambda: self.client.post(
+            '/api/analytics/stream/token', HTTP_AUTHORIZATION=f'Bearer {self.access_token}',
+        ))
+        self.assertEqual(stream_token_user_id(response.json()['token']), self.user.pk)
+
+    async def read_stream(self, path, until: bytes, frames: int = 10, headers=None):
+        # The stream never ends: read up to `frames` ticks, or the one containing `until`
+        response = await self.async_client.get(path, headers={'X-Analytics-Read-From': 'primary', **(headers or {})})
+        if not response.streaming:
+            return response
+        content = b''
+        async for chunk in response.streaming_content:
+            content += chunk
+            if until in chunk or content.count(b'event: tick') >= frames:
+                break
+        await response.streaming_content.aclose()
+        return HttpResponse(content, status=response.status_code, content_type=response['Content-Type'])
+
+    def test_stream_live(self):
+        with tempfile.TemporaryDirectory() as directory, self.settings(ANALYTICS_LIVE_PATH=Path(directory) / 'live'):
+            self.pageview(str(self.session.session_id))
+            response = self.assertWithinBudget('stream_live', lambda: async_to_sync(self.read_stream)(
+                f'/api/analytics/stream?api_key={self.api_key.key}&backfill=5&token={stream_token(self.user.pk)}',
+                until=b'"page_views":1', headers={'Last-Event-ID': '\u00b2'},
+            ))
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertIn(b'"page_views":1,"events":0,"conversions":0,"bot_flags":0', response.content)
+
+    def test_stream_live_rejects_access_tokens_in_the_url(self):
+        response = async_to_sync(self.read_stream)(f'/api/analytics/stream?token={self.access_token}', until=b'')
+        self.assertEqual(response.status_code, 401)
+
+    def test_export_dataset(self):
+        self.assertWithinBudget('export_dataset', lambda: self.get('/api/analytics/export/events'))
+
+
+@mock.patch('analytics.middleware.replica_alias', return_value='replica')
+class ReplicaRoutingTests(SimpleTestCase):
+    """Which requests ReplicaRoutingMiddleware sends to a (healthy) replica"""
+
+    def read_alias_of(self, method, path, read_from=None):
+        headers = {'HTTP_X_ANALYTICS_READ_FROM': read_from} if read_from else {}
+        request = RequestFactory().generic(method, path, **headers)
+        request.resolver_match = resolve(path)
+
+        def view(request):
+            middleware.process_view(request, request.resolver_match.func, (), {})
+            return read_alias()
+        middleware = ReplicaRoutingMiddleware(view)
+        return middleware(request)
+
+    def test_analytics_reads_use_the_replica(self, replica_alias):
+        self.assertEqual(self.read_alias_of('GET', '/api/analytics/dashboard'), 'replica')
+
+    def test_header_sends_reads_to_the_primary(self, replica_alias):
+        self.assertEqual(self.read_alias_of('GET', '/api/analytics/dashboard', 'primary'), 'default')
+
+    def test_header_cannot_send_tracking_to_the_replica(self, replica_alias):
+        self.assertEqual(self.read_alias_of('POST', '/api/track/pageview', 'replica'), 'default')
+        self.assertEqual(self.read_alias_of('POST', '/api/auth/login', 'replica'), 'default')
+
+
+class ProfileStorageTests(SimpleTestCase):
+    """Sampled profiles do not pile up without bound"""
+
+    def test_only_the_newest_profiles_of_a_route_are_kept(self):
+        root = self.enterContext(tempfile.TemporaryDirectory())
+        profiler = mock.Mock(seconds=0.01, collapsed=lambda: 'view;query 3\n')
+        with self.settings(ANALYTICS_PROFILE_ROOT=Path(root), ANALYTICS_PROFILE_MAX_FILES=2):
+            paths = [save_profile('api/track/pageview', profiler, 'POST', 200) for _ in range(3)]
+            self.assertEqual(sorted(route_directory('api/track/pageview').glob('*.collapsed')), paths[1:])
+
+
+class LiveWindowTests(SimpleTestCase):
+    """Processes started with other live window settings do not share its file"""
+
+    def test_each_layout_has_its_own_file(self):
+        path = Path(self.enterContext(tempfile.TemporaryDirectory())) / 'live'
+        small, large = LiveWindow(path, 5, 16, 4, 4, 10), LiveWindow(path, 5, 32, 4, 4, 10)
+        small.touch(1, uuid.uuid4().bytes, '/pricing')
+        large.touch(1, uuid.uuid4().bytes, '/docs')
+        self.assertNotEqual(small.file, large.file)
+        self.assertEqual(small.active(1, 5)['pages'], [('/pricing', 1)])
+
+    def test_a_file_of_another_layout_is_left_alone(self):
+        path = Path(self.enterContext(tempfile.TemporaryDirectory())) / 'live'
+        window = LiveWindow(path, 5, 16, 4, 4, 10)
+        window.file.write_bytes(b'other')
+        with self.assertRaises(ValueError):
+            window._open()
+        self.assertEqual(window.file.read_bytes(), b'other')
+
+
+class EventDictionaryTests(TestCase):
+    """Tracking clients cannot grow the event type and category dictionaries without bound"""
+    databases = '__all__'
+
+    def setUp(self):
+        self.api_key = APIKey.objects.create(key='dictionary-key', name='Dictionary', domain='example.com')
+        self.session = Session.objects.create(api_key=self.api_key, landing_page_url='https://example.com/',
+                                              ip_address='203.0.113.7', user_agent=USER_AGENT)
+
+    def track_event(self, **fields):
+        payload = {
+            'api_key': self.api_key.key, 'session_id': str(self.session.session_id), 'event_type': 'cta_click',
+            'page_url': 'https://example.com/', 'time_since_page_load_ms': 10,
+            'time_since_session_start_seconds': 1, **fields,
+        }
+        return self.client.post('/api/track/event', data=json.dumps(payload), content_type='application/json',
+                                HTTP_X_ANALYTICS_KEY=self.api_key.key)
+
+    def test_unknown_event_types_are_stored(self):
+        response = self.track_event(event_type='made_up_type')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Event.objects.get(session=self.session).event_type, 'made_up_type')
+
+    def test_event_types_past_the_limit_are_stored_as_custom(self):
+        # The process-wide cache remembers the table is full
+        cache = dictionary_cache('analytics.EventType')
+        self.addCleanup(cache.restore, cache.snapshot())
+        with mock.patch.object(EventType, 'MAX_ENTRIES', EventType.objects.count() + 1):
+            response = self.client.post(
+                '/api/track/batch', content_type='application/json', HTTP_X_ANALYTICS_KEY=self.api_key.key,
+                data=json.dumps([1, self.api_key.key, str(self.session.session_id), 'https://example.com/',
+                                 [['made_up_type', 10, 1]]]),
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Event.objects.get(session=self.session).event_type, 'custom')
+        self.assertFalse(EventType.objects.filter(name='made_up_type').exists())
+
+    def test_categories_past_the_limit_are_stored_as_overflow(self):
+        cache = DictionaryCache('analytics.EventCategory')
+        limit = EventCategory.objects.count() + 2
+        with mock.patch.object(EventCategory, 'MAX_ENTRIES', limit):
+            first = cache.id_for('first new category', create=True)
+            overflow = cache.id_for('second new category', create=True)
+            self.assertEqual(cache.id_for('third new category', create=True), overflow)
+        self.assertEqual(EventCategory.objects.get(pk=overflow).name, EventCategory.OVERFLOW_NAME)
+        self.assertNotEqual(first, overflow)
+        self.assertEqual(EventCategory.objects.count(), limit)
+
+
+class MetadataTests(TestCase):
+    """Promoted metadata keys are compared on their generated column, the others by containment"""
+    databases = '__all__'
+
+    def setUp(self):
+        api_key = APIKey.objects.create(key='metadata-key', name='Metadata', domain='example.com')
+        self.session = create_session(api_key)
+
+    def event(self, **metadata):
+        return Event.objects.create(session=self.session, event_type='custom', page_url='https://example.com/',
+                                    time_since_page_load_ms=10, time_since_session_start_seconds=1,
+                                    metadata=metadata)
+
+    def test_step_number_holds_integers_only(self):
+        values = [3, -7, '3', 3.5, 10 ** 12, True, None]
+        events = [self.event(step_number=value) for value in values] + [self.event()]
+        step_numbers = dict(Event.objects.filter(session=self.session).values_list('pk', 'step_number'))
+        self.assertEqual([step_numbers[event.pk] for event in events], [3, -7] + [None] * 6)
+
+    def test_promoted_keys_use_their_column(self):
+        match = self.event(step_number=2, variant='b')
+        self.event(step_number=2, variant='a')
+        self.event(step_number='2', variant='b')
+        queryset = filter_metadata(Event.objects.filter(session=self.session), step_number=2, variant='b')
+        self.assertEqual(list(queryset.values_list('pk', flat=True)), [match.pk])
+        sql = str(queryset.query)
+        self.assertIn('"step_number" = 2', sql)
+        self.assertIn('"metadata" @> \'{"variant": "b"}\'', sql)
+        self.assertNotIn('step_number":', sql)
+
+    def test_keys_must_be_safe_in_ddl(self):
+        self.assertEqual(validate_key('plan_tier2'), 'plan_tier2')
+        for key in ['Plan', '2fa', "x') ; DROP TABLE analytics_events; --", 'a-b', 'k' * 39, '']:
+            with self.subTest(key=key), self.assertRaises(ValueError):
+                validate_key(key)
+
+
+class MetadataIndexTests(TransactionTestCase):
+    """Metadata key indexes cover every partition (CREATE INDEX CONCURRENTLY: outside a transaction)"""
+
+    def test_parent_monthly_and_default_partitions_are_indexed(self):
+        name = metadata_index_name('variant')
+        self.addCleanup(sync_metadata_indexes, [], drop_unlisted=True)
+        self.assertEqual(sync_metadata_indexes(['variant']), ([name], []))
+
+        with connections['default'].cursor() as cursor:
+            cursor.execute(
+                "SELECT x.indrelid::regclass::text FROM pg_inherits i "
+                "JOIN pg_index x ON x.indexrelid = i.inhrelid WHERE i.inhparent = to_regclass(%s)",
+                [name],
+            )
+            indexed = {row[0] for row in cursor.fetchall()}
+            cursor.execute("SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(%s)", [name])
+            self.assertEqual(cursor.fetchone(), (True,))
+        partitions = {p['name'] for p in list_partitions('analytics_events')}
+        self.assertTrue(partitions)
+        self.assertEqual(indexed, partitions | {default_partition('analytics_events')})
+        self.assertEqual(existing_index_keys(), ['variant'])
+
+
+class DefaultPartitionTests(TestCase):
+    """Rows no monthly partition covers are kept, and moved once their partition is created"""
+    databases = '__all__'
+
+    def test_rows_past_the_last_partition_move_to_their_month(self):
+        api_key = APIKey.objects.create(key='partition-key', name='Partition', domain='example.com')
+        session = Session.objects.create(api_key=api_key, landing_page_url='https://example.com/',
+                                         ip_address='203.0.113.7', user_agent=USER_AGENT)
+        view = PageView.objects.create(session=session, page_url='https://example.com/', page_path='/',
+                                       sequence_number=1)
+        month = datetime(2099, 5, 1, tzinfo=dt_timezone.utc)
+        PageView.objects.filter(pk=view.pk).update(viewed_at=month.replace(day=17))
+
+        default = default_partition('analytics_page_views')
+        name = partition_name('analytics_page_views', month)
+        self.assertEqual(ensure_partitions('analytics_page_views', month, month), [name])
+        with connections['default'].cursor() as cursor:
+            cursor.execute(f"SELECT id FROM {name}")
+            self.assertEqual(cursor.fetchall(), [(view.pk,)])
+            cursor.execute(f"SELECT count(*) FROM {default}")
+            self.assertEqual(cursor.fetchone()[0], 0)
+        self.assertTrue(PageView.objects.filter(pk=view.pk, viewed_at__gte=month).exists())
+
+    def test_partitions_can_be_dropped_next_to_the_default_one(self):
+        first = datetime(2001, 1, 1, tzinfo=dt_timezone.utc)
+        names = ensure_partitions('analytics_events', first, first.replace(month=2))
+        self.assertEqual(len(names), 2)
+        drop_partition('analytics_events', names[0])
+        remaining = {p['name'] for p in list_partitions('analytics_events')}
+        self.assertNotIn(names[0], remaining)
+        self.assertIn(names[1], remaining)
+        self.assertTrue(default_partition('analytics_events'))
+
+
+class SessionChangeTests(TestCase):
+    """Every tracking update of a session bumps last_activity_at, which exports use to find changes"""
+    databases = '__all__'
+
+    def setUp(self):
+        self.api_key = APIKey.objects.create(key='change-key', name='Change', domain='example.com')
+        self.session = Session.objects.create(api_key=self.api_key, landing_page_url='https://example.com/',
+                                              ip_address='203.0.113.7', user_agent=USER_AGENT)
+
+    def test_capturing_an_email_marks_the_session_changed(self):
+        Session.objects.filter(pk=self.session.pk).update(last_activity_at=timezone.now() - timedelta(days=1))
+        response = self.client.post(
+            '/api/track/email', content_type='application/json', HTTP_X_ANALYTICS_KEY=self.api_key.key,
+            data=json.dumps({'api_key': self.api_key.key, 'session_id': str(self.session.session_id),
+                             'email': 'visitor@example.com'}),
+        )
+        self.assertEqual(response.status_code, 200)
+        self.session.refresh_from_db()
+        self.assertGreater(self.session.last_activity_at, timezone.now() - timedelta(minutes=1))
+
+
+class RetentionTests(TestCase):
+    """Expired days are archived before they are deleted, and archived again when they change"""
+    databases = '__all__'
+
+    def setUp(self):
+        self.root = self.enterContext(tempfile.TemporaryDirectory())
+        self.api_key = APIKey.objects.create(key='retention-key', name='Retention', domain='example.com',
+                                             retention_days=30)
+        self.expired_at = timezone.now() - timedelta(days=40)
+        self.day = self.expired_at.astimezone(dt_timezone.utc).date()
+
+    def session(self, alive=False):
+        """A session and page view from before the retention, kept by a page view of today when ``alive``"""
+        session = Session.objects.create(api_key=self.api_key, landing_page_url='https://example.com/',
+                                         ip_address='203.0.113.7', user_agent=USER_AGENT)
+        view = PageView.objects.create(session=session, page_url='https://example.com/', page_path='/',
+                                       sequence_number=1)
+        PageView.objects.filter(pk=view.pk).update(viewed_at=self.expired_at)
+        Session.objects.filter(pk=session.pk).update(created_at=self.expired_at, last_activity_at=self.expired_at)
+        if alive:
+            PageView.objects.create(session=session, page_url='https://example.com/', page_path='/',
+                                    sequence_number=2)
+        return session
+
+    def prune(self):
+        archive_api_key(self.api_key, self.root)
+        return delete_api_key(self.api_key, self.root, batch_size=100)
+
+    def archived_sessions(self):
+        table = pyarrow.parquet.read_table(partition_path(self.root, 'analytics_sessions', self.day, self.api_key.pk))
+        return dict(zip(table['id'].to_pylist(), table['email'].to_pylist()))
+
+    def test_expired_rows_are_archived_then_deleted(self):
+        expired, alive = self.session(), self.session(alive=True)
+        results = self.prune()
+
+        self.assertEqual(results['analytics_sessions']['deleted'], 1)
+        self.assertEqual(results['analytics_page_views']['deleted'], 2)
+        self.assertEqual(list(Session.objects.values_list('pk', flat=True)), [alive.pk])
+        self.assertEqual(self.archived_sessions(), {expired.pk: None, alive.pk: None})
+        self.assertTrue(partition_path(self.root, 'analytics_page_views', self.day, self.api_key.pk).exists())
+
+    def test_archived_days_are_skipped(self):
+        self.session(alive=True)
+        archive_api_key(self.api_key, self.root)
+        results = archive_api_key(self.api_key, self.root)
+        self.assertEqual(results['analytics_sessions']['files'], 0)
+        self.assertEqual(results['analytics_sessions']['skipped'], 1)
+
+    def test_sessions_updated_after_archiving_are_archived_again(self):
+        expired, alive = self.session(), self.session(alive=True)
+        self.prune()
+
+        # Updated after the day was archived, then expires too
+        PageView.objects.filter(session=alive).delete()
+        Session.objects.filter(pk=alive.pk).update(email='late@example.com',
+                                                   last_activity_at=self.expired_at + timedelta(hours=1))
+        results = self.prune()
+
+        self.assertEqual(results['analytics_sessions']['deleted'], 1)
+        self.assertFalse(Session.objects.exists())
+        self.assertEqual(self.archived_sessions(), {expired.pk: None, alive.pk: 'late@example.com'})
+
+    def test_months_expired_for_every_key_are_dropped(self):
+        month = datetime(2001, 3, 1, tzinfo=dt_timezone.utc)
+        name = partition_name('analytics_page_views', month)
+        ensure_partitions('analytics_page_views', month, month)
+        session = self.session()
+        PageView.objects.filter(session=session).update(viewed_at=month.replace(day=9))
+        archive_api_key(self.api_key, self.root)
+        with connections['default'].cursor() as cursor:
+            # Run the deferred foreign key checks, as committing would: they block DROP TABLE
+            cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+
+        self.assertIn(name, drop_expired_partitions(global_cutoff()))
+        self.assertNotIn(name, {p['name'] for p in list_partitions('analytics_page_views')})
+        self.assertTrue(partition_path(self.root, 'analytics_page_views', date(2001, 3, 9), self.api_key.pk).exists())
+
+
+class ExportJobTests(TestCase):
+    """Jobs left running by a worker that died are failed instead of showing as running forever"""
+
+    @override_settings(ANALYTICS_EXPORT_JOB_TIMEOUT=600)
+    def test_stale_running_jobs_are_failed(self):
+        now = timezone.now()
+        stale = ExportJob.objects.create(dataset='sessions', status='running', started_at=now - timedelta(hours=2),
+                                         heartbeat_at=now - timedelta(minutes=11))
+        busy = ExportJob.objects.create(dataset='sessions', status='running', started_at=now - timedelta(hours=2),
+                                        heartbeat_at=now - timedelta(minutes=1))
+        pending = ExportJob.objects.create(dataset='sessions')
+
+        self.assertEqual(claim_next_job(), pending)
+        stale.refresh_from_db()
+        busy.refresh_from_db()
+        self.assertEqual((stale.status, busy.status), ('failed', 'running'))
+        self.assertIsNotNone(stale.finished_at)
+
+
+class SlowQueryTests(TestCase):
+    """Slow queries are grouped by statement shape and call site, with a plan that never re-runs a write"""
+
+    def test_reads_are_analyzed(self):
+        plan = explain('default', "SELECT count(*) FROM analytics_api_keys WHERE id > %s", [0])
+        self.assertIn('actual time', plan)
+
+    def test_writes_are_only_explained(self):
+        plan = explain('default', "INSERT INTO analytics_api_keys (key, name, domain, is_active, created_at, shard) "
+                                  "VALUES (%s, 'x', 'x', true, now(), '')", ['explained'])
+        self.assertIn('Insert on analytics_api_keys', plan)
+        self.assertNotIn('actual time', plan)
+
+    def test_selects_that_write_are_only_explained(self):
+        def sequence():
+            with connections['default'].cursor() as cursor:
+                cursor.execute("SELECT last_value, is_called FROM analytics_events_id_seq")
+                return cursor.fetchone()
+
+        before = sequence()
+        plan = explain('default', "SELECT nextval('analytics_events_id_seq')", None)
+        self.assertNotIn('actual time', plan)
+        self.assertNotIn('EXPLAIN failed', plan)
+        self.assertEqual(sequence(), before)
+
+    def test_calls_are_counted_per_statement_shape_and_call_site(self):
+        def entry(session_id, ms, route='api/track/event'):
+            return {'database': 'default', 'sql': f"SELECT * FROM analytics_sessions WHERE id = {session_id}",
+                    'params': None, 'many': False, 'ms': ms, 'route': route,
+                    'function': 'analytics/api/tracking.py:290 track_event'}
+
+        with mock.patch('analytics.services.slow_queries.explain', return_value='Seq Scan') as explained:
+            _store(entry(1, 600))
+            _store(entry(2, 900))
+            _store(entry(3, 700, route='api/track/pageview'))
+        explained.assert_called_once()
+
+        event, pageview = SlowQuery.objects.order_by('route')
+        self.assertEqual((event.calls, event.total_ms, event.max_ms, event.last_ms), (2, 1500, 900, 900))
+        self.assertEqual((pageview.calls, pageview.plan), (1, 'Seq Scan'))
+        self.assertEqual(event.fingerprint, pageview.fingerprint)
+        self.assertEqual(event.normalized_sql, 'SELECT * FROM analytics_sessions WHERE id = ?')
+
+
+def create_session(api_key, **fields):
+    return Session.objects.create(api_key=api_key, landing_page_url='https://example.com/',
+                                  ip_address='203.0.113.7', user_agent=USER_AGENT, **fields)
+
+
+def create_page_view(session, sequence_number=1):
+    return PageView.objects.create(session=session, page_url='https://example.com/', page_path='/',
+                                   sequence_number=sequence_number)
+
+
+@skipUnless(SHARD, "no shard configured (ANALYTICS_SHARD_DATABASES)")
+class ShardTests(TestCase):
+    """Tracking data goes to its API key's shard, and moves between shards without losing writes"""
+    databases = {'default', SHARD or 'default'}
+
+    def test_tracking_is_written_to_the_key_shard(self):
+        api_key = APIKey.objects.create(key='shard-key', name='Shard', domain='example.com', shard=SHARD)
+        response = self.client.post(
+            '/api/track/pageview', content_type='application/json', HTTP_X_ANALYTICS_KEY=api_key.key,
+            data=json.dumps({'api_key': api_key.key, 'session_id': str(uuid.uuid4()), 'page_url': 'https://example.com/',
+                             'user_agent': USER_AGENT}),
+        )
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(Session.objects.using(SHARD).filter(api_key=api_key).count(), 1)
+        self.assertEqual(PageView.objects.using(SHARD).count(), 1)
+        self.assertFalse(Session.objects.using('default').exists())
+
+    def test_related_rows_follow_their_session(self):
+        api_key = APIKey.objects.create(key='shard-key', name='Shard', domain='example.com', shard=SHARD)
+        with use_shard(SHARD):
+            session = create_session(api_key)
+        view = session.page_views.create(page_url='https://example.com/', page_path='/', sequence_number=1)
+        self.assertEqual(view._state.db, SHARD)
+        self.assertEqual(list(session.page_views.values_list('pk', flat=True)), [view.pk])
+
+    def test_move_keeps_writes_made_during_the_move(self):
+        api_key = APIKey.objects.create(key='move-key', name='Move', domain='example.com')
+        sessions = [create_session(api_key) for _ in range(3)]
+        for session in sessions:
+            create_page_view(session)
+
+        def requests_still_on_the_old_shard(seconds):
+            # Requests that looked the key up before the switch keep writing to the source
+            with use_shard('default'):
+                late = create_session(api_key)
+                create_page_view(late)
+                create_page_view(sessions[0], sequence_number=2)
+                Session.objects.filter(pk=sessions[0].pk).update(email='late@example.com', page_views_count=2,
+                                                                 last_activity_at=timezone.now())
+
+        with mock.patch('analytics.services.sharding.time.sleep', requests_still_on_the_old_shard):
+            counts = move_api_key(api_key, SHARD, batch_size=2, grace=0)
+
+        self.assertEqual(counts['analytics_sessions'], 4)
+        self.assertFalse(Session.objects.using('default').filter(api_key=api_key).exists())
+        self.assertFalse(PageView.objects.using('default').exists())
+        self.assertEqual(Session.objects.using(SHARD).filter(api_key=api_key).count(), 4)
+        self.assertEqual(PageView.objects.using(SHARD).count(), 5)
+        moved = Session.objects.using(SHARD).get(pk=sessions[0].pk)
+        self.assertEqual((moved.email, moved.page_views_count), ('late@example.com', 2))
+        self.assertEqual(moved.created_at, sessions[0].created_at)
+        api_key.refresh_from_db()
+        self.assertEqual(api_key.shard, SHARD)
+
+
+@skipUnless(SHARD, "no shard configured (ANALYTICS_SHARD_DATABASES)")
+class ShardFanOutTests(TransactionTestCase):
+    """Reports read every shard in parallel and merge what they return (committed data: other connections)"""
+    databases = {'default', SHARD or 'default'}
+
+    def test_sessions_of_every_shard_are_merged_newest_first(self):
+        user = CustomUser.objects.create_user(username='fan-out', email='fan-out@example.com', password='x',
+                                              is_staff=True)
+        now = timezone.now()
+        created = []
+        for index, shard in enumerate(['', SHARD, '', SHARD]):
+            api_key = APIKey.objects.create(key=f'fan-out-{index}', name='Fan out', domain='example.com',
+                                            shard=shard)
+            with use_shard(shard):
+                session = create_session(api_key)
+                Session.objects.filter(pk=session.pk).update(created_at=now - timedelta(minutes=index))
+            created.append(session.pk)
+
+        self.assertEqual(fan_out(Session.objects.count), [2, 2])
+        response = self.client.get('/api/analytics/sessions?limit=3',
+                                   HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(user).access_token}',
+                                   HTTP_X_ANALYTICS_READ_FROM='primary')
+        self.assertEqual([session['id'] for session in response.json()], created[:3])
@@ -1,3 +1,29 @@
-from django.shortcuts import render
+import ipaddress
 
-# Create your views here.
+from django.conf import settings
+from django.http import Http404, HttpResponse
+from django.utils.crypto import constant_time_compare
+from django.views.decorators.http import require_GET
+
+from analytics.services.metrics import render_metrics
+
+
+def metrics_allowed(request) -> bool:
+    """Scrapes come from ANALYTICS_METRICS_ALLOWED_NETWORKS or carry ANALYTICS_METRICS_TOKEN"""
+    token = settings.ANALYTICS_METRICS_TOKEN
+    if token and constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return True
+    try:
+        address = ipaddress.ip_address(request.META.get('REMOTE_ADDR', ''))
+    except ValueError:
+        return False
+    return any(address in ipaddress.ip_network(network) for network in settings.ANALYTICS_METRICS_ALLOWED_NETWORKS)
+
+
+@require_GET
+def metrics(request):
+    """Prometheus scrape endpoint (internal: a 404 for everyone else)"""
+    if not settings.ANALYTICS_METRICS_ENABLED or not metrics_allowed(request):
+        raise Http404
+    body, content_type = render_metrics()
+    return HttpResponse(body, content_type=content_type)
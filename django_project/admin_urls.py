@@ -0,0 +1,12 @@
+"""
+Admin URLs, imported when the first /admin/ URL is resolved or reversed
+
+Registering the ModelAdmins happens here instead of at startup, see
+django_project.apps.LazyAdminConfig.
+"""
+from django.contrib import admin
+
+admin.autodiscover()
+
+app_name = 'admin'
+urlpatterns = admin.site.get_urls()
@@ -1,15 +1,23 @@
+from django.conf import settings
 from ninja import NinjaAPI
 from analytics.api.auth import router as auth_router
 from analytics.api.tracking import router as tracking_router
 from analytics.api.analytics import router as analytics_router
+from analytics.api.export import router as export_router
+from analytics.renderers import api_parser_and_renderer
+
+parser, renderer = api_parser_and_renderer(settings.ANALYTICS_API_JSON)
 
 api = NinjaAPI(
     title="Analytics API",
     version="1.0.0",
-    description="Analytics tracking and reporting API"
+    description="Analytics tracking and reporting API",
+    parser=parser,
+    renderer=renderer,
 )
 
 # Add routers
 api.add_router('/auth', auth_router)
 api.add_router('/track', tracking_router)
-api.add_router('/analytics', analytics_router)
\ No newline at end of file
+api.add_router('/analytics', analytics_router)
+api.add_router('/analytics/export', export_router)
\ No newline at end of file
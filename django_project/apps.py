@@ -0,0 +1,23 @@
+from django.contrib.admin.apps import SimpleAdminConfig
+from django.contrib.admin.checks import check_admin_app, check_dependencies
+from django.core import checks
+
+
+def check_admin_app_autodiscovered(app_configs, **kwargs):
+    from django.contrib import admin
+    admin.autodiscover()
+    return check_admin_app(app_configs, **kwargs)
+
+
+class LazyAdminConfig(SimpleAdminConfig):
+    """
+    Admin that imports the apps' admin modules on first use (see
+    django_project/admin_urls.py) rather than when Django starts
+
+    They pull in import_export, tablib and DRF, which API workers never need.
+    System checks still discover them, so `manage.py check` covers them.
+    """
+
+    def ready(self):
+        checks.register(check_dependencies, checks.Tags.admin)
+        checks.register(check_admin_app_autodiscovered, checks.Tags.admin)
@@ -30,12 +30,13 @@ ALLOWED_HOSTS = os.environ.get('DJANGO_ALLOWED_HOSTS', '').split(',')
 # ═══════════════════════════════════════════════════════════
 
 INSTALLED_APPS = [
-    "django.contrib.admin",
+    "django_project.apps.LazyAdminConfig",  # django.contrib.admin, autodiscovered on first use
     "django.contrib.auth",
     "django.contrib.contenttypes",
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "django.contrib.postgres",
     
     # Third party apps
     "import_export",
@@ -51,15 +52,20 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'analytics.middleware.MetricsMiddleware',  # First, so it times everything below
+    'analytics.middleware.TrackingFastLaneMiddleware',  # /api/track/* skips the rest, see below
+    'analytics.middleware.SlowQueryMiddleware',
     "django.middleware.security.SecurityMiddleware",
     "whitenoise.middleware.WhiteNoiseMiddleware",  # ADD THIS LINE (right after SecurityMiddleware)
     "django.contrib.sessions.middleware.SessionMiddleware",
     'corsheaders.middleware.CorsMiddleware',
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
+    'analytics.middleware.ReplicaRoutingMiddleware',
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    'analytics.middleware.ProfilingMiddleware',  # Last, it calls the view itself
 ]
 
 ROOT_URLCONF = "django_project.urls"
@@ -96,6 +102,38 @@ DATABASES = {
     }
 }
 
+# Optional read replica for analytics reads (see analytics.routers). Locally a
+# second database on the same server can stand in: set only POSTGRES_REPLICA_DB.
+if os.environ.get('POSTGRES_REPLICA_HOST') or os.environ.get('POSTGRES_REPLICA_DB'):
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        "NAME": os.environ.get('POSTGRES_REPLICA_DB', DATABASES['default']['NAME']),
+        "USER": os.environ.get('POSTGRES_REPLICA_USER', DATABASES['default']['USER']),
+        "PASSWORD": os.environ.get('POSTGRES_REPLICA_PASSWORD', DATABASES['default']['PASSWORD']),
+        "HOST": os.environ.get('POSTGRES_REPLICA_HOST', DATABASES['default']['HOST']),
+        "PORT": os.environ.get('POSTGRES_REPLICA_PORT', DATABASES['default']['PORT']),
+        # Tests read the primary's test database through this alias
+        "TEST": {"MIRROR": "default"},
+    }
+
+# Optional shards for tracking data, as "alias=dbname" or "alias=dbname@host:port"
+# pairs (e.g. "shard1=analytics_shard1,shard2=analytics_shard2@10.0.0.5:5432");
+# they share the primary's credentials. API keys are assigned with APIKey.shard.
+ANALYTICS_SHARDS = []
+for _spec in filter(None, os.environ.get('ANALYTICS_SHARD_DATABASES', '').split(',')):
+    _alias, _, _location = _spec.strip().partition('=')
+    _name, _, _address = _location.partition('@')
+    _host, _, _port = _address.partition(':')
+    DATABASES[_alias] = {
+        **DATABASES['default'],
+        "NAME": _name,
+        "HOST": _host or DATABASES['default']['HOST'],
+        "PORT": _port or DATABASES['default']['PORT'],
+    }
+    ANALYTICS_SHARDS.append(_alias)
+
+DATABASE_ROUTERS = ['analytics.routers.ShardRouter', 'analytics.routers.ReplicaRouter']
+
 # ═══════════════════════════════════════════════════════════
 # PASSWORD VALIDATION
 # ═══════════════════════════════════════════════════════════
@@ -165,6 +203,8 @@ CORS_ALLOW_HEADERS = [
     'x-csrftoken',
     'x-requested-with',
     'x-analytics-key',
+    'prefer',  # Prefer: return=minimal, see analytics.api.tracking
+    'content-encoding',  # gzip/deflate request bodies
 ]
 
 # ═══════════════════════════════════════════════════════════
@@ -187,4 +227,195 @@ SIMPLE_JWT = {
     'AUTH_HEADER_TYPES': ('Bearer',),
     'USER_ID_FIELD': 'id',
     'USER_ID_CLAIM': 'user_id',
-}
\ No newline at end of file
+}
+
+# ═══════════════════════════════════════════════════════════
+# ANALYTICS EXPORT SETTINGS
+# ═══════════════════════════════════════════════════════════
+
+# Rows fetched per round-trip by the server-side cursor used for bulk exports
+ANALYTICS_EXPORT_CHUNK_SIZE = int(os.environ.get('ANALYTICS_EXPORT_CHUNK_SIZE', '2000'))
+
+# Output directory for the partitioned Parquet export (manage.py export_parquet)
+ANALYTICS_PARQUET_ROOT = Path(os.environ.get('ANALYTICS_PARQUET_ROOT', BASE_DIR / 'exports' / 'parquet'))
+
+# Compressed files produced by background admin export jobs (manage.py run_export_worker)
+ANALYTICS_EXPORT_JOB_ROOT = Path(os.environ.get('ANALYTICS_EXPORT_JOB_ROOT', BASE_DIR / 'exports' / 'jobs'))
+
+# A running export job whose worker reported no progress for this many
+# seconds is marked failed (the worker crashed or was redeployed)
+ANALYTICS_EXPORT_JOB_TIMEOUT = int(os.environ.get('ANALYTICS_EXPORT_JOB_TIMEOUT', '900'))
+
+# ═══════════════════════════════════════════════════════════
+# EVENT STORAGE SETTINGS
+# ═══════════════════════════════════════════════════════════
+
+# Dictionary entries (event types, categories, page paths) cached per process
+ANALYTICS_DICTIONARY_CACHE_SIZE = int(os.environ.get('ANALYTICS_DICTIONARY_CACHE_SIZE', '100000'))
+
+# Event.metadata keys given their own expression index (manage.py metadata_indexes),
+# e.g. "variant,plan". Frequently filtered keys can instead be promoted to a generated
+# column with analytics.models.promoted_metadata_field.
+ANALYTICS_METADATA_INDEX_KEYS = [
+    key.strip() for key in os.environ.get('ANALYTICS_METADATA_INDEX_KEYS', '').split(',') if key.strip()
+]
+
+# ═══════════════════════════════════════════════════════════
+# DATA RETENTION SETTINGS
+# ═══════════════════════════════════════════════════════════
+
+# Day files of data removed by APIKey.retention_days (manage.py prune_retention)
+ANALYTICS_ARCHIVE_ROOT = Path(os.environ.get('ANALYTICS_ARCHIVE_ROOT', BASE_DIR / 'exports' / 'archive'))
+
+# Rows deleted per statement; each batch commits on its own so locks stay short
+ANALYTICS_RETENTION_BATCH_SIZE = int(os.environ.get('ANALYTICS_RETENTION_BATCH_SIZE', '5000'))
+
+# ═══════════════════════════════════════════════════════════
+# READ REPLICA SETTINGS
+# ═══════════════════════════════════════════════════════════
+
+# Requests under these paths read from DATABASES['replica'] when it is configured
+ANALYTICS_REPLICA_PATH_PREFIXES = ('/api/analytics/',)
+
+# Reads fall back to the primary while the replica is further behind than this
+ANALYTICS_REPLICA_MAX_LAG_SECONDS = float(os.environ.get('ANALYTICS_REPLICA_MAX_LAG_SECONDS', '30'))
+
+# Seconds between replica lag checks, per process
+ANALYTICS_REPLICA_LAG_CHECK_INTERVAL = float(os.environ.get('ANALYTICS_REPLICA_LAG_CHECK_INTERVAL', '5'))
+
+# ═══════════════════════════════════════════════════════════
+# SHARDING SETTINGS
+# ═══════════════════════════════════════════════════════════
+
+# Threads used to query shards in parallel for cross-site reports
+ANALYTICS_SHARD_WORKERS = int(os.environ.get('ANALYTICS_SHARD_WORKERS', '8'))
+
+# Each shard allocates row ids from its own block (shard N starts at N * this),
+# so rows keep their ids when a site is moved between shards
+ANALYTICS_SHARD_ID_BLOCK = int(os.environ.get('ANALYTICS_SHARD_ID_BLOCK', str(10 ** 12)))
+
+# ═══════════════════════════════════════════════════════════
+# METRICS SETTINGS
+# ═══════════════════════════════════════════════════════════
+
+# Per-route latency, status and database metrics, scraped from /metrics.
+# With several gunicorn workers set PROMETHEUS_MULTIPROC_DIR (see gunicorn.conf.py).
+ANALYTICS_METRICS_ENABLED = os.environ.get('ANALYTICS_METRICS_ENABLED', 'True').lower() == 'true'
+
+# /metrics answers requests from these networks, or sending "Authorization: Bearer <ANALYTICS_METRICS_TOKEN>"
+ANALYTICS_METRICS_ALLOWED_NETWORKS = [
+    network.strip()
+    for network in os.environ.get('ANALYTICS_METRICS_ALLOWED_NETWORKS', '127.0.0.1/32,::1/128').split(',')
+    if network.strip()
+]
+ANALYTICS_METRICS_TOKEN = os.environ.get('ANALYTICS_METRICS_TOKEN', '')
+
+# ═══════════════════════════════════════════════════════════
+# PROFILING SETTINGS
+# ═══════════════════════════════════════════════════════════
+
+# Collapsed-stack profiles of single requests, one directory per route (manage.py profiles)
+ANALYTICS_PROFILE_ROOT = Path(os.environ.get('ANALYTICS_PROFILE_ROOT', BASE_DIR / 'exports' / 'profiles'))
+
+# Only views under these paths can be profiled
+ANALYTICS_PROFILE_PATH_PREFIXES = ('/api/',)
+
+# Fraction of requests profiled without being asked (0 disables sampling)
+ANALYTICS_PROFILE_SAMPLE_RATE = float(os.environ.get('ANALYTICS_PROFILE_SAMPLE_RATE', '0'))
+
+# Profiles kept per route; saving one more deletes the oldest
+ANALYTICS_PROFILE_MAX_FILES = int(os.environ.get('ANALYTICS_PROFILE_MAX_FILES', '500'))
+
+# Seconds between stack samples of a profiled request
+ANALYTICS_PROFILE_INTERVAL = float(os.environ.get('ANALYTICS_PROFILE_INTERVAL', '0.001'))
+
+# Lifetime of tokens from `manage.py profiles --token`
+ANALYTICS_PROFILE_TOKEN_MAX_AGE = int(os.environ.get('ANALYTICS_PROFILE_TOKEN_MAX_AGE', '3600'))
+
+# ═══════════════════════════════════════════════════════════
+# SLOW QUERY LOG SETTINGS
+# ═══════════════════════════════════════════════════════════
+
+# Queries slower than this many milliseconds are logged with their plan
+# (admin: Slow Queries); 0 disables the log
+ANALYTICS_SLOW_QUERY_MS = float(os.environ.get('ANALYTICS_SLOW_QUERY_MS', '500'))
+
+# Longest the EXPLAIN ANALYZE re-run of a logged query may take
+ANALYTICS_SLOW_QUERY_EXPLAIN_TIMEOUT_MS = int(os.environ.get('ANALYTICS_SLOW_QUERY_EXPLAIN_TIMEOUT_MS', '10000'))
+
+# ═══════════════════════════════════════════════════════════
+# API SETTINGS
+# ═══════════════════════════════════════════════════════════
+
+# JSON library the API parses request bodies and renders responses with:
+# 'orjson' (faster, same output) or 'json' (the standard library)
+ANALYTICS_API_JSON = os.environ.get('ANALYTICS_API_JSON', 'orjson')
+
+# Most events accepted in one /api/track/batch request
+ANALYTICS_TRACK_BATCH_MAX_EVENTS = int(os.environ.get('ANALYTICS_TRACK_BATCH_MAX_EVENTS', '500'))
+
+# ═══════════════════════════════════════════════════════════
+# TRACKING FAST LANE SETTINGS
+# ═══════════════════════════════════════════════════════════
+
+# Requests under these prefixes only run ANALYTICS_FAST_LANE_MIDDLEWARE after
+# TrackingFastLaneMiddleware (no sessions, CSRF, auth, messages, clickjacking);
+# empty sends everything through MIDDLEWARE
+ANALYTICS_FAST_LANE_PATH_PREFIXES = tuple(
+    prefix.strip() for prefix in os.environ.get('ANALYTICS_FAST_LANE_PATH_PREFIXES', '/api/track/').split(',')
+    if prefix.strip()
+)
+
+ANALYTICS_FAST_LANE_MIDDLEWARE = [
+    'analytics.middleware.SlowQueryMiddleware',
+    "django.middleware.security.SecurityMiddleware",
+    'corsheaders.middleware.CorsMiddleware',
+    'analytics.middleware.ReplicaRoutingMiddleware',  # Scopes the API key's shard to the request
+    'analytics.middleware.ProfilingMiddleware',
+]
+
+# ═══════════════════════════════════════════════════════════
+# ADMIN SETTINGS
+# ═══════════════════════════════════════════════════════════
+
+# Above this many rows admin changelists show the planner's estimate instead of COUNT(*)
+ANALYTICS_ADMIN_EXACT_COUNT_LIMIT = int(os.environ.get('ANALYTICS_ADMIN_EXACT_COUNT_LIMIT', '100000'))
+
+# ═══════════════════════════════════════════════════════════
+# LIVE VISITORS SETTINGS
+# ═══════════════════════════════════════════════════════════
+
+# Minutes a session stays counted by /api/analytics/live after its last
+# tracking request (the most the endpoint can be asked for); 0 turns it off,
+# and the live stream with it
+ANALYTICS_LIVE_WINDOW_MINUTES = int(os.environ.get('ANALYTICS_LIVE_WINDOW_MINUTES', '30'))
+
+# File shared by the workers of a host; in memory under /dev/shm where there is one.
+# Its name gets the sizes below appended, so processes with other sizes keep apart
+ANALYTICS_LIVE_PATH = Path(os.environ.get(
+    'ANALYTICS_LIVE_PATH',
+    '/dev/shm/analytics-live' if os.path.isdir('/dev/shm') else BASE_DIR / 'exports' / 'analytics-live',
+))
+
+# Size of its tables: sessions tracked at once, API keys, pages broken down per API key
+ANALYTICS_LIVE_MAX_SESSIONS = int(os.environ.get('ANALYTICS_LIVE_MAX_SESSIONS', '65536'))
+ANALYTICS_LIVE_MAX_API_KEYS = int(os.environ.get('ANALYTICS_LIVE_MAX_API_KEYS', '256'))
+ANALYTICS_LIVE_PAGES_PER_KEY = int(os.environ.get('ANALYTICS_LIVE_PAGES_PER_KEY', '64'))
+
+# ═══════════════════════════════════════════════════════════
+# LIVE STREAM SETTINGS
+# ═══════════════════════════════════════════════════════════
+
+# Per-second counters kept for /api/analytics/stream, i.e. how far back a
+# client can catch up when it (re)connects; 0 turns the counters off
+ANALYTICS_LIVE_STREAM_SECONDS = int(os.environ.get('ANALYTICS_LIVE_STREAM_SECONDS', '120'))
+
+# Streams end after this many seconds; browsers reconnect by themselves and
+# resume where they were (Last-Event-ID), with a token that is still valid
+ANALYTICS_LIVE_STREAM_MAX_AGE = int(os.environ.get('ANALYTICS_LIVE_STREAM_MAX_AGE', '900'))
+
+# Lifetime of the stream tokens browsers open the stream with (?token=)
+ANALYTICS_LIVE_STREAM_TOKEN_MAX_AGE = int(os.environ.get('ANALYTICS_LIVE_STREAM_TOKEN_MAX_AGE', '60'))
+
+# A client this many seconds behind (not reading) is disconnected
+ANALYTICS_LIVE_STREAM_MAX_BACKLOG = int(os.environ.get('ANALYTICS_LIVE_STREAM_MAX_BACKLOG', '30'))
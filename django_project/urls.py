@@ -14,11 +14,13 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
-from django.contrib import admin
 from django.urls import path
+from analytics import views as analytics_views
 from .api import api
 
 urlpatterns = [
-    path("admin/", admin.site.urls),
+    # Passed by name so the admin (and import_export) loads on the first /admin/ request
+    path("admin/", ('django_project.admin_urls', 'admin', 'admin')),
     path('api/', api.urls),  # All API endpoints under /api/
+    path('metrics', analytics_views.metrics, name='metrics'),  # Prometheus, internal only
 ]
@@ -11,5 +11,16 @@ echo "PostgreSQL started"
 #echo "Running database migrations..."
 #python manage.py migrate --noinput
 
+# Make sure upcoming monthly partitions exist; the analytics_partitions
+# service runs this daily, rows no partition covers meanwhile go to the
+# DEFAULT partition
+python manage.py manage_partitions --months-ahead 3 || echo "Partition maintenance skipped"
+
+# Metrics files are per process and only valid for one run of the server
+if [ -n "$PROMETHEUS_MULTIPROC_DIR" ]; then
+  rm -rf "$PROMETHEUS_MULTIPROC_DIR"
+  mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+fi
+
 # Execute the main command
 exec "$@"
\ No newline at end of file
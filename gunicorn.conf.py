@@ -0,0 +1,25 @@
+# Read by gunicorn from the working directory; command-line flags still win
+import os
+
+
+def when_ready(server):
+    # With --preload the app is imported once in the master and workers are
+    # forked from it: also load what they would load on their first requests
+    if server.cfg.preload_app:
+        from analytics.services.startup import preload
+        preload()
+
+
+def pre_fork(server, worker):
+    # A connection opened in the master would be shared by every worker forked
+    # after it; Django reconnects on its own when one is needed again
+    if server.cfg.preload_app:
+        from django.db import connections
+        connections.close_all()
+
+
+def child_exit(server, worker):
+    # Drop the live gauges of a worker that exited from /metrics (multiprocess mode)
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)